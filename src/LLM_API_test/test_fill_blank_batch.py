@@ -0,0 +1,133 @@
+# Exercises the batched fill-in-the-blank request against a local mock of the
+# OpenAI chat completions endpoint, so no API key or network is needed.
+#
+# The lookups outside the inventory run against an empty database in a
+# temporary directory, never data/db.sqlite3.
+#
+# The mock answers every batch with a valid item for the first requested
+# character, an item using characters outside the database for the second,
+# and nothing for the third. Only the last two should fall back to database
+# phrases, each with its own reason.
+#
+# Run with: python -m pytest LLM_API_test/test_fill_blank_batch.py (from src)
+# or:       python LLM_API_test/test_fill_blank_batch.py
+
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from data import database, migrate  # noqa: E402
+from logic import LLM_fill_blank as fill_blank  # noqa: E402
+
+# globals
+
+KANA = "ですのはにをがかきくけこ"
+PHRASES = [
+    (1, "日本人です", "I am Japanese"),
+    (2, "大学生です", "I am a student"),
+    (3, "先生のです", "It is the teacher's"),
+]
+
+
+class _MockChatHandler(BaseHTTPRequestHandler):
+    """Answers POST /v1/chat/completions with a canned exercise batch built
+    from the answer characters named in the prompt"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["messages"][0]["content"]
+        answers = re.search(r"in this order: (\S+)", prompt).group(1)
+
+        exercises = [
+            {"sentence": f"{answers[0]}です", "answer": answers[0],
+             "english_meaning": "valid", "hint": "valid hint"},
+            {"sentence": f"{answers[1]}xyz", "answer": answers[1],
+             "english_meaning": "invalid", "hint": "uses romaji"},
+        ]
+        payload = {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps({"exercises": exercises})},
+                "finish_reason": "stop",
+            }],
+        }
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _mock_inventory():
+    """An inventory holding only the characters and phrases above"""
+    inventory = fill_blank._InventoryIndex()
+    inventory._loaded = True
+    for ch in KANA:
+        inventory._add_char(ch, inventory.kana_chars)
+    for ch in "日本人大学生先":
+        inventory._add_char(ch, inventory.kanji_chars)
+    for card_id, text, meaning in PHRASES:
+        inventory._add_phrase(card_id, text, None, meaning, None)
+    return inventory
+
+
+def test_batch_falls_back_only_for_bad_items():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MockChatHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    saved_env = {k: os.environ.get(k) for k in ("OPENAI_API_KEY", "OPENAI_BASE_URL")}
+    saved_inventory = fill_blank._inventory
+    saved_db = (database._db_path, database._backup_dir)
+    tmp_dir = tempfile.TemporaryDirectory()
+    database.use_database(os.path.join(tmp_dir.name, "db.sqlite3"))
+    migrate()
+    os.environ["OPENAI_API_KEY"] = "mock-key"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    fill_blank._inventory = _mock_inventory()
+    try:
+        result = fill_blank.generate_fill_blank_exercises(3)
+    finally:
+        fill_blank._inventory = saved_inventory
+        database.use_database(*saved_db)
+        tmp_dir.cleanup()
+        for k, v in saved_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        server.shutdown()
+        server.server_close()
+
+    assert len(result) == 3
+    assert len({e.answer for e in result}) == 3
+
+    valid, invalid, missing = result
+    assert valid.source.startswith("OpenAI")
+    assert valid.sentence == f"{valid.answer}です"
+    assert valid.blanked_sentence == f"{fill_blank.BLANK_CHAR}です"
+
+    assert invalid.source == "Database fallback (rejected by validation)"
+    assert missing.source == "Database fallback (missing from batch)"
+    for exercise in (invalid, missing):
+        assert exercise.answer in exercise.sentence
+        assert exercise.sentence in {text for _, text, _ in PHRASES}
+
+
+if __name__ == "__main__":
+    test_batch_falls_back_only_for_bad_items()
+    print("ok")
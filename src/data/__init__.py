@@ -1,10 +1,13 @@
+from .migrations import migrate
 from .card import Card, CardRelation
 from .kana_card import KanaCard
 from .kanji_card import KanjiCard
 from .phrase_card import PhraseCard
 from .drawing import Drawing
-from .database import maybe_connection, maybe_connection_commit
+from .database import maybe_connection, maybe_connection_commit, read_connection, pool_statistics
 from .derive_card import derive_card_type
+from .unit_of_work import UnitOfWork
+from .glyph_index import GlyphIndex, GlyphEntry
 from .helpers import *
 from .queries import *
 __all__ = [
@@ -14,8 +17,13 @@ __all__ = [
     "PhraseCard",
     "Drawing",
     "CardRelation",
+    "UnitOfWork",
+    "GlyphIndex",
+    "GlyphEntry",
     "maybe_connection",
     "maybe_connection_commit",
+    "read_connection",
+    "pool_statistics",
     'derive_card_type',
     'query_learnable_card_ids',
     'query_reviewable_card_ids',
@@ -26,6 +34,17 @@ __all__ = [
     'query_learnable_phrase_cards',
     'query_reviewable_phrase_cards',
     'is_kana',
-    'is_kanji'
+    'is_kanji',
+    'has_kana',
+    'has_kanji',
+    'first_kanji',
+    'kana_in',
+    'kanji_in',
+    'japanese_in',
+    'glyph_sets',
+    'char_mask',
+    'char_masks',
+    'set_kanji_ranges',
+    'migrate'
 
 ]
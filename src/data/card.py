@@ -8,16 +8,18 @@
 ################################################################################
 
 from __future__ import annotations
-from typing import Mapping
+from typing import Callable, Iterable, Mapping
 import sqlalchemy as sqla
 from datetime import date
 from .database import (card_table,
                        card_relation_table,
                        maybe_connection,
                        maybe_connection_commit,
+                       IN_CLAUSE_BATCH,
                        KANA_CARD_KIND,
                        KANJI_CARD_KIND,
                        PHRASE_CARD_KIND)
+from .unit_of_work import UnitOfWork, register_wrapper
 
 ################################################################################
 # Class Definition
@@ -30,8 +32,20 @@ class CardRelation:
     _searched_db_a_id: dict[int, bool] = {}
     _searched_db_b_id: dict[int, bool] = {}
     _searched_db: bool = False
+    # Temporary ids count down from here, so creating one never scans the cache
+    _next_temp_id: int = 0
+    # Unsynced relations by each of their cards, read when a card is saved. The
+    # inner dicts are ordered sets.
+    _pending: dict[Card, dict[CardRelation, None]] = {}
+    _sync_listeners: list[Callable[[CardRelation], None]] = []
     
     # Class Methods ############################################################
+
+    @classmethod
+    def add_sync_listener(cls, fn: Callable[[CardRelation], None]):
+        '''Registers a function called with the relation every time it is synced'''
+        cls._sync_listeners.append(fn)
+
     @classmethod
     def _encache(cls, cr: CardRelation):
         assert cr._db_id not in cls._instances_by_id
@@ -70,16 +84,37 @@ class CardRelation:
         if card_a.id == card_b.id or card_a == card_b:
             raise ValueError('Invalid ids: a card cannot be related to itself')
     
-        new_id = min(cls._instances_by_id, default=1) -1
-        if new_id > 0:
-            new_id = 0
-        
+        new_id = cls._next_temp_id
+        cls._next_temp_id -= 1
             
         obj = cls(new_id, card_a, card_b, b_is_prereq, easily_confused, False)
         cls._encache(obj)
+        obj._mark_pending()
         return obj
 
 
+    @classmethod
+    def _create_many(cls,
+                     pairs: Iterable[tuple[Card, Card]],
+                     b_is_prereq: bool,
+                     easily_confused: bool) -> list[CardRelation]:
+        '''Creates one relation per (card_a, card_b) pair without looking for
+        existing relations between them, so card_a should be a new card'''
+        pairs = list(pairs)
+        for card_a, card_b in pairs:
+            if card_a.id == card_b.id or card_a == card_b:
+                raise ValueError('Invalid ids: a card cannot be related to itself')
+
+        start = cls._next_temp_id
+        cls._next_temp_id -= len(pairs)
+        objs = [cls(start - i, card_a, card_b, b_is_prereq, easily_confused, False)
+                for i, (card_a, card_b) in enumerate(pairs)]
+        for obj in objs:
+            cls._encache(obj)
+            obj._mark_pending()
+        return objs
+
+
     @classmethod
     def _load_from_db(cls, con: sqla.Connection | None = None):
         if cls._searched_db:
@@ -139,8 +174,10 @@ class CardRelation:
                     d[obj.id] = obj
             cls._searched_db_a_id[a_id] = True
 
-        for r in [r for k, r in cls._instances_by_id.items() if k < 1]:
-            if r._card_a.id == a_id:
+        # Relations not yet saved are all pending on both of their cards
+        card = Card._id_cache.get(a_id)
+        for r in cls._pending.get(card, ()) if card is not None else ():
+            if r._db_id < 1 and r._card_a is card:
                 d[r.id] = r
         
         return d
@@ -160,8 +197,9 @@ class CardRelation:
                     d[obj.id] = obj
             cls._searched_db_b_id[b_id] = True
 
-        for r in [r for k, r in cls._instances_by_id.items() if k < 1]:
-            if r._card_b.id == b_id:
+        card = Card._id_cache.get(b_id)
+        for r in cls._pending.get(card, ()) if card is not None else ():
+            if r._db_id < 1 and r._card_b is card:
                 d[r.id] = r
                 
         return d
@@ -210,6 +248,8 @@ class CardRelation:
         self._b_is_prereq = b_is_prereq
         self._easily_confused = easily_confused
         self._synced = synced
+        # card_a's unlocked flag needs recomputing once this is saved
+        self._prereq_changed = not synced
 
     # Properties ###############################################################
 
@@ -243,17 +283,20 @@ class CardRelation:
             return
         self._b_is_prereq = b
         self._synced = False
+        self._prereq_changed = True
+        self._mark_pending()
 
     @property
     def easily_confused(self) -> bool:
         return self._easily_confused
 
     @easily_confused.setter
-    def easly_confused(self, b: bool):
+    def easily_confused(self, b: bool):
         if b == self._easily_confused:
             return
         self._easily_confused = b
         self._synced = False
+        self._mark_pending()
         
     @property
     def synced(self) -> bool:
@@ -261,46 +304,47 @@ class CardRelation:
 
     # Methods ##################################################################
 
-    def sync(self, con: sqla.Connection | None = None) -> int:
-        # Ignore reduntant syncs
-        if self.synced:
-            return self._db_id
+    def _mark_pending(self):
+        for c in (self._card_a, self._card_b):
+            CardRelation._pending.setdefault(c, {})[self] = None
 
-        with maybe_connection_commit(con) as con:
-            
-            if self._db_id > 0:
-                # These should never fail
-                assert self._card_a.id > 0
-                assert self._card_b.id > 0
-                
-                res = con.execute(
-                    sqla.update(card_relation_table)
-                    .where(card_relation_table.c.id == self._db_id)
-                    .returning(card_relation_table.c.id)
-                    .values(b_is_prereq=self._b_is_prereq,
-                            easily_confused=self._easily_confused))
-                _ = res.scalar_one()
-            else:
-                CardRelation._decache(self)
-                if self._card_a.id < 1:
-                    self._card_a._sync_only_self(con)
-                if self._card_b.id < 1:
-                    self._card_b._sync_only_self(con)
-                    
-                res = con.execute(
-                    sqla.insert(card_relation_table)
-                    .returning(card_relation_table.c.id)
-                    .values(card_a_id=self._card_a.id,
-                            card_b_id=self._card_b.id,
-                            b_is_prereq=self._b_is_prereq,
-                            easily_confused=self._easily_confused))
-                self._db_id = res.scalar_one()
-                CardRelation._encache(self)
-
-        self._synced = True
+
+    def _unmark_pending(self):
+        '''Called once the relation is saved'''
+        for c in (self._card_a, self._card_b):
+            pending = CardRelation._pending.get(c)
+            if pending is not None:
+                pending.pop(self, None)
+                if not pending:
+                    del CardRelation._pending[c]
+
+
+    def _flush_dependencies(self) -> list:
+        return [c for c in (self._card_a, self._card_b) if not c.synced]
+
+
+    def _flush_row(self, inserting: bool, new_ids: dict) -> dict:
+        row = {'b_is_prereq': self._b_is_prereq,
+               'easily_confused': self._easily_confused}
+        if inserting:
+            row['card_a_id'] = self._card_a.id
+            row['card_b_id'] = self._card_b.id
+        return row
+
+
+    def sync(self, con: sqla.Connection | None = None) -> int:
+        UnitOfWork([self]).flush(con)
         return self._db_id
 
 
+    @staticmethod
+    def _after_flush(con: sqla.Connection, relations: list[CardRelation]):
+        changed = [r for r in relations if r._prereq_changed]
+        if changed:
+            Card._refresh_unlocked(con, [r.card_a for r in changed], [])
+        for r in changed:
+            r._prereq_changed = False
+
 
 
 
@@ -322,9 +366,17 @@ class Card:
 
     _id_cache: dict[int, Card] = {}
     _searched_db: bool = False
+    _next_temp_id: int = 0
+    _sync_listeners: list[Callable[[Card], None]] = []
 
     # Class Methods ############################################################
 
+    @classmethod
+    def add_sync_listener(cls, fn: Callable[[Card], None]):
+        '''Registers a function called with the card every time it is synced'''
+        cls._sync_listeners.append(fn)
+
+
     @classmethod
     def _encache(cls, kc: Card):
         assert kc._db_id not in cls._id_cache
@@ -356,7 +408,8 @@ class Card:
                    int(m['due_date_increment']),
                    due_date,
                    str(m['tags']),
-                   True)
+                   True,
+                   bool(m['unlocked']))
         cls._encache(obj)
         
         return obj
@@ -379,10 +432,8 @@ class Card:
         if due_date is None:
             due_date = date.today()
 
-        # Find new minimum id
-        new_id = min(cls._id_cache, default=1) - 1
-        if new_id > 0:
-            new_id = 0
+        new_id = cls._next_temp_id
+        cls._next_temp_id -= 1
         
         # Instantiate and cache
         obj = cls(new_id, study_id, kind, due_date_increment, due_date, tags, False)
@@ -391,6 +442,20 @@ class Card:
         return obj
 
 
+    @classmethod
+    def _create_many(cls, kind: str, count: int) -> list[Card]:
+        '''count new cards of kind with the defaults of _create'''
+        if kind != KANA_CARD_KIND and kind != KANJI_CARD_KIND and kind != PHRASE_CARD_KIND:
+            raise ValueError(f"Invalid kind argument '{kind}': must be {KANA_CARD_KIND}, {KANJI_CARD_KIND}, or {PHRASE_CARD_KIND}")
+        today = date.today()
+        start = cls._next_temp_id
+        cls._next_temp_id -= count
+        objs = [cls(start - i, -1, kind, 0, today, None, False) for i in range(count)]
+        for obj in objs:
+            cls._encache(obj)
+        return objs
+
+
     @classmethod
     def _load_from_db(cls, con: sqla.Connection | None = None):
         if cls._searched_db:
@@ -435,6 +500,94 @@ class Card:
                 obj = cls._create_from_mapping(res)
             
         return obj
+
+
+    @classmethod
+    def by_ids(cls, ids: Iterable[int], con: sqla.Connection | None = None) -> dict[int, Card]:
+        '''The cards of every id found, reading those not cached with one
+        query per IN_CLAUSE_BATCH ids'''
+        found = {}
+        missing = []
+        for id in set(ids):
+            obj = cls._id_cache.get(id)
+            if obj is not None:
+                found[id] = obj
+            elif id > 0 and not cls._searched_db:
+                missing.append(id)
+
+        if missing:
+            with maybe_connection(con) as con2:
+                for i in range(0, len(missing), IN_CLAUSE_BATCH):
+                    stmnt = sqla.select(card_table)\
+                                .where(card_table.c.id.in_(missing[i:i + IN_CLAUSE_BATCH]))
+                    for row in con2.execute(stmnt).mappings():
+                        obj = cls._create_from_mapping(row)
+                        found[obj.id] = obj
+        return found
+
+
+    @staticmethod
+    def _unlocked_clause() -> sqla.ColumnElement[bool]:
+        '''True for a row of card_table with no unstudied prerequisite; what
+        cards.unlocked stores'''
+        R = card_relation_table
+        B = card_table.alias('B')
+        return ~sqla.exists(
+            sqla.select(1)
+            .select_from(R.join(B, R.c.card_b_id == B.c.id))
+            .where(R.c.b_is_prereq == True)
+            .where(R.c.card_a_id == card_table.c.id)
+            .where(B.c.study_id < 1))
+
+
+    @classmethod
+    def _refresh_unlocked(cls, con: sqla.Connection, cards: list[Card], prereq_ids: list[int]):
+        '''Recomputes cards.unlocked for cards and for every card with one of
+        prereq_ids as a prerequisite, updating the cached cards to match.
+        Cards just inserted are not in _id_cache until the save finishes, so
+        they are looked up in cards as well.'''
+        R = card_relation_table
+        known = {c.id: c for c in cards}
+        card_ids = sorted(known)
+        prereq_ids = sorted(set(prereq_ids))
+        for i in range(0, max(len(card_ids), len(prereq_ids)), IN_CLAUSE_BATCH):
+            conditions = []
+            if card_ids[i:i + IN_CLAUSE_BATCH]:
+                conditions.append(card_table.c.id.in_(card_ids[i:i + IN_CLAUSE_BATCH]))
+            if prereq_ids[i:i + IN_CLAUSE_BATCH]:
+                dependents = sqla.select(R.c.card_a_id)\
+                                 .where(R.c.b_is_prereq == True)\
+                                 .where(R.c.card_b_id.in_(prereq_ids[i:i + IN_CLAUSE_BATCH]))
+                conditions.append(card_table.c.id.in_(dependents))
+            stmnt = sqla.update(card_table)\
+                        .where(sqla.or_(*conditions))\
+                        .values(unlocked=cls._unlocked_clause())\
+                        .returning(card_table.c.id, card_table.c.unlocked)
+            for id, unlocked in con.execute(stmnt):
+                obj = known.get(id) or cls._id_cache.get(id)
+                if obj is not None:
+                    obj._unlocked = bool(unlocked)
+
+
+    @classmethod
+    def check_unlocked(cls, repair: bool = True, con: sqla.Connection | None = None) -> int:
+        '''Returns the number of cards whose stored unlocked flag disagrees
+        with their prerequisites, rewriting those when repair is set'''
+        stale = card_table.c.unlocked != cls._unlocked_clause()
+        with maybe_connection_commit(con) as con:
+            if not repair:
+                stmnt = sqla.select(sqla.func.count()).select_from(card_table).where(stale)
+                return con.execute(stmnt).scalar_one()
+            stmnt = sqla.update(card_table)\
+                        .where(stale)\
+                        .values(unlocked=cls._unlocked_clause())\
+                        .returning(card_table.c.id, card_table.c.unlocked)
+            rows = con.execute(stmnt).all()
+        for id, unlocked in rows:
+            obj = cls._id_cache.get(id)
+            if obj is not None:
+                obj._unlocked = bool(unlocked)
+        return len(rows)
     
     # Constructor ##############################################################
 
@@ -445,7 +598,8 @@ class Card:
                  due_date_increment: int,
                  due_date: date,
                  tags: str | None,
-                 synced: bool):
+                 synced: bool,
+                 unlocked: bool = False):
         self._db_id = db_id
         self._study_id = study_id
         self._kind = kind
@@ -453,6 +607,11 @@ class Card:
         self._due_date = due_date
         self._tags = tags
         self._synced = synced
+        self._unlocked = unlocked
+        # Whether this card's unlocked flag, or that of the cards it is a
+        # prerequisite of, needs recomputing once this is saved
+        self._unlock_stale = not synced
+        self._study_crossed = False
 
     # Properties ###############################################################
 
@@ -473,6 +632,8 @@ class Card:
     def study_id(self, id: int):
         if id == self._study_id:
             return
+        if (id > 0) != (self._study_id > 0):
+            self._study_crossed = True
         self._study_id = id
         self._synced = False
     
@@ -503,6 +664,12 @@ class Card:
         self._synced = False
         
 
+    @property
+    def unlocked(self) -> bool:
+        '''Whether every prerequisite has been studied, as last saved'''
+        return self._unlocked
+
+
     @property
     def tags(self) -> str:
         if self._tags is None:
@@ -580,16 +747,17 @@ class Card:
             return CardRelation._create(self, c, True, False)
     
 
-    def add_easily_confused(self, c: Card):
+    def add_easily_confused(self, c: Card) -> CardRelation:
+        assert isinstance(c, Card)
         # Check to see that this relationship already exists
         r = CardRelation.specifc_relation(self.id, c.id)
-        if r is not None and r.b_is_prereq:
+        if r is not None and r.easily_confused:
             return r
         elif r is not None:
-            r.b_is_prereq = True
+            r.easily_confused = True
             return r
         else:
-            return CardRelation._create(self, c, True, False)
+            return CardRelation._create(self, c, False, True)
     
 
     def clear_tags(self):
@@ -606,6 +774,7 @@ class Card:
             self._tags = t
         else:
             self._tags = self._tags + f',{t}'
+        self._synced = False
 
 
     def remove_tag(self, t: str):
@@ -618,43 +787,51 @@ class Card:
             self._synced = False
 
 
-    def _sync_only_self(self, con: sqla.Connection | None = None) -> int:
-        with maybe_connection_commit(con) as con:
-            # Ignore reduntant syncs
-            if self.synced:
-                pass
-            # If updating
-            elif self._db_id > 0:
-                res = con.execute(
-                    sqla.update(card_table)\
-                        .where(card_table.c.id == self._db_id)\
-                        .returning(card_table.c.id)\
-                        .values(due_date=self._due_date,
-                                due_date_increment=self._due_date_increment,
-                                tags=self._tags,
-                                study_id=self._study_id))
-                _ = res.scalar_one()
-            # If inserting
-            else:
-                Card._decache(self)
-                res = con.execute(
-                    sqla.insert(card_table)\
-                        .returning(card_table.c.id)\
-                        .values(study_id=self._study_id,
-                                kind=self._kind,
-                                due_date_increment=self._due_date_increment,
-                                due_date=self._due_date,
-                                tags=self._tags))
-                self._db_id = res.scalar_one()
-                Card._encache(self)
-        self._synced = True
-        return self._db_id
-        
+    def _flush_dependencies(self) -> list:
+        '''The unsynced relations of this card'''
+        return [r for r in CardRelation._pending.get(self, ()) if not r.synced]
+
+
+    def _flush_row(self, inserting: bool, new_ids: dict) -> dict:
+        row = {'study_id': self._study_id,
+               'due_date_increment': self._due_date_increment,
+               'due_date': self._due_date,
+               'tags': self._tags}
+        if inserting:
+            row['kind'] = self._kind
+        return row
+
 
     def sync(self, con: sqla.Connection | None = None) -> int:
-        with maybe_connection_commit(con) as con:
-            for r in self.relations:
-                if not r.synced:
-                    r.sync(con=con)
-            self._sync_only_self(con)
+        '''Saves the card and its unsynced relations (see UnitOfWork)'''
+        UnitOfWork([self]).flush(con)
         return self._db_id
+
+
+    @staticmethod
+    def _after_flush(con: sqla.Connection, cards: list[Card]):
+        stale = [c for c in cards if c._unlock_stale]
+        crossed = [c.id for c in cards if c._study_crossed]
+        if stale or crossed:
+            Card._refresh_unlocked(con, stale, crossed)
+        for c in cards:
+            c._unlock_stale = False
+            c._study_crossed = False
+
+
+
+register_wrapper(Card,
+                 card_table,
+                 0,
+                 Card._decache,
+                 Card._encache,
+                 Card._sync_listeners,
+                 Card._after_flush)
+register_wrapper(CardRelation,
+                 card_relation_table,
+                 1,
+                 CardRelation._decache,
+                 CardRelation._encache,
+                 CardRelation._sync_listeners,
+                 CardRelation._after_flush)
+CardRelation.add_sync_listener(CardRelation._unmark_pending)
@@ -11,9 +11,13 @@
 # Allows me to make recursively defined classes with pyright
 from __future__ import annotations
 import os
+import pickle
+import threading
+import numpy as np
 import sqlalchemy as sqla
 from sqlalchemy import event
 from contextlib import contextmanager
+from logic.stroke_set import StrokeSet
 
 ################################################################################
 # Globals
@@ -23,26 +27,93 @@ KANA_CARD_KIND = 'kana'
 KANJI_CARD_KIND = 'kanji'
 PHRASE_CARD_KIND = 'phrase'
 
+# Most values bound into one IN (...) list by the batch lookups
+IN_CLAUSE_BATCH = 500
+
 ################################################################################
 # Database Objects
 ################################################################################
 
 _db_path = os.path.join(os.path.dirname(__file__), "db.sqlite3")
-_engine = sqla.create_engine(f'sqlite+pysqlite:///{_db_path}', echo=True)
+_backup_dir = os.path.join(os.path.dirname(__file__), "db_backups")
 _metadata = sqla.MetaData()
 
 @event.listens_for(sqla.engine.Engine, "connect")
 def enable_foreign_keys(dbapi_con, con_record):
     dbapi_con.execute("PRAGMA foreign_keys=ON;")
 
+def enable_wal(dbapi_con, con_record):
+    # Lets the read only connections keep reading while the GUI commits
+    dbapi_con.execute("PRAGMA journal_mode=WAL;")
+
+def _count_read_checkout(dbapi_con, con_record, con_proxy):
+    _pool_stats['read_checkouts'] += 1
+
+def _create_engines(db_path: str) -> tuple[sqla.Engine, sqla.Engine]:
+    engine = sqla.create_engine(f'sqlite+pysqlite:///{db_path}', echo=True)
+    # Read only connections for worker threads, see maybe_connection
+    read_engine = sqla.create_engine(f'sqlite+pysqlite:///file:{db_path}?mode=ro&uri=true',
+                                     echo=True,
+                                     pool_size=4,
+                                     max_overflow=4)
+    event.listen(engine, "connect", enable_wal)
+    event.listen(read_engine.pool, "checkout", _count_read_checkout)
+    return engine, read_engine
+
+_engine, _read_engine = _create_engines(_db_path)
+
+class PackedStrokes(sqla.types.TypeDecorator):
+    '''Stores [[x0, y0, x1, y1, ...], ...] (or a StrokeSet) as a 'KST1' header, the stroke
+    count and per stroke point counts as little endian uint32, then every
+    point as little endian float32. Values written before the strokes
+    migration are pickled lists and are still read.'''
+    impl = sqla.LargeBinary
+    cache_ok = True
+    MAGIC = b'KST1'
+
+    @classmethod
+    def encode(cls, strokes) -> bytes:
+        if isinstance(strokes, StrokeSet):
+            lengths = np.diff(strokes.offsets).astype('<u4')
+            points = strokes.points.astype('<f4')
+        else:
+            lengths = np.array([len(s) // 2 for s in strokes], dtype='<u4')
+            if lengths.sum() == 0:
+                points = np.empty(0, dtype='<f4')
+            else:
+                points = np.concatenate([np.asarray(s, dtype='<f4').reshape(-1) for s in strokes])
+        header = np.array([lengths.size], dtype='<u4')
+        return cls.MAGIC + header.tobytes() + lengths.tobytes() + points.tobytes()
+
+    @classmethod
+    def decode(cls, value: bytes) -> list[list[float]]:
+        if not value.startswith(cls.MAGIC):
+            return pickle.loads(value)
+        count = int(np.frombuffer(value, dtype='<u4', count=1, offset=4)[0])
+        lengths = np.frombuffer(value, dtype='<u4', count=count, offset=8)
+        flat = np.frombuffer(value, dtype='<f4', offset=8 + 4 * count).tolist()
+        ends = np.cumsum(2 * lengths.astype(np.intp)).tolist()
+        return [flat[a:b] for a, b in zip([0] + ends[:-1], ends)]
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return self.encode(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.decode(value)
+
 drawing_table = sqla.Table(
     'drawings',
     _metadata,
     sqla.Column('id', sqla.Integer, primary_key=True, nullable=False),
     sqla.Column('stroke_count', sqla.Integer, unique=False, nullable=False),
-    sqla.Column('strokes', sqla.PickleType, unique=False, nullable=False),
+    sqla.Column('strokes', PackedStrokes, unique=False, nullable=False),
     sqla.Column('glyph', sqla.String, unique=False, nullable=True),
-    sqla.Index('ix_drawings_stroke_count', 'stroke_count'))
+    sqla.Index('ix_drawings_stroke_count', 'stroke_count'),
+    sqla.Index('ix_drawings_glyph', 'glyph'))
 
 card_table = sqla.Table(
     'cards',
@@ -53,7 +124,11 @@ card_table = sqla.Table(
     sqla.Column('due_date', sqla.Date, nullable=False),
     sqla.Column('tags', sqla.String, nullable=True),
     sqla.Column('kind', sqla.String, nullable=True),
-    sqla.Index('ix_cards_study_id', 'study_id'))
+    # No prerequisite of the card is unstudied, kept current by Card (see
+    # Card._refresh_unlocked)
+    sqla.Column('unlocked', sqla.Boolean, nullable=False, server_default=sqla.false()),
+    sqla.Index('ix_cards_study_id', 'study_id'),
+    sqla.Index('ix_cards_kind_unlocked_study', 'kind', 'unlocked', 'study_id'))
 
 card_relation_table = sqla.Table(
     'card_relation',
@@ -99,43 +174,181 @@ phrase_card_table = sqla.Table(
     sqla.Column('grammar', sqla.String, nullable=True),
     sqla.Index('ix_phrase_cards_card_id', 'card_id'))
 
-# Construct the database
-_metadata.create_all(_engine)
+glyph_confusable_table = sqla.Table(
+    'glyph_confusables',
+    _metadata,
+    sqla.Column('id', sqla.Integer, primary_key=True, nullable=False),
+    sqla.Column('glyph', sqla.String, nullable=False),
+    sqla.Column('neighbor_glyph', sqla.String, nullable=False),
+    sqla.Column('rank', sqla.Integer, nullable=False),
+    sqla.Column('distance', sqla.Float, nullable=False),
+    sqla.Index('ix_glyph_confusables_glyph', 'glyph'))
+
+# What the glyph_confusables rows of each stroke count were computed from.
+# A bucket without a row, or whose templates no longer match it, has changed
+# since and its rows are not trusted.
+glyph_confusable_bucket_table = sqla.Table(
+    'glyph_confusable_buckets',
+    _metadata,
+    sqla.Column('stroke_count', sqla.Integer, primary_key=True, nullable=False),
+    sqla.Column('template_count', sqla.Integer, nullable=False),
+    sqla.Column('max_drawing_id', sqla.Integer, nullable=False))
+
+# The schema is created and upgraded by data.migrations
 
 ################################################################################
 # Helper Functions
 ################################################################################
 
+# The connection the GUI thread reuses for every query it makes, opened on
+# first use. _gui_depth counts the maybe_connection blocks open on it so only
+# the outermost one ends the transaction.
+_gui_con: sqla.Connection | None = None
+_gui_depth = 0
+_gui_commit_pending = False
+
+_pool_stats = {
+    'gui_connects': 0,
+    'gui_reads': 0,
+    'gui_commits': 0,
+    'read_checkouts': 0,
+    'worker_writes': 0,
+}
+
+def _on_gui_thread() -> bool:
+    return threading.current_thread() is threading.main_thread()
+
+
+def _begin_savepoint(con: sqla.Connection) -> sqla.NestedTransaction:
+    # pysqlite only sends BEGIN before a write, and a SAVEPOINT opened
+    # outside a transaction is committed by its own RELEASE, so make sure the
+    # outer transaction has really begun first
+    if not con.connection.driver_connection.in_transaction:
+        con.exec_driver_sql('BEGIN')
+    return con.begin_nested()
+
+
 @contextmanager
-def maybe_connection(con: sqla.Connection | None):
-    '''Function used for 'where' clauses where the caller may want to reuse a
-    pre-existing connection.'''
-    owns_con = con is None
-    if owns_con:
-        con = _engine.connect()
+def _gui_connection(commit: bool):
+    '''Yields the long lived GUI thread connection. Nested blocks join the
+    transaction of the outermost one, which commits if any block asked to and
+    rolls back otherwise, so a read never holds its snapshot open. A nested
+    block that commits runs in a savepoint, so if it raises only its own
+    writes are undone, even when an outer block catches the exception and
+    goes on to commit.'''
+    global _gui_con, _gui_depth, _gui_commit_pending
+    if _gui_con is None or _gui_con.closed or _gui_con.invalidated:
+        _gui_con = _engine.connect()
+        _pool_stats['gui_connects'] += 1
+    con = _gui_con
+    outermost = _gui_depth == 0
+    savepoint = None
+    if commit and not outermost:
+        savepoint = _begin_savepoint(con)
+    _gui_depth += 1
+    _gui_commit_pending = _gui_commit_pending or commit
     try:
         yield con
+    except Exception:
+        if savepoint is not None:
+            savepoint.rollback()
+        if outermost:
+            _gui_commit_pending = False
+            con.rollback()
+        raise
+    else:
+        if savepoint is not None:
+            savepoint.commit()
+        if outermost:
+            if _gui_commit_pending:
+                _gui_commit_pending = False
+                con.commit()
+                _pool_stats['gui_commits'] += 1
+            else:
+                con.rollback()
+                _pool_stats['gui_reads'] += 1
     finally:
-        if owns_con:
-            con.close()
+        _gui_depth -= 1
+
+
+def close_gui_connection() -> None:
+    global _gui_con
+    if _gui_con is not None and _gui_depth == 0:
+        _gui_con.close()
+        _gui_con = None
+
+
+def use_database(db_path: str, backup_dir: str | None = None) -> None:
+    '''Points every connection at the database file at db_path instead of
+    data/db.sqlite3, for tests and scripts working on a copy. Call it before
+    the first query and follow it with migrate(); rows the wrappers already
+    cached from the old database are not cleared.'''
+    global _db_path, _backup_dir, _engine, _read_engine
+    if _gui_depth:
+        raise RuntimeError('Cannot switch databases inside a maybe_connection block')
+    close_gui_connection()
+    _engine.dispose()
+    _read_engine.dispose()
+    _db_path = db_path
+    _backup_dir = backup_dir or os.path.join(os.path.dirname(db_path), "db_backups")
+    _engine, _read_engine = _create_engines(db_path)
+
+
+def pool_statistics() -> dict[str, int | str]:
+    '''Counters for the connection policy plus the read pool's own status'''
+    stats: dict[str, int | str] = dict(_pool_stats)
+    pool = _read_engine.pool
+    assert isinstance(pool, sqla.pool.QueuePool)
+    stats['read_pool_checked_out'] = pool.checkedout()
+    stats['read_pool_idle'] = pool.checkedin()
+    stats['read_pool_status'] = pool.status()
+    return stats
+
+
+@contextmanager
+def read_connection():
+    '''A pooled read only connection, safe to use from any thread'''
+    with _read_engine.connect() as con:
+        yield con
+
+
+@contextmanager
+def maybe_connection(con: sqla.Connection | None):
+    '''Function used for 'where' clauses where the caller may want to reuse a
+    pre-existing connection. Without one, the GUI thread reuses its long lived
+    connection and any other thread borrows a read only pooled connection.'''
+    if con is not None:
+        yield con
+    elif _on_gui_thread():
+        with _gui_connection(False) as con:
+            yield con
+    else:
+        with read_connection() as con:
+            yield con
 
 
 @contextmanager
 def maybe_connection_commit(con: sqla.Connection | None):
     '''Function used for 'where' clauses where the caller may want to reuse a
-    pre-existing connection. Will always commit if it owns the connection.'''
-    owns_con = con is None
-    if owns_con:
-        con = _engine.connect()
+    pre-existing connection. Will always commit if it owns the connection.
+    Without one, the GUI thread reuses its long lived connection and any other
+    thread opens a writable connection of its own.'''
+    if con is not None:
+        yield con
+        return
+    if _on_gui_thread():
+        with _gui_connection(True) as con:
+            yield con
+        return
+
+    con = _engine.connect()
+    _pool_stats['worker_writes'] += 1
     try:
         yield con
     except Exception:
-        if owns_con:
-            con.rollback()
+        con.rollback()
         raise
     else:
-        if owns_con:
-            con.commit()
+        con.commit()
     finally:
-        if owns_con:
-            con.close()
+        con.close()
@@ -7,15 +7,34 @@
 ################################################################################
 
 from __future__ import annotations
-from typing import Mapping
+import time
+from dataclasses import dataclass
+from typing import Callable, Mapping
+import numpy as np
+from numpy.typing import NDArray
 import sqlalchemy as sqla
-from .database import _engine, drawing_table, maybe_connection, maybe_connection_commit
+from .database import drawing_table, glyph_confusable_table, glyph_confusable_bucket_table, maybe_connection
+from .unit_of_work import UnitOfWork, register_wrapper
 from logic import drawing_utils as du
+from logic.stroke_set import StrokeSet
 
 ################################################################################
 # Class Definition
 ################################################################################
 
+@dataclass(slots=True)
+class BucketStatistics:
+    '''One stroke count bucket of the template store (see Drawing.bucket_statistics)'''
+    stroke_count: int
+    templates: int
+    glyphs: int
+    loaded: bool
+    prototypes: int | None
+    matches: int
+    mean_match_ms: float | None
+
+
+
 class Drawing:
     # Class Variable ###########################################################
 
@@ -25,9 +44,29 @@ class Drawing:
     _stroke_count_groups: dict[int, dict[int, Drawing]] = {}
     _stroke_count_groups_searched_db: dict[int, bool] = {}
     _searched_db: bool = False
+    _next_temp_id: int = 0
+    _bucket_stacks: dict[tuple[int, bool, int, int], tuple[list[Drawing], NDArray]] = {}
+    _confusable_cache: dict[tuple[str, int, int, int, int], tuple[list[Drawing], dict[int, float]]] = {}
+    _prototype_cache: dict[tuple[str, int], list[Drawing]] = {}
+    max_prototypes: int = 4
+    arc_length: bool = False
+    _confusable_glyphs: dict[str, list[tuple[str, float]]] = {}
+    _confusable_glyphs_loaded: bool = False
+    # (template count, max drawing id) each bucket's confusables came from
+    _confusable_sources: dict[int, tuple[int, int]] = {}
+    _sync_listeners: list[Callable[[Drawing], None]] = []
+    _COLUMNS: tuple[str, ...] = ('stroke_count', 'strokes', 'glyph')
+    # Cache hit/miss counters and per stroke count [seconds, searches]
+    _cache_counters: dict[str, int] = {}
+    _match_times: dict[int, list[float]] = {}
 
     # Class Methods ############################################################
 
+    @classmethod
+    def add_sync_listener(cls, fn: Callable[[Drawing], None]):
+        '''Registers a function called with the drawing every time it is synced'''
+        cls._sync_listeners.append(fn)
+
     @classmethod
     def _add_to_cache(cls, d: Drawing):
         cls._id_cache[d._db_id] = d
@@ -39,15 +78,17 @@ class Drawing:
             cls._stroke_count_groups[d._stroke_count] = {}
             cls._stroke_count_groups_searched_db[d._stroke_count] = False
         cls._stroke_count_groups[d._stroke_count][d._db_id] = d
+        cls._drop_bucket_stacks(d._stroke_count, d._glyph)
 
     @classmethod
     def _clear_from_cache(cls, d: Drawing):
         del cls._id_cache[d._db_id]
         del cls._glyph_cache[d._glyph][d._db_id]
-        if len(cls._glyph_cache) == 0:
+        if len(cls._glyph_cache[d._glyph]) == 0:
             del cls._glyph_cache[d._glyph]
             del cls._glyph_cache_searched_db[d._glyph]
         del cls._stroke_count_groups[d._stroke_count][d._db_id]
+        cls._drop_bucket_stacks(d._stroke_count, d._glyph)
         if len(cls._stroke_count_groups[d._stroke_count]) == 0:
             del cls._stroke_count_groups[d._stroke_count]
             del cls._stroke_count_groups_searched_db[d._stroke_count]
@@ -68,12 +109,16 @@ class Drawing:
         return obj
 
     @classmethod
-    def create(cls, strokes: list[list[float]], glyph: str) -> Drawing:
-        new_id = min(cls._id_cache, default=1) - 1
-        if new_id > 0:
-            new_id = 0
+    def create(cls, strokes: StrokeSet | list[list[float]], glyph: str) -> Drawing:
+        new_id = cls._next_temp_id
+        cls._next_temp_id -= 1
         stroke_count = len(strokes)
+        stroke_set = None
+        if isinstance(strokes, StrokeSet):
+            stroke_set = strokes
+            strokes = strokes.to_lists()
         obj = Drawing(new_id, stroke_count, strokes, glyph, False)
+        obj._stroke_set = stroke_set
         cls._add_to_cache(obj)
         return obj
 
@@ -125,18 +170,11 @@ class Drawing:
         elif cls._searched_db:
             return
 
-        owns_con = False
-        if con is None:
-            owns_con = True
-            con = _engine.connect()
-        try:
+        with maybe_connection(con) as con:
             stmnt = sqla.select(drawing_table).where(drawing_table.c.id == id)
             res = con.execute(stmnt).mappings().one_or_none()
             if res is not None:
                 obj = cls._create_from_mapping(res)
-        finally:
-            if owns_con:
-                con.close()
         return obj
     
 
@@ -177,47 +215,445 @@ class Drawing:
         
 
 
+    @classmethod
+    def _bucket_stack(cls,
+                      stroke_count: int,
+                      coarse: bool,
+                      point_count: int,
+                      size: int) -> tuple[list[Drawing], NDArray]:
+        '''Prototypes of every glyph with a stroke count, with their processed
+        strokes stacked into one (T, S, D) array, kept until the bucket changes'''
+        key = (stroke_count, coarse, point_count, size)
+        stack = cls._bucket_stacks.get(key)
+        cls._count_cache('bucket_stack', stack is not None)
+        if stack is None:
+            glyphs = dict.fromkeys(d._glyph for d in cls._stroke_count_groups.get(stroke_count, {}).values())
+            drawings = [p for g in glyphs for p in cls.prototypes(g, stroke_count)]
+            stack = (drawings, np.stack([d._processed_strokes(coarse, point_count, size)
+                                         for d in drawings]))
+            cls._bucket_stacks[key] = stack
+        return stack
+
+
+
+    @classmethod
+    def _drop_bucket_stacks(cls, stroke_count: int, glyph: str | None = None):
+        for key in [k for k in cls._bucket_stacks if k[0] == stroke_count]:
+            del cls._bucket_stacks[key]
+        cls._prototype_cache.pop((glyph, stroke_count), None)
+        for key in [k for k in cls._confusable_cache if k[1] == stroke_count]:
+            del cls._confusable_cache[key]
+
+
+
+    @classmethod
+    def prototypes(cls, glyph: str, stroke_count: int) -> list[Drawing]:
+        '''The drawings of glyph with stroke_count strokes that stand in for it
+        in template searches. Once there are more than max_prototypes of them
+        they are clustered with k-medoids on stroke_diff and only the medoids
+        are kept, so recording more samples does not slow matching down.'''
+        key = (glyph, stroke_count)
+        protos = cls._prototype_cache.get(key)
+        if protos is None:
+            members = [d for d in (cls._glyph_cache.get(glyph) or {}).values()
+                       if d._stroke_count == stroke_count]
+            if len(members) > cls.max_prototypes:
+                processed = np.stack([d._processed_strokes(False, 100, 100) for d in members])
+                dist = np.concatenate([block for _, block in du.pairwise_diff_chunks(processed, processed)])
+                members = [members[i] for i in du.k_medoids(dist, cls.max_prototypes)]
+            protos = members
+            cls._prototype_cache[key] = protos
+        return protos
+
+
+
+    @classmethod
+    def set_max_prototypes(cls, n: int):
+        assert n >= 1
+        cls.max_prototypes = n
+        cls._prototype_cache.clear()
+        cls._bucket_stacks.clear()
+        cls._confusable_cache.clear()
+
+
+
+    @classmethod
+    def set_arc_length(cls, b: bool):
+        '''Switches template matching between resampling strokes by point index
+        and by arc length (see drawing_utils.resample_strokes). Off by default
+        and opt in only: nothing in the app turns it on, and while it is on
+        the offline confusables, computed by index, are not used.'''
+        if b == cls.arc_length:
+            return
+        cls.arc_length = b
+        cls._prototype_cache.clear()
+        cls._bucket_stacks.clear()
+        cls._confusable_cache.clear()
+
+
+
+    @classmethod
+    def _count_cache(cls, name: str, hit: bool):
+        key = f'{name}_hits' if hit else f'{name}_misses'
+        cls._cache_counters[key] = cls._cache_counters.get(key, 0) + 1
+
+
+
+    @classmethod
+    def _record_match(cls, stroke_count: int, start_time: float):
+        timing = cls._match_times.setdefault(stroke_count, [0.0, 0])
+        timing[0] += time.perf_counter() - start_time
+        timing[1] += 1
+
+
+
+    @classmethod
+    def stroke_count_histogram(cls, con: sqla.Connection | None = None) -> dict[int, tuple[int, int]]:
+        '''{stroke_count: (templates, distinct glyphs)} over the saved drawings,
+        counted by the database without loading any of them'''
+        with maybe_connection(con) as con:
+            stmnt = sqla.select(drawing_table.c.stroke_count,
+                                sqla.func.count(),
+                                sqla.func.count(sqla.distinct(drawing_table.c.glyph)))\
+                        .group_by(drawing_table.c.stroke_count)\
+                        .order_by(drawing_table.c.stroke_count)
+            return {int(sc): (int(n), int(g)) for sc, n, g in con.execute(stmnt)}
+
+
+
+    @classmethod
+    def glyph_histogram(cls,
+                        stroke_count: int | None = None,
+                        limit: int | None = None,
+                        con: sqla.Connection | None = None) -> list[tuple[str, int]]:
+        '''(glyph, templates) over the saved drawings, most templates first,
+        optionally within one stroke count'''
+        with maybe_connection(con) as con:
+            count = sqla.func.count().label('templates')
+            stmnt = sqla.select(drawing_table.c.glyph, count)\
+                        .group_by(drawing_table.c.glyph)\
+                        .order_by(count.desc(), drawing_table.c.glyph)
+            if stroke_count is not None:
+                stmnt = stmnt.where(drawing_table.c.stroke_count == stroke_count)
+            if limit is not None:
+                stmnt = stmnt.limit(limit)
+            return [(g, int(n)) for g, n in con.execute(stmnt)]
+
+
+
+    @classmethod
+    def cache_statistics(cls) -> dict[str, tuple[int, int, float | None]]:
+        '''{cache: (hits, misses, hit rate)} for the processed stroke, bucket
+        stack and confusable neighbor caches since the last reset'''
+        stats = {}
+        for name in ('processed', 'bucket_stack', 'confusable'):
+            hits = cls._cache_counters.get(f'{name}_hits', 0)
+            misses = cls._cache_counters.get(f'{name}_misses', 0)
+            stats[name] = (hits, misses, hits / (hits + misses) if hits + misses else None)
+        return stats
+
+
+
+    @classmethod
+    def bucket_statistics(cls, con: sqla.Connection | None = None) -> list[BucketStatistics]:
+        '''Size of every stroke count bucket alongside how it has been used:
+        whether it is loaded, how many prototypes its search stack holds and
+        the mean latency of the template searches run against it'''
+        stats = []
+        for sc, (templates, glyphs) in cls.stroke_count_histogram(con).items():
+            stack = cls._bucket_stacks.get((sc, False, 100, 100))
+            seconds, matches = cls._match_times.get(sc, (0.0, 0))
+            stats.append(BucketStatistics(sc,
+                                          templates,
+                                          glyphs,
+                                          cls._stroke_count_groups_searched_db.get(sc, False) or cls._searched_db,
+                                          len(stack[0]) if stack is not None else None,
+                                          int(matches),
+                                          1000 * seconds / matches if matches else None))
+        return stats
+
+
+
+    @classmethod
+    def reset_statistics(cls):
+        cls._cache_counters.clear()
+        cls._match_times.clear()
+
+
+
+    @classmethod
+    def _shortlist(cls,
+                   s: list[list[float]],
+                   size: int,
+                   shortlist: int,
+                   coarse_point_count: int,
+                   ignore_order: bool = False) -> tuple[list[Drawing], NDArray]:
+        '''First stage of the template search. Ranks the bucket of s on the
+        coarse descriptor and returns the bucket with the indices of the best
+        'shortlist' drawings, or of every drawing when the bucket is no bigger
+        than that.'''
+        drawings, coarse = cls._bucket_stack(len(s), True, coarse_point_count, size)
+        if shortlist <= 0 or len(drawings) <= shortlist:
+            return drawings, np.arange(len(drawings))
+
+        q = du.coarse_descriptor(s, point_count=coarse_point_count, size=size, arc_length=cls.arc_length)
+        if ignore_order:
+            # each stroke's nearest counterpart, a lower bound on the assignment cost
+            scores = du.stroke_cost_matrix(coarse, q).min(axis=1).mean(axis=1)
+        else:
+            scores = np.abs(coarse - q).mean(axis=(1, 2))
+        return drawings, np.argpartition(scores, shortlist - 1)[:shortlist]
+
+
+
+    @classmethod
+    def confusable_glyphs(cls, glyph: str, con: sqla.Connection | None = None) -> list[tuple[str, float]]:
+        '''Precomputed (neighbor_glyph, distance) pairs for glyph, nearest
+        first, as written by util_scripts/compute_confusables.py'''
+        cls._load_confusables(con)
+        return cls._confusable_glyphs.get(glyph, [])
+
+
+
+    @classmethod
+    def _load_confusables(cls, con: sqla.Connection | None = None):
+        if cls._confusable_glyphs_loaded:
+            return
+        with maybe_connection(con) as con:
+            stmnt = sqla.select(glyph_confusable_table.c.glyph,
+                                glyph_confusable_table.c.neighbor_glyph,
+                                glyph_confusable_table.c.distance)\
+                        .order_by(glyph_confusable_table.c.glyph,
+                                  glyph_confusable_table.c.rank)
+            for g, neighbor, distance in con.execute(stmnt):
+                cls._confusable_glyphs.setdefault(g, []).append((neighbor, float(distance)))
+            B = glyph_confusable_bucket_table
+            for stroke_count, template_count, max_id in con.execute(sqla.select(B)):
+                cls._confusable_sources[stroke_count] = (template_count, max_id)
+        cls._confusable_glyphs_loaded = True
+
+
+
+    @classmethod
+    def bucket_source(cls, stroke_count: int) -> tuple[int, int]:
+        '''(template count, max drawing id) of the drawings with a glyph in a
+        loaded bucket, unsaved ones counted, as recorded for confusables'''
+        drawings = [d for d in cls._stroke_count_groups.get(stroke_count, {}).values() if d._glyph]
+        return len(drawings), max((d._db_id for d in drawings), default=0)
+
+
+
+    @classmethod
+    def _confusables_current(cls, stroke_count: int) -> bool:
+        '''Whether the bucket still holds exactly the templates its
+        precomputed confusables were computed from'''
+        cls._load_confusables()
+        source = cls._confusable_sources.get(stroke_count)
+        return source is not None and source == cls.bucket_source(stroke_count)
+
+
+
+    @classmethod
+    def reload_confusable_glyphs(cls):
+        '''Forgets the precomputed confusables so the next lookup rereads them'''
+        cls._confusable_glyphs = {}
+        cls._confusable_sources = {}
+        cls._confusable_glyphs_loaded = False
+        cls._confusable_cache.clear()
+
+
+
+    @classmethod
+    def confusable_neighbors(cls,
+                             glyph: str,
+                             stroke_count: int,
+                             k: int = 40,
+                             point_count: int = 100,
+                             size: int = 100) -> tuple[list[Drawing], dict[int, float]]:
+        '''Templates of other glyphs that a drawing of glyph could be mistaken
+        for. Taken from the precomputed confusables table when it has an
+        entry for glyph and the bucket has not changed since it was computed,
+        otherwise the k nearest in the bucket to each of glyph's own
+        templates.
+
+        Also returns, for each of glyph's templates, the distance to the
+        closest template that did not make the list. Every other template is
+        at least that far away, which lets callers tell when the list is
+        enough to rank a drawing exactly.'''
+        key = (glyph, stroke_count, k, point_count, size)
+        cached = cls._confusable_cache.get(key)
+        cls._count_cache('confusable', cached is not None)
+        if cached is not None:
+            return cached
+
+        cls.by_stroke_count(stroke_count)
+
+        # The offline table is computed at the default resolution, its last
+        # distance bounds every glyph that did not make the list as long as
+        # no template was added, removed or changed since
+        default_resolution = (point_count, size) == (100, 100) and not cls.arc_length
+        listed = []
+        if default_resolution and cls._confusables_current(stroke_count):
+            listed = cls.confusable_glyphs(glyph)
+        if listed:
+            radius = listed[-1][1]
+            cached = ([p for g, _ in listed for p in cls.prototypes(g, stroke_count)],
+                      {d_id: radius for d_id in (cls.by_glyph(glyph) or {})})
+            cls._confusable_cache[key] = cached
+            return cached
+
+        drawings, full = cls._bucket_stack(stroke_count, False, point_count, size)
+        others = np.array([d.glyph != glyph for d in drawings], dtype=bool)
+        other_idx = np.flatnonzero(others)
+
+        chosen: set[int] = set()
+        order: dict[int, NDArray] = {}
+        for i in np.flatnonzero(~others):
+            dists = np.abs(full[other_idx] - full[i]).mean(axis=(1, 2))
+            order[drawings[i].id] = dists
+            nearest = np.argsort(dists, kind='stable')[:k]
+            chosen.update(int(other_idx[j]) for j in nearest)
+
+        chosen_mask = np.isin(other_idx, list(chosen))
+        radii: dict[int, float] = {}
+        for d_id, dists in order.items():
+            rest = dists[~chosen_mask]
+            radii[d_id] = float(rest.min()) if rest.size else float('inf')
+
+        cached = ([drawings[i] for i in sorted(chosen)], radii)
+        cls._confusable_cache[key] = cached
+        return cached
+
+
+
+    @classmethod
+    def target_rank(cls,
+                    s: list[list[float]],
+                    glyph: str,
+                    top_n: int,
+                    point_count: int = 100,
+                    size: int = 100,
+                    neighbor_count: int = 40) -> int | None:
+        '''Position glyph would take in by_strokes_fuzzy(s, top_n), or None when
+        it would not appear. Only glyph's own templates and their confusable
+        neighbors are scored; when the drawing is too far from every template
+        of glyph for the neighbors to settle the rank, the full search is run.'''
+        start_time = time.perf_counter()
+        cls.by_glyph(glyph)
+        targets = cls.prototypes(glyph, len(s))
+        if not targets:
+            return None
+
+        ps = du.process_strokes(s,point_count=point_count,size=size,arc_length=cls.arc_length)
+        scores = [float(np.abs(d._processed_strokes(False, point_count, size) - ps).mean())
+                  for d in targets]
+        best = int(np.argmin(scores))
+        best_score = scores[best]
+
+        neighbors, radii = cls.confusable_neighbors(glyph, len(s), neighbor_count, point_count, size)
+        if best_score * 2 > radii.get(targets[best].id, 0.0):
+            res = cls.by_strokes_fuzzy(s, top_n, point_count=point_count, size=size)
+            return next((i for i, d in enumerate(res) if d.glyph == glyph), None)
+
+        # any template outside the neighbors is at least radius - best_score >= best_score away
+        rank = 0
+        if neighbors:
+            stack = np.stack([d._processed_strokes(False, point_count, size) for d in neighbors])
+            rank = int((np.abs(stack - ps).mean(axis=(1, 2)) < best_score).sum())
+        cls._record_match(len(s), start_time)
+        return rank if rank < top_n else None
+
+
+
     @classmethod
     def by_strokes_fuzzy(cls,
                          s: list[list[float]],
                          top_n: int,
                          point_count: int=100,
-                         size: int = 100) -> list[Drawing]:
+                         size: int = 100,
+                         ignore_order: bool = False,
+                         order_weight: float = 0.0,
+                         shortlist_factor: int = 8,
+                         coarse_point_count: int = 8) -> list[Drawing]:
+        '''Closest top_n drawings with the same stroke count as s, see
+        by_strokes_fuzzy_scored'''
+        return [d for d, _, _ in cls.by_strokes_fuzzy_scored(s,
+                                                             top_n,
+                                                             point_count,
+                                                             size,
+                                                             ignore_order,
+                                                             order_weight,
+                                                             shortlist_factor,
+                                                             coarse_point_count)]
+
+    @classmethod
+    def by_strokes_fuzzy_scored(cls,
+                                s: list[list[float]],
+                                top_n: int,
+                                point_count: int=100,
+                                size: int = 100,
+                                ignore_order: bool = False,
+                                order_weight: float = 0.0,
+                                shortlist_factor: int = 8,
+                                coarse_point_count: int = 8) -> list[tuple[Drawing, float, float]]:
+        '''Closest top_n drawings with the same stroke count as s, each with
+        its shape score and order penalty. With ignore_order strokes are
+        paired by optimal assignment rather than by position, and
+        order_weight (in grid units) is added per unit of order penalty when
+        ranking; by position the order penalty is always 0.
+
+        The search is a cascade: a coarse descriptor with coarse_point_count
+        points per stroke narrows the bucket to top_n * shortlist_factor
+        drawings, and only those get the full resolution score. A larger
+        factor trades latency for recall, 0 scores the whole bucket.'''
+        start_time = time.perf_counter()
         extant = cls.by_stroke_count(len(s))
 
         if extant is None or len(extant) == 0:
             return []
 
-
-        ps = du.process_strokes(s,point_count=point_count,size=size)
-        
-        closest: dict[float, Drawing] = {}
-        for _, v in extant.items():
-            value = du.stroke_diff(v.strokes, ps, size=size, point_count=point_count)
-            if len(closest) < top_n:
-                while value in closest:
-                    value += 0.001
-                closest[value] = v
-
-            if value < max(closest):
-                m = max(closest)
-                del closest[m]
-                while value in closest:
-                    value += 0.001
-                closest[value] = v
-        
-        return [closest[k] for k in sorted(closest.keys())]
+        drawings, candidates = cls._shortlist(s,
+                                              size,
+                                              top_n * shortlist_factor,
+                                              coarse_point_count,
+                                              ignore_order)
+        _, full = cls._bucket_stack(len(s), False, point_count, size)
+        templates = full[candidates]
+
+        ps = du.process_strokes(s,point_count=point_count,size=size,arc_length=cls.arc_length)
+
+        if ignore_order:
+            shapes, orders = du.match_strokes_batch(templates, ps)
+            scores = shapes + order_weight * orders
+        else:
+            # stroke_diff against every candidate at once
+            shapes = np.abs(templates - ps).mean(axis=(1, 2))
+            orders = np.zeros_like(shapes)
+            scores = shapes
+
+        best = np.argsort(scores, kind='stable')[:top_n]
+        cls._record_match(len(s), start_time)
+        return [(drawings[candidates[i]], float(shapes[i]), float(orders[i])) for i in best]
     
     @classmethod
-    def by_strokes(cls, s: list[list[float]]) -> Drawing | None:
+    def by_strokes(cls,
+                   s: list[list[float]],
+                   shortlist: int = 32,
+                   coarse_point_count: int = 8) -> Drawing | None:
+        '''Closest drawing by Procrustes comparison, run only on the
+        'shortlist' best coarse matches (0 compares the whole bucket)'''
+        start_time = time.perf_counter()
         extant = cls.by_stroke_count(len(s))
 
         if extant is None or len(extant) == 0:
             return
 
+        drawings, candidates = cls._shortlist(s, 100, shortlist, coarse_point_count)
+
         closest = None
         closest_value = 1000000000.0
-        for _, v in extant.items():
+        for i in candidates:
+            v = drawings[i]
             value = du.compare_drawings(v.strokes, s)
             if closest == None:
                 closest = v
@@ -226,6 +662,7 @@ class Drawing:
             elif value < closest_value:
                 closest = v
                 closest_value = value
+        cls._record_match(len(s), start_time)
         return closest
 
 
@@ -244,7 +681,12 @@ class Drawing:
         self._stroke_count = stroke_count
         self._strokes = strokes
         self._glyph = glyph
-        self._synced = synced
+        # Columns changed since the last sync, every column for a new drawing
+        self._dirty: set[str] = set() if synced else set(Drawing._COLUMNS)
+        self._processed: dict[tuple[bool, int, int, bool], NDArray] = {}
+        self._stroke_set: StrokeSet | None = None
+        # Stroke count the drawing had when last synced, if it changed since
+        self._left_bucket: int | None = None
 
 
 
@@ -271,17 +713,41 @@ class Drawing:
 
 
     @strokes.setter
-    def strokes(self, s: list[list[float]]):
-        old_stroke_count = self._stroke_count
-        self._stroke_count = len(s)
-        self._strokes = s
-        if old_stroke_count != self._stroke_count:
+    def strokes(self, s: StrokeSet | list[list[float]]):
+        stroke_set = StrokeSet.from_lists(s)
+        if isinstance(s, StrokeSet):
+            s = s.to_lists()
+        # Compared as stored (float32), so strokes read back from the database
+        # and recomputed from the same source count as unchanged
+        current = self.stroke_set
+        if np.array_equal(stroke_set.offsets, current.offsets) and np.array_equal(stroke_set.points, current.points):
+            return
+        if len(s) != self._stroke_count:
+            # The caches are keyed on the old stroke count
+            self._left_bucket = self._stroke_count
             Drawing._clear_from_cache(self)
+            self._stroke_count = len(s)
+            self._strokes = s
             Drawing._add_to_cache(self)
-        self._synced = False
+            self._dirty.add('stroke_count')
+        else:
+            self._strokes = s
+            Drawing._drop_bucket_stacks(self._stroke_count, self._glyph)
+        self._processed = {}
+        self._stroke_set = stroke_set
+        self._dirty.add('strokes')
         
 
 
+    @property
+    def stroke_set(self) -> StrokeSet:
+        '''The strokes as a StrokeSet, built once until the strokes change'''
+        if self._stroke_set is None:
+            self._stroke_set = StrokeSet.from_lists(self._strokes)
+        return self._stroke_set
+
+
+
     @property
     def glyph(self) -> str:
         return self._glyph
@@ -291,14 +757,32 @@ class Drawing:
     @glyph.setter
     def glyph(self, g: str) -> None:
         if g != self._glyph:
+            Drawing._clear_from_cache(self)
             self._glyph = g
-            self._synced = False
+            Drawing._add_to_cache(self)
+            self._dirty.add('glyph')
 
 
 
     @property
     def synced(self) -> bool:
-        return self._synced
+        return not self._dirty
+
+
+
+    @property
+    def _synced(self) -> bool:
+        return not self._dirty
+
+
+
+    @_synced.setter
+    def _synced(self, b: bool) -> None:
+        # Set by UnitOfWork once the dirty columns are written
+        if b:
+            self._dirty.clear()
+        else:
+            self._dirty.update(Drawing._COLUMNS)
 
 
 
@@ -306,32 +790,71 @@ class Drawing:
 
 
 
-    def sync(self, con: sqla.Connection | None = None) -> int:
-        with maybe_connection_commit(con) as con:
-            # if updating
-            if self._db_id > 0:
-                res = con.execute(
-                    sqla.update(drawing_table)
-                    .where(drawing_table.c.id == self._db_id)
-                    .returning(drawing_table.c.id)
-                    .values(stroke_count=self._stroke_count,
-                            strokes=self._strokes,
-                            glyph=self._glyph))
-                _ = res.scalar_one()
-            # if inserting
+    def _processed_strokes(self, coarse: bool, point_count: int, size: int) -> NDArray:
+        '''process_strokes (or coarse_descriptor) of this drawing, cached
+        until its strokes change'''
+        key = (coarse, point_count, size, Drawing.arc_length)
+        ps = self._processed.get(key)
+        Drawing._count_cache('processed', ps is not None)
+        if ps is None:
+            if coarse:
+                ps = du.coarse_descriptor(self.stroke_set,
+                                          point_count=point_count,
+                                          size=size,
+                                          arc_length=Drawing.arc_length)
             else:
-                Drawing._clear_from_cache(self)
-                res = con.execute(
-                    sqla.insert(drawing_table)
-                    .returning(drawing_table.c.id)
-                    .values(
-                        stroke_count=self._stroke_count,
-                        strokes=self._strokes,
-                        glyph=self._glyph))
-                self._db_id = res.scalar_one()
-                Drawing._add_to_cache(self)
-                
-        self._synced = True
+                ps = du.process_strokes(self.stroke_set,
+                                        point_count=point_count,
+                                        size=size,
+                                        arc_length=Drawing.arc_length)
+            self._processed[key] = ps
+        return ps
+
+
+    def _flush_dependencies(self) -> list:
+        return []
+
+
+    def _flush_row(self, inserting: bool, new_ids: dict) -> dict:
+        '''Every column when inserting, otherwise only those changed. Strokes
+        are encoded straight from the StrokeSet when one has been built.'''
+        columns = Drawing._COLUMNS if inserting else self._dirty
+        row = {}
+        if 'stroke_count' in columns:
+            row['stroke_count'] = self._stroke_count
+        if 'strokes' in columns:
+            row['strokes'] = self._stroke_set if self._stroke_set is not None else self._strokes
+        if 'glyph' in columns:
+            row['glyph'] = self._glyph
+        return row
+
+
+    def sync(self, con: sqla.Connection | None = None) -> int:
+        UnitOfWork([self]).flush(con)
         return self._db_id
-                
-                
+
+
+    @staticmethod
+    def _after_flush(con: sqla.Connection, drawings: list[Drawing]):
+        '''Forgets the recorded source of every bucket a saved drawing is in or
+        left, as its precomputed confusables may no longer hold'''
+        stroke_counts = {d._stroke_count for d in drawings}
+        stroke_counts.update(d._left_bucket for d in drawings if d._left_bucket is not None)
+        B = glyph_confusable_bucket_table
+        con.execute(sqla.delete(B).where(B.c.stroke_count.in_(stroke_counts)))
+        for stroke_count in stroke_counts:
+            Drawing._confusable_sources.pop(stroke_count, None)
+            for key in [k for k in Drawing._confusable_cache if k[1] == stroke_count]:
+                del Drawing._confusable_cache[key]
+        for d in drawings:
+            d._left_bucket = None
+
+
+
+register_wrapper(Drawing,
+                 drawing_table,
+                 0,
+                 Drawing._clear_from_cache,
+                 Drawing._add_to_cache,
+                 Drawing._sync_listeners,
+                 Drawing._after_flush)
@@ -1,6 +1,6 @@
 # Generated by ChatGPT
 # bootstrap_kana_cards.py
-from .database import maybe_connection_commit
+from .unit_of_work import UnitOfWork
 from .kana_card import KanaCard
 
 # ---------------------------------------------------------------------------
@@ -207,6 +207,4 @@ KanaCard.create(kana="ュ", romaji="yu")
 KanaCard.create(kana="ョ", romaji="yo")
 KanaCard.create(kana="ッ", romaji="tsu")
 
-with maybe_connection_commit(None) as con:
-    for kc in KanaCard.every():
-        kc.sync(con)
+UnitOfWork(KanaCard.every()).flush()
@@ -0,0 +1,204 @@
+# Description: An in memory index of every character with a kana or kanji
+#     card or a drawing, for membership checks that should not load cards
+
+
+################################################################################
+# Imports
+################################################################################
+
+from __future__ import annotations
+import threading
+from dataclasses import dataclass
+from typing import Callable
+import sqlalchemy as sqla
+from .database import (drawing_table,
+                       kana_card_table,
+                       kanji_card_table,
+                       maybe_connection,
+                       KANA_CARD_KIND,
+                       KANJI_CARD_KIND)
+from .drawing import Drawing
+from .kana_card import KanaCard
+from .kanji_card import KanjiCard
+
+################################################################################
+# Class Definition
+################################################################################
+
+@dataclass(slots=True)
+class GlyphEntry:
+    glyph: str
+    # KANA_CARD_KIND or KANJI_CARD_KIND, None when the glyph only has drawings
+    kind: str | None
+    card_id: int | None
+    has_drawing: bool
+
+
+
+class GlyphIndex:
+    '''Saved characters by glyph: the kind and card id of their kana or kanji
+    card and whether any drawing of them exists. Loaded with one query on
+    first use, then kept current by the card and drawing sync listeners.
+    Unsaved cards are not in the index; kana_card and kanji_card check the
+    card caches for those first.'''
+
+    # Class Variables ##########################################################
+
+    _entries: dict[str, GlyphEntry] = {}
+    _loaded: bool = False
+    _lock = threading.RLock()
+    _listeners: list[Callable[[GlyphEntry], None]] = []
+
+    # Class Methods ############################################################
+
+    @classmethod
+    def add_listener(cls, fn: Callable[[GlyphEntry], None]):
+        '''Registers a function called with an entry every time it is added
+        or changed after the index is loaded'''
+        cls._listeners.append(fn)
+
+
+
+    @classmethod
+    def ensure_loaded(cls, con: sqla.Connection | None = None):
+        with cls._lock:
+            if cls._loaded:
+                return
+            kana = sqla.select(kana_card_table.c.kana,
+                               sqla.literal(KANA_CARD_KIND),
+                               kana_card_table.c.card_id,
+                               kana_card_table.c.drawing_id.is_not(None))
+            kanji = sqla.select(kanji_card_table.c.kanji,
+                                sqla.literal(KANJI_CARD_KIND),
+                                kanji_card_table.c.card_id,
+                                kanji_card_table.c.drawing_id.is_not(None))
+            drawn = sqla.select(drawing_table.c.glyph,
+                                sqla.null(),
+                                sqla.null(),
+                                sqla.true())\
+                        .where(drawing_table.c.glyph.is_not(None))\
+                        .group_by(drawing_table.c.glyph)
+            with maybe_connection(con) as con:
+                for glyph, kind, card_id, has_drawing in con.execute(sqla.union_all(kana, kanji, drawn)):
+                    entry = cls._entries.get(glyph)
+                    if entry is None:
+                        cls._entries[glyph] = GlyphEntry(glyph, kind, card_id, bool(has_drawing))
+                        continue
+                    if kind is not None:
+                        entry.kind = kind
+                        entry.card_id = card_id
+                    entry.has_drawing = entry.has_drawing or bool(has_drawing)
+            cls._loaded = True
+
+
+
+    @classmethod
+    def reload(cls):
+        with cls._lock:
+            cls._entries = {}
+            cls._loaded = False
+
+
+
+    @classmethod
+    def get(cls, glyph: str) -> GlyphEntry | None:
+        cls.ensure_loaded()
+        return cls._entries.get(glyph)
+
+
+
+    @classmethod
+    def kind(cls, glyph: str) -> str | None:
+        entry = cls.get(glyph)
+        return entry.kind if entry is not None else None
+
+
+
+    @classmethod
+    def has_drawing(cls, glyph: str) -> bool:
+        entry = cls.get(glyph)
+        return entry is not None and entry.has_drawing
+
+
+
+    @classmethod
+    def glyphs(cls, kind: str | None = None) -> list[str]:
+        '''Glyphs with a saved card of kind (any card when None), sorted'''
+        cls.ensure_loaded()
+        with cls._lock:
+            return sorted(g for g, e in cls._entries.items()
+                          if e.kind is not None and (kind is None or e.kind == kind))
+
+
+
+    @classmethod
+    def kana_card(cls, glyph: str) -> KanaCard | None:
+        '''The kana card of glyph, touching the database only when the index
+        says a saved card exists'''
+        card = KanaCard._kana_cache.get(glyph)
+        if card is not None:
+            return card
+        entry = cls.get(glyph)
+        if entry is None or entry.kind != KANA_CARD_KIND or entry.card_id is None:
+            return None
+        return KanaCard.by_card_id(entry.card_id)
+
+
+
+    @classmethod
+    def kanji_card(cls, glyph: str) -> KanjiCard | None:
+        '''The kanji card of glyph, touching the database only when the index
+        says a saved card exists'''
+        card = KanjiCard._kanji_cache.get(glyph)
+        if card is not None:
+            return card
+        entry = cls.get(glyph)
+        if entry is None or entry.kind != KANJI_CARD_KIND or entry.card_id is None:
+            return None
+        return KanjiCard.by_card_id(entry.card_id)
+
+
+
+    @classmethod
+    def _update(cls, glyph: str, kind: str | None, card_id: int | None, has_drawing: bool):
+        with cls._lock:
+            if not cls._loaded or not glyph:
+                return
+            entry = cls._entries.get(glyph)
+            if entry is None:
+                entry = GlyphEntry(glyph, kind, card_id, has_drawing)
+                cls._entries[glyph] = entry
+            elif (kind is None or (entry.kind, entry.card_id) == (kind, card_id))\
+                    and (entry.has_drawing or not has_drawing):
+                return
+            else:
+                if kind is not None:
+                    entry.kind = kind
+                    entry.card_id = card_id
+                entry.has_drawing = entry.has_drawing or has_drawing
+            for fn in cls._listeners:
+                fn(entry)
+
+
+
+    @classmethod
+    def _on_kana_synced(cls, card: KanaCard):
+        cls._update(card.kana, KANA_CARD_KIND, card.card.id, card._drawing_id is not None)
+
+
+
+    @classmethod
+    def _on_kanji_synced(cls, card: KanjiCard):
+        cls._update(card.kanji, KANJI_CARD_KIND, card.card.id, card._drawing_id is not None)
+
+
+
+    @classmethod
+    def _on_drawing_synced(cls, drawing: Drawing):
+        cls._update(drawing.glyph, None, None, True)
+
+
+
+KanaCard.add_sync_listener(GlyphIndex._on_kana_synced)
+KanjiCard.add_sync_listener(GlyphIndex._on_kanji_synced)
+Drawing.add_sync_listener(GlyphIndex._on_drawing_synced)
@@ -6,42 +6,151 @@
 # Imports
 ################################################################################
 
+from __future__ import annotations
+import re
+from typing import Iterable, Sequence
+import numpy as np
+from numpy.typing import NDArray
+
+################################################################################
+# Globals
+################################################################################
+
+# Inclusive code point ranges
+KANA_RANGES: tuple[tuple[int, int], ...] = (
+    (0x3040, 0x309F),   # Hiragana
+    (0x30A0, 0x30FF),   # Katakana
+    # Katakana Phonetic Extensions (rare but legit)
+    #(0x31F0, 0x31FF),
+)
+
+DEFAULT_KANJI_RANGES: tuple[tuple[int, int], ...] = (
+    (0x4E00, 0x9FFF),   # CJK Unified Ideographs
+    (0x3400, 0x4DBF),   # CJK Unified Ideographs Extension A (rare but valid)
+)
+
+# Further ideograph blocks that set_kanji_ranges can add
+EXTENDED_KANJI_RANGES: tuple[tuple[int, int], ...] = (
+    (0xF900, 0xFAFF),   # CJK Compatibility Ideographs
+    (0x20000, 0x2A6DF), # Extension B
+    (0x2A700, 0x2EBEF), # Extensions C to F
+    (0x30000, 0x3134F), # Extension G
+)
+
+# Values of char_mask
+OTHER_CHAR = 0
+KANA_CHAR = 1
+KANJI_CHAR = 2
+
+################################################################################
+# Character Classes
+################################################################################
+# Compiled from the ranges by set_kanji_ranges, replaced as a whole so
+# readers never see half of an update
+
+
+
+def _char_class(ranges: Iterable[tuple[int, int]]) -> str:
+    # Escaped, so endpoints like ^, - or ] cannot change the class
+    return ''.join(f'\\U{lo:08x}-\\U{hi:08x}' for lo, hi in ranges)
+
+
+
+def _bounds(ranges: Sequence[tuple[int, int]]) -> tuple[NDArray[np.uint32], NDArray[np.uint32]]:
+    return (np.array([lo for lo, _ in ranges], dtype=np.uint32),
+            np.array([hi for _, hi in ranges], dtype=np.uint32))
+
+
+
+def set_kanji_ranges(ranges: Iterable[tuple[int, int]] = DEFAULT_KANJI_RANGES) -> None:
+    '''Sets the code point ranges counted as kanji by every function here,
+    e.g. DEFAULT_KANJI_RANGES + EXTENDED_KANJI_RANGES'''
+    global kanji_ranges, _KANA, _KANJI, _JAPANESE, _KANA_BOUNDS, _KANJI_BOUNDS
+    ranges = tuple(ranges)
+    for lo, hi in ranges:
+        if not 0 <= lo <= hi <= 0x10FFFF:
+            raise ValueError(f'Invalid code point range: {lo:#x}-{hi:#x}')
+    kana = _char_class(KANA_RANGES)
+    kanji = _char_class(ranges)
+    _KANA = re.compile(f'[{kana}]')
+    _KANJI = re.compile(f'[{kanji}]') if ranges else re.compile('(?!)')
+    _JAPANESE = re.compile(f'[{kana}{kanji}]')
+    _KANA_BOUNDS = _bounds(KANA_RANGES)
+    _KANJI_BOUNDS = _bounds(ranges)
+    kanji_ranges = ranges
+
+
+
+set_kanji_ranges()
+
 ################################################################################
 # Functions
 ################################################################################
 
 def is_kana(ch: str) -> bool:
-    if len(ch) != 1:
-        return False
+    return len(ch) == 1 and _KANA.match(ch) is not None
+
+def is_kanji(ch: str) -> bool:
+    return len(ch) == 1 and _KANJI.match(ch) is not None
 
-    code = ord(ch)
 
-    # Hiragana
-    if 0x3040 <= code <= 0x309F:
-        return True
 
-    # Katakana
-    if 0x30A0 <= code <= 0x30FF:
-        return True
+def has_kana(text: str) -> bool:
+    return _KANA.search(text) is not None
 
-    # Katakana Phonetic Extensions (rare but legit)
-    #if 0x31F0 <= code <= 0x31FF:
-    #    return True
+def has_kanji(text: str) -> bool:
+    return _KANJI.search(text) is not None
+
+
+
+def first_kanji(text: str) -> str | None:
+    m = _KANJI.search(text)
+    return m.group() if m is not None else None
+
+
+
+def kana_in(text: str) -> list[str]:
+    '''The kana of text in order, repeats included'''
+    return _KANA.findall(text)
+
+def kanji_in(text: str) -> list[str]:
+    '''The kanji of text in order, repeats included'''
+    return _KANJI.findall(text)
+
+def japanese_in(text: str) -> list[str]:
+    '''The kana and kanji of text in order, repeats included'''
+    return _JAPANESE.findall(text)
+
+
+
+def glyph_sets(texts: Iterable[str | None]) -> tuple[set[str], set[str]]:
+    '''The distinct kana and kanji across every string of texts (None and
+    empty strings skipped), each found with one pass over all of them'''
+    joined = '\n'.join(t for t in texts if t)
+    return set(_KANA.findall(joined)), set(_KANJI.findall(joined))
+
+
+
+def _codes(text: str) -> NDArray[np.uint32]:
+    return np.frombuffer(text.encode('utf-32-le', errors='surrogatepass'), dtype=np.uint32)
+
+def _in_ranges(codes: NDArray[np.uint32], bounds: tuple[NDArray[np.uint32], NDArray[np.uint32]]) -> NDArray[np.bool_]:
+    lo, hi = bounds
+    return ((codes[:, None] >= lo) & (codes[:, None] <= hi)).any(axis=1)
 
-    return False
 
-def is_kanji(ch: str) -> bool:
-    if len(ch) != 1:
-        return False
 
-    code = ord(ch)
+def char_mask(text: str) -> NDArray[np.uint8]:
+    '''KANA_CHAR, KANJI_CHAR or OTHER_CHAR for each character of text'''
+    codes = _codes(text)
+    mask = np.zeros(len(codes), dtype=np.uint8)
+    mask[_in_ranges(codes, _KANA_BOUNDS)] = KANA_CHAR
+    mask[_in_ranges(codes, _KANJI_BOUNDS)] = KANJI_CHAR
+    return mask
 
-    # CJK Unified Ideographs
-    if 0x4E00 <= code <= 0x9FFF:
-        return True
 
-    # CJK Unified Ideographs Extension A (rare but valid)
-    if 0x3400 <= code <= 0x4DBF:
-        return True
 
-    return False
+def char_masks(texts: Sequence[str]) -> list[NDArray[np.uint8]]:
+    '''char_mask of every string of texts, classified together in one pass'''
+    ends = np.cumsum([len(t) for t in texts])
+    return np.split(char_mask(''.join(texts)), ends[:-1]) if len(texts) else []
@@ -7,12 +7,13 @@
 ################################################################################
 
 from __future__ import annotations
-from typing import Mapping
+from typing import Callable, Iterable, Mapping
 import sqlalchemy as sqla
-from .database import kana_card_table, maybe_connection, maybe_connection_commit, KANA_CARD_KIND
+from .database import kana_card_table, maybe_connection, IN_CLAUSE_BATCH, KANA_CARD_KIND
 from .card import Card
 from .drawing import Drawing
 from .helpers import is_kana
+from .unit_of_work import UnitOfWork, register_wrapper
 
 ################################################################################
 # Class Definition
@@ -25,9 +26,16 @@ class KanaCard:
     _card_id_cache: dict[int, KanaCard] = {}
     _kana_cache: dict[str, KanaCard] = {}
     _searched_db: bool = False
+    _next_temp_id: int = 0
+    _sync_listeners: list[Callable[[KanaCard], None]] = []
 
     # Class Methods ############################################################
 
+    @classmethod
+    def add_sync_listener(cls, fn: Callable[[KanaCard], None]):
+        '''Registers a function called with the card every time it is synced'''
+        cls._sync_listeners.append(fn)
+
     @classmethod
     def _add_to_cache(cls, kc: KanaCard):
         assert kc._db_id not in cls._db_id_cache
@@ -43,6 +51,11 @@ class KanaCard:
         del cls._card_id_cache[kc.card.id]
         del cls._kana_cache[kc._kana]
 
+    @classmethod
+    def _by_cached_card(cls, card: Card) -> KanaCard | None:
+        obj = cls._card_id_cache.get(card.id)
+        return obj if obj is not None and obj.card is card else None
+
     @classmethod
     def _create_from_mapping(cls, m: Mapping, con: sqla.Connection | None = None) -> KanaCard:
         db_id = int(m['id'])
@@ -71,13 +84,20 @@ class KanaCard:
         return obj
 
 
-    @classmethod
-    def create(cls, kana: str, romaji: str):
-        # Check parameters
+    @staticmethod
+    def _check_args(kana: str, romaji: str) -> tuple[str, str]:
+        '''Validates the arguments of create'''
         if not is_kana(kana):
             raise ValueError(f'Invalid kana: {kana} is not recognized as a kana character')
         if romaji is None or romaji == '':
             raise ValueError('Inavlid romaji: cannot be null or empty')
+        return kana, romaji
+
+
+    @classmethod
+    def create(cls, kana: str, romaji: str):
+        # Check parameters
+        kana, romaji = cls._check_args(kana, romaji)
         
         # Check uniqueness
         extant_card = cls.by_kana(kana)
@@ -87,10 +107,8 @@ class KanaCard:
         # Create new card object
         c = Card._create(kind=KANA_CARD_KIND)
 
-        # Find new minimum id
-        new_id = min(cls._db_id_cache, default=1) - 1
-        if new_id > 0:
-            new_id = 0
+        new_id = cls._next_temp_id
+        cls._next_temp_id -= 1
         
         # Instantiate and cache
         obj = KanaCard(new_id, c, None, kana, romaji, False)
@@ -185,6 +203,32 @@ class KanaCard:
         
         return obj
 
+
+    @classmethod
+    def by_kana_many(cls, kana: Iterable[str], con: sqla.Connection | None = None) -> dict[str, KanaCard]:
+        '''The cards of every kana found, reading those not cached with one
+        query for the cards and one for their Card rows per IN_CLAUSE_BATCH'''
+        found = {}
+        missing = []
+        for k in set(kana):
+            obj = cls._kana_cache.get(k)
+            if obj is not None:
+                found[k] = obj
+            elif not cls._searched_db:
+                missing.append(k)
+
+        if missing:
+            with maybe_connection(con) as con2:
+                for i in range(0, len(missing), IN_CLAUSE_BATCH):
+                    stmnt = sqla.select(kana_card_table)\
+                                .where(kana_card_table.c.kana.in_(missing[i:i + IN_CLAUSE_BATCH]))
+                    rows = con2.execute(stmnt).mappings().all()
+                    Card.by_ids([int(r['card_id']) for r in rows], con=con2)
+                    for row in rows:
+                        obj = KanaCard._create_from_mapping(row, con=con2)
+                        found[obj.kana] = obj
+        return found
+
     
     # Constructor ##############################################################
 
@@ -247,48 +291,38 @@ class KanaCard:
 
     # Methods ##################################################################
 
-    def sync(self, con: sqla.Connection | None = None) -> int:
+    def _flush_dependencies(self) -> list:
+        deps = []
+        if not self._card.synced:
+            deps.append(self._card)
+        dw = self.drawing
+        if dw is not None and not dw.synced:
+            deps.append(dw)
+        return deps
+
 
-        with maybe_connection_commit(con) as con2:
-            if not self.card.synced:
-                c = self.card
-                old_id = c.id
-                self._card.sync(con=con2)
-                if old_id != c.id:
-                    self._synced = False
-            if self.drawing and not self.drawing.synced:
-                dw = self.drawing
-                old_id = dw.id
-                dw.sync(con=con2)
-                if old_id != dw.id:
-                    self._drawing_id = dw.id
-                    self._synced = False
-
-            # If already synced
-            if self.synced:
-                pass
-            # If updating
-            elif self._db_id > 0:
-                res = con2.execute(
-                    sqla.update(kana_card_table)\
-                        .where(kana_card_table.c.id == self._db_id)\
-                        .returning(kana_card_table.c.id)\
-                        .values(drawing_id=self._drawing_id))
-                _ = res.scalar_one()
-            # If creating
-            else:
-                KanaCard._remove_from_cache(self)
-                res = con2.execute(
-                    sqla.insert(kana_card_table)\
-                        .returning(kana_card_table.c.id)\
-                        .values(
-                            card_id=self._card._db_id,
-                            drawing_id=self._drawing_id,
-                            kana=self._kana,
-                            romaji=self._romaji))
-                self._db_id = res.scalar_one()
-                KanaCard._add_to_cache(self)
-
-        self._synced = True
+    def _flush_row(self, inserting: bool, new_ids: dict) -> dict:
+        if self._drawing_id is not None:
+            self._drawing_id = new_ids.get((Drawing, self._drawing_id), self._drawing_id)
+        if not inserting:
+            return {'drawing_id': self._drawing_id}
+        return {'card_id': self._card.id,
+                'drawing_id': self._drawing_id,
+                'kana': self._kana,
+                'romaji': self._romaji}
+
+
+    def sync(self, con: sqla.Connection | None = None) -> int:
+        '''Saves the card along with its card, relations and drawing'''
+        UnitOfWork([self]).flush(con)
         return self._db_id
 
+
+
+register_wrapper(KanaCard,
+                 kana_card_table,
+                 1,
+                 KanaCard._remove_from_cache,
+                 KanaCard._add_to_cache,
+                 KanaCard._sync_listeners,
+                 keyed_on=(Card, KanaCard._by_cached_card))
@@ -7,14 +7,15 @@
 ################################################################################
 
 from __future__ import annotations
-from typing import Mapping
+from typing import Callable, Iterable, Mapping, Sequence
 import sqlalchemy as sqla
 
 from data.kana_card import KanaCard
-from .database import kanji_card_table, maybe_connection, maybe_connection_commit, KANJI_CARD_KIND
-from .card import Card
+from .database import kanji_card_table, maybe_connection, IN_CLAUSE_BATCH, KANJI_CARD_KIND
+from .card import Card, CardRelation
 from .drawing import Drawing
-from .helpers import is_kanji, is_kana
+from .helpers import has_kana, is_kanji, kana_in
+from .unit_of_work import UnitOfWork, register_wrapper
 
 ################################################################################
 # Class Definition
@@ -27,9 +28,16 @@ class KanjiCard:
     _card_id_cache: dict[int, KanjiCard] = {}
     _kanji_cache: dict[str, KanjiCard] = {}
     _searched_db: bool = False
+    _next_temp_id: int = 0
+    _sync_listeners: list[Callable[[KanjiCard], None]] = []
 
     # Class Methods ############################################################
 
+    @classmethod
+    def add_sync_listener(cls, fn: Callable[[KanjiCard], None]):
+        '''Registers a function called with the card every time it is synced'''
+        cls._sync_listeners.append(fn)
+
     @classmethod
     def _add_to_cache(cls, kc: KanjiCard):
         assert kc._db_id not in cls._id_cache
@@ -46,6 +54,11 @@ class KanjiCard:
         del cls._card_id_cache[kc.card.id]
 
 
+    @classmethod
+    def _by_cached_card(cls, card: Card) -> KanjiCard | None:
+        obj = cls._card_id_cache.get(card.id)
+        return obj if obj is not None and obj.card is card else None
+
     @classmethod
     def _create_from_mapping(cls, m: Mapping, con: sqla.Connection | None = None) -> KanjiCard:
         db_id = int(m['id'])
@@ -75,14 +88,13 @@ class KanjiCard:
         
         return obj
 
-    @classmethod
-    def create(cls,
-               kanji: str,
-               on_yomi: str | None = None,
-               kun_yomi: str | None = None,
-               meaning: str | None = None,
-               require_relationships: bool = True):
-        # Check parameters
+    @staticmethod
+    def _check_args(kanji: str,
+                    on_yomi: str | None = None,
+                    kun_yomi: str | None = None,
+                    meaning: str | None = None) -> tuple[str, str | None, str | None, str | None]:
+        '''Validates the arguments of create, returning them with the readings
+        stripped and empty readings as None'''
         if not is_kanji(kanji):
             raise ValueError(f'Invalid kanji: {kanji} not recognized as a kanji character')
         if on_yomi:
@@ -95,22 +107,27 @@ class KanjiCard:
             kun_yomi = None
         if on_yomi is None and kun_yomi is None:
             raise ValueError('Invalid on_yomi or kun_yomi: both cannot be None or empty')
-        if on_yomi is not None:
-            has_kana = False
-            for c in on_yomi:
-                if is_kana(c):
-                    has_kana = True
-                    break
-            if not has_kana:
-                raise ValueError('Invalid on_yomi: contains no kana')
-        if kun_yomi is not None:
-            has_kana = False
-            for c in kun_yomi:
-                if is_kana(c):
-                    has_kana = True
-                    break
-            if  not has_kana:
-                raise ValueError('Invalid kun_yomi: contains no kana')
+        if on_yomi is not None and not has_kana(on_yomi):
+            raise ValueError('Invalid on_yomi: contains no kana')
+        if kun_yomi is not None and not has_kana(kun_yomi):
+            raise ValueError('Invalid kun_yomi: contains no kana')
+        return kanji, on_yomi, kun_yomi, meaning
+
+
+    @staticmethod
+    def _reading_kana(on_yomi: str | None, kun_yomi: str | None) -> set[str]:
+        return set(kana_in(f'{on_yomi or ""}{kun_yomi or ""}'))
+
+
+    @classmethod
+    def create(cls,
+               kanji: str,
+               on_yomi: str | None = None,
+               kun_yomi: str | None = None,
+               meaning: str | None = None,
+               require_relationships: bool = True):
+        # Check parameters
+        kanji, on_yomi, kun_yomi, meaning = cls._check_args(kanji, on_yomi, kun_yomi, meaning)
                 
         # Check uniqueness
         extant_card = cls.by_kanji(kanji)
@@ -120,14 +137,7 @@ class KanjiCard:
         # Check prereqs if required
         kana_cards = []
         if require_relationships:
-            kana = []
-            if on_yomi:
-                kana = [k for k in on_yomi if is_kana(k)]
-            if kun_yomi:
-                kana += [k for k in kun_yomi if is_kana(k)]
-            kana = list(set(kana))
-
-            for k in kana:
+            for k in cls._reading_kana(on_yomi, kun_yomi):
                 kana_c = KanaCard.by_kana(k)
                 if not kana_c:
                     raise ValueError(f"Invalid on_yomi or kun_yomi: uknown kana '{k}'")
@@ -141,10 +151,8 @@ class KanjiCard:
             for kana_c in kana_cards:
                 c.add_prereq(kana_c.card)
         
-        # Find new minimum id
-        new_id = min(cls._id_cache, default=1) - 1
-        if new_id > 0:
-            new_id = 0
+        new_id = cls._next_temp_id
+        cls._next_temp_id -= 1
 
         # Instantiate and cache
         obj = KanjiCard(new_id, c, None, kanji, on_yomi, kun_yomi, meaning, False)
@@ -153,6 +161,67 @@ class KanjiCard:
         return obj
 
 
+    @classmethod
+    def create_many(cls,
+                    rows: Sequence[Mapping[str, str | None]],
+                    require_relationships: bool = True,
+                    on_error: Callable[[int, ValueError], None] | None = None,
+                    con: sqla.Connection | None = None) -> list[KanjiCard | None]:
+        '''Creates a card for each row of create's keyword arguments (kanji,
+        on_yomi, kun_yomi, meaning). Every row is checked before any card is
+        made: the kanji already taken and the kana of every reading are each
+        looked up for all rows at once, and the relations are made in one
+        batch. A bad row raises ValueError, or when on_error is given is
+        passed to it with its index and left as None in the result.'''
+        results: list[KanjiCard | None] = [None] * len(rows)
+        valid: dict[int, tuple[str, str | None, str | None, str | None]] = {}
+
+        def reject(i: int, e: ValueError):
+            if on_error is None:
+                raise ValueError(f'Row {i}: {e}') from e
+            on_error(i, e)
+            valid.pop(i, None)
+
+        for i, row in enumerate(rows):
+            try:
+                valid[i] = cls._check_args(**row)
+            except (ValueError, TypeError) as e:
+                reject(i, ValueError(str(e)))
+
+        # Check uniqueness, against other rows too
+        taken = set(cls.by_kanji_many((v[0] for v in valid.values()), con=con))
+        for i, (kanji, *_) in list(valid.items()):
+            if kanji in taken:
+                reject(i, ValueError('Invalid kanji: not unique'))
+            taken.add(kanji)
+
+        # Check prereqs if required
+        needed: dict[int, list[str]] = {}
+        kana_cards: dict[str, KanaCard] = {}
+        if require_relationships:
+            for i, (_, on_yomi, kun_yomi, _) in valid.items():
+                needed[i] = sorted(cls._reading_kana(on_yomi, kun_yomi))
+            kana_cards = KanaCard.by_kana_many({k for ks in needed.values() for k in ks}, con=con)
+            for i, kana in needed.items():
+                unknown = [k for k in kana if k not in kana_cards]
+                if unknown:
+                    reject(i, ValueError(f"Invalid on_yomi or kun_yomi: uknown kana '{unknown[0]}'"))
+
+        # Create the cards, then every kana relationship in one batch
+        cards = Card._create_many(KANJI_CARD_KIND, len(valid))
+        pairs = []
+        start = cls._next_temp_id
+        cls._next_temp_id -= len(valid)
+        for n, (c, (i, (kanji, on_yomi, kun_yomi, meaning))) in enumerate(zip(cards, valid.items())):
+            obj = KanjiCard(start - n, c, None, kanji, on_yomi, kun_yomi, meaning, False)
+            cls._add_to_cache(obj)
+            results[i] = obj
+            pairs.extend((c, kana_cards[k].card) for k in needed.get(i, ()))
+        CardRelation._create_many(pairs, True, False)
+
+        return results
+
+
     @classmethod
     def _load_from_db(cls, con: sqla.Connection | None = None):
         if cls._searched_db:
@@ -238,6 +307,32 @@ class KanjiCard:
                 obj = KanjiCard._create_from_mapping(res)
         return obj
 
+
+    @classmethod
+    def by_kanji_many(cls, kanji: Iterable[str], con: sqla.Connection | None = None) -> dict[str, KanjiCard]:
+        '''The cards of every kanji found, reading those not cached with one
+        query for the cards and one for their Card rows per IN_CLAUSE_BATCH'''
+        found = {}
+        missing = []
+        for k in set(kanji):
+            obj = cls._kanji_cache.get(k)
+            if obj is not None:
+                found[k] = obj
+            elif not cls._searched_db:
+                missing.append(k)
+
+        if missing:
+            with maybe_connection(con) as con2:
+                for i in range(0, len(missing), IN_CLAUSE_BATCH):
+                    stmnt = sqla.select(kanji_card_table)\
+                                .where(kanji_card_table.c.kanji.in_(missing[i:i + IN_CLAUSE_BATCH]))
+                    rows = con2.execute(stmnt).mappings().all()
+                    Card.by_ids([int(r['card_id']) for r in rows], con=con2)
+                    for row in rows:
+                        obj = KanjiCard._create_from_mapping(row, con=con2)
+                        found[obj.kanji] = obj
+        return found
+
     
     # Constructor ##############################################################
 
@@ -314,7 +409,7 @@ class KanjiCard:
 
     @kun_yomi.setter
     def kun_yomi(self, ky: str | None):
-        if ky == self._on_yomi:
+        if ky == self._kun_yomi:
             return
         self._kun_yomi = ky
         self._synced = False
@@ -330,7 +425,7 @@ class KanjiCard:
         if m == self._meaning:
             return
         self._meaning = m
-        self._synced
+        self._synced = False
     
 
     @property
@@ -339,53 +434,40 @@ class KanjiCard:
 
     # Methods ##################################################################
 
+    def _flush_dependencies(self) -> list:
+        deps = []
+        if not self._card.synced:
+            deps.append(self._card)
+        dw = self.drawing
+        if dw is not None and not dw.synced:
+            deps.append(dw)
+        return deps
+
+
+    def _flush_row(self, inserting: bool, new_ids: dict) -> dict:
+        if self._drawing_id is not None:
+            self._drawing_id = new_ids.get((Drawing, self._drawing_id), self._drawing_id)
+        row = {'drawing_id': self._drawing_id,
+               'on_yomi': self._on_yomi,
+               'kun_yomi': self._kun_yomi,
+               'meaning': self._meaning}
+        if inserting:
+            row['card_id'] = self._card.id
+            row['kanji'] = self._kanji
+        return row
+
+
     def sync(self, con: sqla.Connection | None = None) -> int:
-        with maybe_connection_commit(con) as con2:
-            if not self._card.synced:
-                c = self.card
-                old_id = c.id
-                self.card.sync(con=con2)
-                if old_id != c.id:
-                    self._synced = False
-            if self.drawing and not self.drawing.synced:
-                dw = self.drawing
-                old_id = dw.id
-                dw.sync(con=con2)
-                if old_id != dw.id:
-                    self._drawing_id = dw.id
-                    self._synced = False
-
-            # If already synced
-            if self.synced:
-                pass
-            # If updating
-            elif self._db_id > 0:
-                res = con2.execute(
-                    sqla.update(kanji_card_table)\
-                        .where(kanji_card_table.c.id == self._db_id)\
-                        .returning(kanji_card_table.c.id)\
-                        .values(
-                            drawing_id=self._drawing_id,
-                            kun_yomi=self._kun_yomi,
-                            on_yomi=self._on_yomi,
-                            meaning=self._meaning))
-                _ = res.scalar_one()
-            # If creating
-            else:
-                KanjiCard._remove_from_cache(self)
-                res = con2.execute(
-                    sqla.insert(kanji_card_table)\
-                        .returning(kanji_card_table.c.id)\
-                        .values(
-                            card_id=self._card._db_id,
-                            drawing_id=self._drawing_id,
-                            kanji=self._kanji,
-                            on_yomi=self._on_yomi,
-                            kun_yomi=self._kun_yomi,
-                            meaning=self._meaning))
-                self._db_id = res.scalar_one()
-                KanjiCard._add_to_cache(self)
-
-        self._synced = True
+        '''Saves the card along with its card, relations and drawing'''
+        UnitOfWork([self]).flush(con)
         return self._db_id
 
+
+
+register_wrapper(KanjiCard,
+                 kanji_card_table,
+                 1,
+                 KanjiCard._remove_from_cache,
+                 KanjiCard._add_to_cache,
+                 KanjiCard._sync_listeners,
+                 keyed_on=(Card, KanjiCard._by_cached_card))
@@ -0,0 +1,203 @@
+# Description: Versioned schema and data migrations for the database,
+#     tracked with PRAGMA user_version
+
+
+################################################################################
+# Imports
+################################################################################
+
+from __future__ import annotations
+import os
+import pickle
+import sqlite3
+import time
+from datetime import datetime
+from typing import Callable
+import sqlalchemy as sqla
+from . import database
+from .database import _metadata, card_table, drawing_table, glyph_confusable_bucket_table, PackedStrokes
+
+################################################################################
+# Globals
+################################################################################
+
+# Called with (migration description, rows done, rows total)
+Progress = Callable[[str, int, int], None]
+
+STROKE_BATCH_SIZE = 500
+
+################################################################################
+# Migrations
+################################################################################
+# Each migration upgrades the database from version - 1 to version. pysqlite
+# only opens a transaction on its own before INSERT/UPDATE/DELETE and runs
+# ALTER TABLE and CREATE INDEX in autocommit mode, so migrate starts each step
+# with an explicit BEGIN: schema steps then roll back with the version stamp
+# if the step fails. Data steps may commit in batches, which ends that
+# transaction early, so they must be safe to rerun after an interruption.
+
+
+
+def _baseline(con: sqla.Connection, progress: Progress) -> None:
+    '''The schema as create_all built it before versioning. Tables added to
+    _metadata since are created here too (create_all skips existing ones).'''
+    _metadata.create_all(con)
+
+
+
+def _pack_strokes(con: sqla.Connection, progress: Progress) -> None:
+    '''Re-encodes pickled drawing strokes as PackedStrokes, a batch of ids at a
+    time. Rows already packed are skipped, so an interrupted run picks up
+    where it stopped.'''
+    raw = sqla.table('drawings', sqla.column('id', sqla.Integer), sqla.column('strokes', sqla.LargeBinary))
+    total = con.execute(sqla.select(sqla.func.count()).select_from(raw)).scalar_one()
+    done = 0
+    last_id = None
+    while True:
+        stmnt = sqla.select(raw.c.id, raw.c.strokes).order_by(raw.c.id).limit(STROKE_BATCH_SIZE)
+        if last_id is not None:
+            stmnt = stmnt.where(raw.c.id > last_id)
+        rows = con.execute(stmnt).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = [{'b_id': r.id, 'b_strokes': PackedStrokes.encode(pickle.loads(r.strokes))}
+                   for r in rows if not r.strokes.startswith(PackedStrokes.MAGIC)]
+        if updates:
+            con.execute(sqla.update(raw)
+                            .where(raw.c.id == sqla.bindparam('b_id'))
+                            .values(strokes=sqla.bindparam('b_strokes')),
+                        updates)
+        con.commit()
+        done += len(rows)
+        progress('Packing drawing strokes', done, total)
+
+
+
+def _index_drawing_glyphs(con: sqla.Connection, progress: Progress) -> None:
+    '''Lets glyph lookups and the glyph index's GROUP BY glyph read an index
+    instead of every drawing row'''
+    for ix in drawing_table.indexes:
+        if ix.name == 'ix_drawings_glyph':
+            ix.create(con, checkfirst=True)
+
+
+
+def _materialize_unlocked(con: sqla.Connection, progress: Progress) -> None:
+    '''Adds cards.unlocked with its (kind, unlocked, study_id) index and fills
+    it in with one UPDATE'''
+    columns = {c['name'] for c in sqla.inspect(con).get_columns('cards')}
+    if 'unlocked' not in columns:
+        con.exec_driver_sql('ALTER TABLE cards ADD COLUMN unlocked BOOLEAN NOT NULL DEFAULT 0')
+    for ix in card_table.indexes:
+        if ix.name == 'ix_cards_kind_unlocked_study':
+            ix.create(con, checkfirst=True)
+    con.exec_driver_sql(
+        'UPDATE cards SET unlocked = NOT EXISTS ('
+        'SELECT 1 FROM card_relation AS r JOIN cards AS b ON r.card_b_id = b.id '
+        'WHERE r.card_a_id = cards.id AND r.b_is_prereq AND b.study_id < 1)')
+
+
+
+def _record_confusable_sources(con: sqla.Connection, progress: Progress) -> None:
+    '''Adds glyph_confusable_buckets. Confusables computed before it have no
+    recorded source, so they are ignored until compute_confusables reruns.'''
+    glyph_confusable_bucket_table.create(con, checkfirst=True)
+
+
+
+_MIGRATIONS: list[tuple[int, str, Callable[[sqla.Connection, Progress], None]]] = [
+    (1, 'Baseline schema', _baseline),
+    (2, 'Pack drawing strokes', _pack_strokes),
+    (3, 'Index drawings by glyph', _index_drawing_glyphs),
+    (4, 'Materialize unlocked cards', _materialize_unlocked),
+    (5, 'Record confusable sources', _record_confusable_sources),
+]
+
+SCHEMA_VERSION = _MIGRATIONS[-1][0]
+
+################################################################################
+# Helper Functions
+################################################################################
+
+
+
+def _print_progress(description: str, done: int, total: int) -> None:
+    print(f'{description}: {done}/{total}')
+
+
+
+def user_version(con: sqla.Connection) -> int:
+    return int(con.exec_driver_sql('PRAGMA user_version').scalar_one())
+
+
+
+def _begin(con: sqla.Connection) -> None:
+    # pysqlite would leave DDL in autocommit mode, see the note on migrations
+    con.exec_driver_sql('BEGIN')
+
+
+
+def _set_user_version(con: sqla.Connection, version: int) -> None:
+    # PRAGMA does not take bound parameters
+    con.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+
+
+
+def backup_database(tag: str) -> str:
+    '''Copies the live database into db_backups with the SQLite online backup
+    API, which gives a consistent snapshot even while it is open elsewhere.
+    Returns the path of the copy.'''
+    os.makedirs(database._backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(database._backup_dir, f'{os.path.basename(database._db_path)}.{tag}_{stamp}.bak')
+    src = database._engine.raw_connection()
+    try:
+        dst = sqlite3.connect(path)
+        try:
+            src.driver_connection.backup(dst)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    return path
+
+
+
+def migrate(progress: Progress | None = None) -> int:
+    '''Brings the database up to SCHEMA_VERSION and returns the version it was
+    at. A new database is created at the current schema directly; an existing
+    one is backed up before the first pending migration runs. Raises
+    RuntimeError if the database is newer than this code.'''
+    if progress is None:
+        progress = _print_progress
+
+    with database._engine.connect() as con:
+        start = user_version(con)
+        if start == SCHEMA_VERSION:
+            return start
+        if start > SCHEMA_VERSION:
+            raise RuntimeError(f'Database version {start} is newer than supported version {SCHEMA_VERSION}')
+
+        if start == 0 and not sqla.inspect(con).get_table_names():
+            _begin(con)
+            _metadata.create_all(con)
+            _set_user_version(con, SCHEMA_VERSION)
+            con.commit()
+            return start
+
+    path = backup_database(f'v{start}')
+    print(f'Backed up database to {path}')
+
+    with database._engine.connect() as con:
+        for version, description, step in _MIGRATIONS:
+            if version <= start:
+                continue
+            start_time = time.perf_counter()
+            _begin(con)
+            step(con, progress)
+            _set_user_version(con, version)
+            con.commit()
+            print(f'Migrated database to version {version} ({description}) '
+                  f'in {time.perf_counter() - start_time:.2f}s')
+    return start
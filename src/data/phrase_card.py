@@ -7,13 +7,15 @@
 ################################################################################
 
 from __future__ import annotations
-from typing import Mapping
+from typing import Callable, Mapping, Sequence
 import sqlalchemy as sqla
-from .database import phrase_card_table, maybe_connection, maybe_connection_commit, PHRASE_CARD_KIND
-from .card import Card
-from .helpers import is_kana, is_kanji
+from .database import phrase_card_table, maybe_connection, PHRASE_CARD_KIND
+from .card import Card, CardRelation
+from .helpers import first_kanji, glyph_sets, has_kana, has_kanji, kana_in, kanji_in
 from .kana_card import KanaCard
 from .kanji_card import KanjiCard
+from .glyph_index import GlyphIndex
+from .unit_of_work import UnitOfWork, register_wrapper
 
 ################################################################################
 # class Definition
@@ -28,9 +30,16 @@ class PhraseCard:
     _card_id_cache: dict[int, PhraseCard] = {}
     _kanji_phrase_cache: dict[str, dict[int,PhraseCard]] = {}
     _searched_db: bool = False
+    _next_temp_id: int = 0
+    _sync_listeners: list[Callable[[PhraseCard], None]] = []
 
     # Class Methods ############################################################
 
+    @classmethod
+    def add_sync_listener(cls, fn: Callable[[PhraseCard], None]):
+        '''Registers a function called with the card every time it is synced'''
+        cls._sync_listeners.append(fn)
+
     @classmethod
     def _add_to_cache(cls, pc: PhraseCard):
         assert pc._db_id not in cls._id_cache
@@ -65,6 +74,11 @@ class PhraseCard:
             del cls._kanji_phrase_cache[pc.kanji_phrase]
 
 
+    @classmethod
+    def _by_cached_card(cls, card: Card) -> PhraseCard | None:
+        obj = cls._card_id_cache.get(card.id)
+        return obj if obj is not None and obj.card is card else None
+
     @classmethod
     def _create_from_mapping(cls, m: Mapping, con: sqla.Connection | None = None) -> PhraseCard:
         db_id = int(m['id'])
@@ -94,14 +108,13 @@ class PhraseCard:
         return obj
 
 
-    @classmethod
-    def create(cls,
-               meaning: str,
-               grammar: str | None = None,
-               kanji_phrase: str | None = None,
-               kana_phrase: str | None = None,
-               require_relationship = True) -> PhraseCard:
-        # Check parameters
+    @staticmethod
+    def _check_args(meaning: str,
+                    grammar: str | None = None,
+                    kanji_phrase: str | None = None,
+                    kana_phrase: str | None = None) -> tuple[str, str | None, str | None, str | None]:
+        '''Validates the arguments of create, returning them with empty
+        phrases as None'''
         if kanji_phrase == '':
             kanji_phrase = None
         if kana_phrase == '':
@@ -115,44 +128,46 @@ class PhraseCard:
             raise ValueError('Invalid grammar: cannot be empty string')
 
         if kana_phrase:
-            contains_kana = False
-            for c in kana_phrase:
-                if not contains_kana and is_kana(c):
-                    contains_kana = True
-                if is_kanji(c):
-                    raise ValueError(f"Invalid kana phrase: contains kanji '{c}'")
-            if not contains_kana:
+            c = first_kanji(kana_phrase)
+            if c is not None:
+                raise ValueError(f"Invalid kana phrase: contains kanji '{c}'")
+            if not has_kana(kana_phrase):
                 raise ValueError('Invalid kana phrase: contains no kana')
 
-        if kanji_phrase:
-            contains_kanji = False
-            for c in kanji_phrase:
-                if is_kanji(c):
-                    contains_kanji = True
-                    break
-            if not contains_kanji:
-                raise ValueError('Invalid kanji phrase: contains no kanji')
+        if kanji_phrase and not has_kanji(kanji_phrase):
+            raise ValueError('Invalid kanji phrase: contains no kanji')
+        return meaning, grammar, kanji_phrase, kana_phrase
+
+
+    @staticmethod
+    def _phrase_glyphs(kanji_phrase: str | None, kana_phrase: str | None) -> tuple[list[str], list[str]]:
+        '''The distinct kana and kanji a phrase card depends on'''
+        kana, kanji = glyph_sets((kanji_phrase,))
+        kana.update(kana_in(kana_phrase or ''))
+        return sorted(kana), sorted(kanji)
+
+
+    @classmethod
+    def create(cls,
+               meaning: str,
+               grammar: str | None = None,
+               kanji_phrase: str | None = None,
+               kana_phrase: str | None = None,
+               require_relationship = True) -> PhraseCard:
+        # Check parameters
+        meaning, grammar, kanji_phrase, kana_phrase = cls._check_args(meaning, grammar, kanji_phrase, kana_phrase)
 
         # Check prereqs if required
         prereq_cards: list[Card] = []
         if require_relationship:
-            kana = []
-            kanji = []
-            if kana_phrase:
-                kana += [k for k in kana_phrase if is_kana(k)]
-            if kanji_phrase:
-                kana += [k for k in kanji_phrase if is_kana(k)]
-                kanji = [k for k in kanji_phrase if is_kanji(k)]
-            kana = list(set(kana))
-            kanji = list(set(kanji))
-
+            kana, kanji = cls._phrase_glyphs(kanji_phrase, kana_phrase)
             for k in kana:
-                kana_c = KanaCard.by_kana(k)
+                kana_c = GlyphIndex.kana_card(k)
                 if kana_c is None:
                     raise ValueError(f"Invalid kana or kanji phrase: contains unknown kana '{k}'")
                 prereq_cards.append(kana_c.card)
             for k in kanji:
-                kanji_c = KanjiCard.by_kanji(k)
+                kanji_c = GlyphIndex.kanji_card(k)
                 if kanji_c is None:
                     raise ValueError(f"Invalid kanji phrase: contains unknown kanji '{k}'")
                 prereq_cards.append(kanji_c.card)
@@ -166,10 +181,8 @@ class PhraseCard:
             for prereq in prereq_cards:
                 c.add_prereq(prereq)
 
-        # Find new minimum id
-        new_id = min(cls._id_cache, default=1) - 1
-        if new_id > 0:
-            new_id = 0
+        new_id = cls._next_temp_id
+        cls._next_temp_id -= 1
         
         #Instantiate and cache
         obj = PhraseCard(new_id, c, kanji_phrase, kana_phrase, meaning, grammar, False)
@@ -177,6 +190,68 @@ class PhraseCard:
         return obj
 
 
+    @classmethod
+    def create_many(cls,
+                    rows: Sequence[Mapping[str, str | None]],
+                    require_relationship: bool = True,
+                    on_error: Callable[[int, ValueError], None] | None = None,
+                    con: sqla.Connection | None = None) -> list[PhraseCard | None]:
+        '''Creates a card for each row of create's keyword arguments (meaning,
+        grammar, kanji_phrase, kana_phrase). Every row is checked before any
+        card is made: the kana and kanji of all rows are looked up together
+        and the relations are made in one batch, so the cost grows with the
+        number of rows and not with rows times characters looked up. A bad
+        row raises ValueError, or when on_error is given is passed to it with
+        its index and left as None in the result.'''
+        results: list[PhraseCard | None] = [None] * len(rows)
+        valid: dict[int, tuple[str, str | None, str | None, str | None]] = {}
+
+        def reject(i: int, e: ValueError):
+            if on_error is None:
+                raise ValueError(f'Row {i}: {e}') from e
+            on_error(i, e)
+            valid.pop(i, None)
+
+        for i, row in enumerate(rows):
+            try:
+                valid[i] = cls._check_args(**row)
+            except (ValueError, TypeError) as e:
+                reject(i, ValueError(str(e)))
+
+        # Check prereqs if required, resolving the union of every row's glyphs
+        needed: dict[int, tuple[list[str], list[str]]] = {}
+        kana_cards: dict[str, KanaCard] = {}
+        kanji_cards: dict[str, KanjiCard] = {}
+        if require_relationship:
+            for i, (_, _, kanji_phrase, kana_phrase) in valid.items():
+                needed[i] = cls._phrase_glyphs(kanji_phrase, kana_phrase)
+            kana_cards = KanaCard.by_kana_many({k for ks, _ in needed.values() for k in ks}, con=con)
+            kanji_cards = KanjiCard.by_kanji_many({k for _, ks in needed.values() for k in ks}, con=con)
+            for i, (kana, kanji) in needed.items():
+                unknown_kana = [k for k in kana if k not in kana_cards]
+                unknown_kanji = [k for k in kanji if k not in kanji_cards]
+                if unknown_kana:
+                    reject(i, ValueError(f"Invalid kana or kanji phrase: contains unknown kana '{unknown_kana[0]}'"))
+                elif unknown_kanji:
+                    reject(i, ValueError(f"Invalid kanji phrase: contains unknown kanji '{unknown_kanji[0]}'"))
+
+        # Create the cards, then every relationship in one batch
+        cards = Card._create_many(PHRASE_CARD_KIND, len(valid))
+        pairs = []
+        start = cls._next_temp_id
+        cls._next_temp_id -= len(valid)
+        for n, (c, (i, (meaning, grammar, kanji_phrase, kana_phrase))) in enumerate(zip(cards, valid.items())):
+            obj = PhraseCard(start - n, c, kanji_phrase, kana_phrase, meaning, grammar, False)
+            cls._add_to_cache(obj)
+            results[i] = obj
+            kana, kanji = needed.get(i, ((), ()))
+            pairs.extend((c, kana_cards[k].card) for k in kana)
+            pairs.extend((c, kanji_cards[k].card) for k in kanji)
+        CardRelation._create_many(pairs, True, False)
+
+        return results
+
+
     @classmethod
     def _load_from_db(cls, con: sqla.Connection | None = None):
         if cls._searched_db:
@@ -327,14 +402,8 @@ class PhraseCard:
         if kp == self._kanji_phrase:
             return
 
-        if kp:
-            has_kanji = False
-            for c in kp:
-                if is_kanji(c):
-                    has_kanji = True
-                    break
-            if not has_kanji:
-                raise ValueError("Invalid kanji phrase: contains no kanji")
+        if kp and not has_kanji(kp):
+            raise ValueError("Invalid kanji phrase: contains no kanji")
 
         self._kanji_phrase = kp
         self._synced = False
@@ -352,9 +421,9 @@ class PhraseCard:
             return
         
         if kp:
-            for c in kp:
-                if is_kanji(c):
-                    raise ValueError(f"Invalid kana phrase: contains kanji '{c}'")
+            c = first_kanji(kp)
+            if c is not None:
+                raise ValueError(f"Invalid kana phrase: contains kanji '{c}'")
 
         self._kana_phrase = kp
         self._synced = False
@@ -394,60 +463,40 @@ class PhraseCard:
     def get_kanji(self) -> list[str]:
         ''' Returns all kanji found in the kanji phrase of this card'''
         if self._kanji_phrase:
-            l = [k for k in self._kanji_phrase if is_kanji(k)]
-            return list(set(l)) # remove duplicates
+            return list(set(kanji_in(self._kanji_phrase))) # remove duplicates
         return []
 
     def get_kana(self) -> list[str]:
         '''Returns all kana found in the kana and kanji phrase of this card'''
-        l = []
-        if self._kanji_phrase:
-            l = [k for k in self._kanji_phrase if is_kana(k)]
-        if self._kana_phrase:
-            l += [k for k in self._kana_phrase if is_kana(k)]
-        return list(set(l))
+        kana, _ = glyph_sets((self._kanji_phrase, self._kana_phrase))
+        return list(kana)
 
 
-    def sync(self, con: sqla.Connection | None = None) -> int:
+    def _flush_dependencies(self) -> list:
+        return [] if self._card.synced else [self._card]
+
+
+    def _flush_row(self, inserting: bool, new_ids: dict) -> dict:
+        row = {'kanji_phrase': self._kanji_phrase,
+               'kana_phrase': self._kana_phrase,
+               'meaning': self._meaning,
+               'grammar': self._grammar}
+        if inserting:
+            row['card_id'] = self._card.id
+        return row
 
-        with maybe_connection_commit(con) as con2:
-            if not self.card.synced:
-                c = self.card
-                old_id = c.id
-                self._card.sync(con=con2)
-                if old_id != c.id:
-                    self._synced = False
-
-            # If already synced
-            if self.synced:
-                pass
-            # If updating
-            elif self._db_id > 0:
-                res = con2.execute(
-                    sqla.update(phrase_card_table)\
-                        .where(phrase_card_table.c.id == self._db_id)\
-                        .returning(phrase_card_table.c.id)\
-                        .values(
-                            kanji_phrase=self._kanji_phrase,
-                            kana_phrase=self._kana_phrase,
-                            meaning=self._meaning,
-                            grammar=self._grammar))
-                _ = res.scalar_one()
-            # If creating
-            else:
-                PhraseCard._remove_from_cache(self)
-                res = con2.execute(
-                    sqla.insert(phrase_card_table)\
-                        .returning(phrase_card_table.c.id)\
-                        .values(
-                            card_id=self._card._db_id,
-                            kanji_phrase=self._kanji_phrase,
-                            kana_phrase=self._kana_phrase,
-                            meaning=self._meaning,
-                            grammar=self._grammar))
-                self._db_id = res.scalar_one()
-                PhraseCard._add_to_cache(self)
-
-        self._synced = True
+
+    def sync(self, con: sqla.Connection | None = None) -> int:
+        '''Saves the card along with its card and relations'''
+        UnitOfWork([self]).flush(con)
         return self._db_id
 
+
+
+register_wrapper(PhraseCard,
+                 phrase_card_table,
+                 1,
+                 PhraseCard._remove_from_cache,
+                 PhraseCard._add_to_cache,
+                 PhraseCard._sync_listeners,
+                 keyed_on=(Card, PhraseCard._by_cached_card))
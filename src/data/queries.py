@@ -9,22 +9,12 @@ from .phrase_card import PhraseCard
 def query_learnable_card_ids(kind: str, con: sqla.Connection | None = None) -> Iterator[int]:
     '''Returns a list of card ids where each card represents a card that has not been
     studied and has no unlearned prerequisites'''
-    A = card_table
-    R = card_relation_table
-    B = card_table.alias('B')
-    has_unlearned_prereq = sqla.exists(
-        sqla.select(1)
-        .select_from(R.join(B, R.c.card_b_id == B.c.id))
-        .where(R.c.b_is_prereq == True)
-        .where(R.c.card_a_id == A.c.id)
-        .where(B.c.study_id < 1))
-
-    # query for cards where they have a study id < 1, have a kind == kind, and have no
-    # unlearned prereqs
-    q = sqla.select(A.c.id)\
-             .where(A.c.study_id < 1)\
-             .where(A.c.kind == kind)\
-             .where(~has_unlearned_prereq)
+    # cards.unlocked is kept current by Card, so this is a range scan of
+    # ix_cards_kind_unlocked_study
+    q = sqla.select(card_table.c.id)\
+             .where(card_table.c.kind == kind)\
+             .where(card_table.c.unlocked == True)\
+             .where(card_table.c.study_id < 1)
     with maybe_connection(con) as con:
         result = con.execute(q)
         for r in result:
@@ -0,0 +1,212 @@
+# Description: Saves many wrapper objects at once, grouping their INSERT and
+#     UPDATE statements by table
+
+
+################################################################################
+# Imports
+################################################################################
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable
+import sqlalchemy as sqla
+from .database import maybe_connection_commit
+
+################################################################################
+# Wrapper Registry
+################################################################################
+
+
+
+@dataclass(frozen=True)
+class _WrapperSpec:
+    table: sqla.Table
+    rank: int
+    decache: Callable[[Any], None]
+    encache: Callable[[Any], None]
+    listeners: list[Callable[[Any], None]]
+    after_flush: Callable[[sqla.Connection, list[Any]], None] | None
+    keyed_on: tuple[type, Callable[[Any], Any]] | None
+
+
+
+# Filled in by each wrapper module through register_wrapper
+_specs: dict[type, _WrapperSpec] = {}
+
+
+
+def register_wrapper(cls: type,
+                     table: sqla.Table,
+                     rank: int,
+                     decache: Callable[[Any], None],
+                     encache: Callable[[Any], None],
+                     listeners: list[Callable[[Any], None]] | None = None,
+                     after_flush: Callable[[sqla.Connection, list[Any]], None] | None = None,
+                     keyed_on: tuple[type, Callable[[Any], Any]] | None = None) -> None:
+    '''Makes a wrapper class saveable by UnitOfWork. Its rows are written after
+    those of every class with a lower rank. decache and encache remove and
+    re-add an object to the class's identity maps around its temporary id
+    being replaced, and listeners are called with each object once it is
+    saved. after_flush is called in the same transaction, once every table
+    is written, with the class's objects just saved (real ids assigned).
+    keyed_on is (other class, find) for a class with an identity map keyed on
+    the id of an object of the other class: find(other) returns the cached
+    object keyed on other's id, or None, so it can be decached and encached
+    around other getting its real id even when it is not itself being saved.
+    Instances must provide:
+
+        _flush_dependencies() -> list of objects that must be saved first
+        _flush_row(inserting, new_ids) -> column values to write, where
+            new_ids maps (class, temporary id) to the id just assigned'''
+    _specs[cls] = _WrapperSpec(table,
+                               rank,
+                               decache,
+                               encache,
+                               listeners if listeners is not None else [],
+                               after_flush,
+                               keyed_on)
+
+################################################################################
+# Class Definition
+################################################################################
+
+class UnitOfWork:
+    '''Collects wrapper objects (cards, relations, drawings) and saves them
+    and everything they depend on in a single transaction. Rows are written
+    one table at a time in dependency order: new rows with one batched
+    INSERT ... RETURNING per table, changed rows with one executemany UPDATE
+    per table and set of columns. Temporary ids are replaced in the identity
+    maps once the real ids are known.'''
+
+    def __init__(self, objs: Iterable[Any] = ()):
+        self._objs: dict[int, Any] = {}
+        self.add_all(objs)
+
+
+
+    def add(self, obj: Any) -> None:
+        if type(obj) not in _specs:
+            raise TypeError(f'{type(obj).__name__} is not a registered wrapper')
+        self._objs.setdefault(id(obj), obj)
+
+
+
+    def add_all(self, objs: Iterable[Any]) -> None:
+        for obj in objs:
+            self.add(obj)
+
+
+
+    def _collect(self) -> list[Any]:
+        '''Unsynced added objects plus their unsynced dependencies, each once'''
+        seen: set[int] = set()
+        out: list[Any] = []
+        stack = list(self._objs.values())
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            if not obj.synced:
+                out.append(obj)
+            stack.extend(d for d in obj._flush_dependencies() if id(d) not in seen)
+        return out
+
+
+
+    def flush(self, con: sqla.Connection | None = None) -> None:
+        pending = self._collect()
+        by_class: dict[type, list[Any]] = {}
+        for obj in pending:
+            by_class.setdefault(type(obj), []).append(obj)
+        order = sorted(by_class, key=lambda c: _specs[c].rank)
+
+        # Every new object leaves the identity maps before any id changes, as
+        # some maps are keyed on the id of another object (e.g. card_id)
+        inserting = [o for o in pending if o._db_id < 1]
+        temp_ids = [o._db_id for o in inserting]
+        rekeyed = inserting + self._keyed_on(inserting)
+        for obj in rekeyed:
+            _specs[type(obj)].decache(obj)
+
+        new_ids: dict[tuple[type, int], int] = {}
+        try:
+            with maybe_connection_commit(con) as con:
+                for cls in order:
+                    self._flush_class(con, cls, by_class[cls], new_ids)
+                for cls in order:
+                    if _specs[cls].after_flush is not None:
+                        _specs[cls].after_flush(con, by_class[cls])
+        except Exception:
+            # The transaction was rolled back, so are the ids
+            for obj, temp_id in zip(inserting, temp_ids):
+                obj._db_id = temp_id
+            for obj in rekeyed:
+                _specs[type(obj)].encache(obj)
+            raise
+
+        for obj in rekeyed:
+            _specs[type(obj)].encache(obj)
+        for obj in pending:
+            obj._synced = True
+
+        notified: set[int] = set()
+        for obj in pending + list(self._objs.values()):
+            if id(obj) not in notified:
+                notified.add(id(obj))
+                for fn in _specs[type(obj)].listeners:
+                    fn(obj)
+        self._objs.clear()
+
+
+
+    @staticmethod
+    def _keyed_on(inserting: list[Any]) -> list[Any]:
+        '''Cached objects outside inserting whose identity maps are keyed on
+        the id of an object in it (e.g. the KanaCard of a new Card saved
+        through a relation, without the KanaCard itself)'''
+        seen = {id(o) for o in inserting}
+        out: list[Any] = []
+        finders = [spec.keyed_on for spec in _specs.values() if spec.keyed_on is not None]
+        for obj in inserting:
+            for other_cls, find in finders:
+                if not isinstance(obj, other_cls):
+                    continue
+                dep = find(obj)
+                if dep is not None and id(dep) not in seen:
+                    seen.add(id(dep))
+                    out.append(dep)
+        return out
+
+
+
+    @staticmethod
+    def _flush_class(con: sqla.Connection,
+                     cls: type,
+                     objs: list[Any],
+                     new_ids: dict[tuple[type, int], int]) -> None:
+        table = _specs[cls].table
+        inserts = [o for o in objs if o._db_id < 1]
+        updates = [o for o in objs if o._db_id > 0]
+
+        if inserts:
+            rows = [o._flush_row(True, new_ids) for o in inserts]
+            res = con.execute(sqla.insert(table).returning(table.c.id, sort_by_parameter_order=True), rows)
+            for o, new_id in zip(inserts, res.scalars()):
+                new_ids[(cls, o._db_id)] = new_id
+                o._db_id = new_id
+
+        # executemany needs the same columns in every row
+        groups: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+        for o in updates:
+            row = o._flush_row(False, new_ids)
+            if not row:
+                continue
+            params = {f'b_{k}': v for k, v in row.items()}
+            params['b_id'] = o._db_id
+            groups.setdefault(tuple(sorted(row)), []).append(params)
+        for columns, params in groups.items():
+            stmnt = sqla.update(table)\
+                        .where(table.c.id == sqla.bindparam('b_id'))\
+                        .values({c: sqla.bindparam(f'b_{c}') for c in columns})
+            con.execute(stmnt, params)
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from PyQt6.QtCore import QSettings
+import getpass
+
+from logic.grade_handwriting import DEFAULT_ORDER_WEIGHT
+
+# Stored next to the theme (see ThemeManager)
+_IGNORE_ORDER_KEY = "grading/ignore_order"
+_ORDER_WEIGHT_KEY = "grading/order_weight"
+
+
+def _settings() -> QSettings:
+    return QSettings(getpass.getuser(), "JapaneseLearningApp")
+
+
+def grading_options() -> tuple[bool, float]:
+    """(ignore_order, order_weight) for grade_strokes, as chosen in the
+    settings menu"""
+    settings = _settings()
+    ignore_order = settings.value(_IGNORE_ORDER_KEY, False, type=bool)
+    order_weight = settings.value(_ORDER_WEIGHT_KEY, DEFAULT_ORDER_WEIGHT, type=float)
+    return bool(ignore_order), float(order_weight)
+
+
+def set_ignore_order(ignore_order: bool) -> None:
+    _settings().setValue(_IGNORE_ORDER_KEY, ignore_order)
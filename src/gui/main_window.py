@@ -23,6 +23,7 @@ from gui.pages.review_kanji_page import ReviewKanjiPage
 from gui.pages.review_phrase_page import ReviewPhrasePage
 
 from gui.theme_manager import ThemeManager, THEMES
+from gui.grading_settings import grading_options, set_ignore_order
 
 
 class MainWindow(QMainWindow):
@@ -75,6 +76,7 @@ class MainWindow(QMainWindow):
         self.settings_menu = QMenu()
         self.settings_btn.setMenu(self.settings_menu)
         self.setup_theme_menu()
+        self.setup_grading_menu()
         menu_bar_layout.addWidget(self.settings_btn)
 
         # ------------------------------------------------------------------
@@ -179,6 +181,18 @@ class MainWindow(QMainWindow):
             partial(self.navigate_to, "Complete the Sentence")
         )
 
+    def setup_grading_menu(self):
+        self.grading_submenu = self.settings_menu.addMenu("Grading")
+        assert self.grading_submenu is not None
+
+        # Grades the shape of each stroke whatever order they were written in,
+        # a wrong order then only costs a little (see grade_strokes)
+        self.ignore_order_action = QAction("Accept any stroke order", self)
+        self.ignore_order_action.setCheckable(True)
+        self.ignore_order_action.setChecked(grading_options()[0])
+        self.ignore_order_action.toggled.connect(set_ignore_order)
+        self.grading_submenu.addAction(self.ignore_order_action)
+
     def setup_theme_menu(self):
         self.theme_submenu = self.settings_menu.addMenu("Themes")
         self.theme_action_group = QActionGroup(self)
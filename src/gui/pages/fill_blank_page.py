@@ -5,11 +5,15 @@ from typing import Optional
 from PyQt6 import QtCore, QtWidgets
 from PyQt6.QtCore import Qt
 
-from data import Drawing, KanaCard, KanjiCard
+from data import Drawing, GlyphIndex
 from gui.widgets.drawing_display import DrawingDisplay
 from gui.widgets.writing_widgets import CharacterDrawing
-from logic.grade_handwriting import grade_strokes
-from logic.LLM_fill_blank import FillBlankExercise, generate_fill_blank_exercise
+from logic.grade_handwriting import grade_strokes_detailed
+from gui.grading_settings import grading_options
+from logic.LLM_fill_blank import FillBlankExercise, generate_fill_blank_exercises
+
+# Number of exercises requested per OpenAI round trip
+_PREFETCH_COUNT = 10
 
 
 def _set_grade_badge(lbl: QtWidgets.QLabel, grade: int) -> None:
@@ -30,23 +34,25 @@ class _ExerciseLoader(QtCore.QThread):
 
     def run(self) -> None:
         try:
-            exercise = generate_fill_blank_exercise()
+            exercises = generate_fill_blank_exercises(_PREFETCH_COUNT)
         except Exception as exc:
             self.failed.emit(str(exc))
             return
 
-        self.loaded.emit(exercise)
+        self.loaded.emit(exercises)
 
 
 def _lookup_answer_strokes(glyph: str) -> list[list[float]] | None:
-    kana = KanaCard.by_kana(glyph)
+    kana = GlyphIndex.kana_card(glyph)
     if kana is not None and kana.drawing is not None and kana.drawing.strokes:
         return kana.drawing.strokes
 
-    kanji = KanjiCard.by_kanji(glyph)
+    kanji = GlyphIndex.kanji_card(glyph)
     if kanji is not None and kanji.drawing is not None and kanji.drawing.strokes:
         return kanji.drawing.strokes
 
+    if not GlyphIndex.has_drawing(glyph):
+        return None
     drawings = Drawing.by_glyph(glyph)
     if drawings:
         sample = next(iter(drawings.values()))
@@ -64,6 +70,7 @@ class FillBlankPracticePage(QtWidgets.QWidget):
         self._current: Optional[FillBlankExercise] = None
         self._last_grade: Optional[int] = None
         self._loader: Optional[_ExerciseLoader] = None
+        self._queue: list[FillBlankExercise] = []
 
         root = QtWidgets.QVBoxLayout(self)
         root.setSpacing(12)
@@ -273,14 +280,27 @@ class FillBlankPracticePage(QtWidgets.QWidget):
         self.full_sentence_label.setText("")
         self.drawing.force_clear()
         self._reset_reveal_panel()
+
+        if self._queue:
+            self._on_question_loaded(self._queue.pop(0))
+            self._finish_loading()
+            return
+
         self._begin_loading()
 
         self._loader = _ExerciseLoader(self)
-        self._loader.loaded.connect(self._on_question_loaded)
+        self._loader.loaded.connect(self._on_batch_loaded)
         self._loader.failed.connect(self._on_question_failed)
         self._loader.finished.connect(self._on_loader_finished)
         self._loader.start()
 
+    def _on_batch_loaded(self, exercises: object) -> None:
+        if not isinstance(exercises, list) or not exercises:
+            self._on_question_failed("Invalid exercise returned.")
+            return
+        self._queue = list(exercises[1:])
+        self._on_question_loaded(exercises[0])
+
     def _on_question_loaded(self, exercise: object) -> None:
         self._current = exercise if isinstance(exercise, FillBlankExercise) else None
         if self._current is None:
@@ -324,7 +344,12 @@ class FillBlankPracticePage(QtWidgets.QWidget):
             return
 
         try:
-            grade = grade_strokes(drawing, self._current.answer)
+            ignore_order, order_weight = grading_options()
+            result = grade_strokes_detailed(drawing,
+                                            self._current.answer,
+                                            ignore_order=ignore_order,
+                                            order_weight=order_weight)
+            grade = result.grade
         except Exception as exc:
             self._set_feedback(f"Could not grade this drawing: {exc}", "#b00020")
             self.drawing.force_clear()
@@ -334,14 +359,15 @@ class FillBlankPracticePage(QtWidgets.QWidget):
         _set_grade_badge(self.badge_label, grade)
 
         if grade == 0:
-            self.full_sentence_label.setText(
-                f"Answer: {self._current.answer}   •   Full sentence: {self._current.sentence}"
-            )
+            text = f"Answer: {self._current.answer}   •   Full sentence: {self._current.sentence}"
+            if result.details:
+                text += f"   •   {result.details}"
+            self.full_sentence_label.setText(text)
         elif grade == 1:
-            self.full_sentence_label.setText("")
+            self.full_sentence_label.setText(result.details)
             self.drawing.force_clear()
         else:
-            self.full_sentence_label.setText("")
+            self.full_sentence_label.setText(result.details)
             self.drawing.force_clear()
 
     def _on_cleared(self) -> None:
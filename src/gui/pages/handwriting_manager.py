@@ -1,6 +1,8 @@
-from PyQt6.QtCore import QMargins
-from PyQt6.QtWidgets import QWidget, QFormLayout, QLineEdit, QTabWidget, QMessageBox, QLabel, QVBoxLayout
+from PyQt6.QtCore import QMargins, Qt
+from PyQt6.QtWidgets import (QWidget, QFormLayout, QLineEdit, QTabWidget, QMessageBox, QLabel, QVBoxLayout,
+                             QHBoxLayout, QPushButton, QTableWidget, QTableWidgetItem, QAbstractItemView)
 from gui.widgets.writing_widgets import CharacterDrawing
+from data import Drawing
 from recognition import stroke_processor as sp
 
 
@@ -27,11 +29,11 @@ class AddUpdateCharacterTab(QWidget):
             error = True
             msg = "'Character' field left empty\n"
         if len(strokes) < 1:
+            error = True
             msg += "Canvas must contain atleast one stroke\n"
             
                 
         if error is False:
-            print(self.line_edit.text())
             sp.add_character(char, strokes)
         else:
             msg += "drawing not submitted"
@@ -69,6 +71,92 @@ class TestCharacterTab(QWidget):
             self.char_label.setText(found_char)
 
 
+class TemplateStatisticsTab(QWidget):
+    """Template counts per stroke count bucket and per glyph, with the
+    template caches' hit rates and each bucket's mean search latency"""
+
+    _BUCKET_COLUMNS = ['Strokes', 'Templates', 'Glyphs', 'Prototypes', 'Loaded', 'Searches', 'Mean ms']
+    _GLYPH_LIMIT = 50
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        top = QHBoxLayout()
+        self.cache_label = QLabel(self)
+        top.addWidget(self.cache_label, 1)
+        refresh = QPushButton('Refresh', self)
+        refresh.clicked.connect(self.refresh)
+        top.addWidget(refresh)
+        reset = QPushButton('Reset counters', self)
+        reset.clicked.connect(self._on_reset)
+        top.addWidget(reset)
+        layout.addLayout(top)
+
+        tables = QHBoxLayout()
+        self.bucket_table = QTableWidget(0, len(self._BUCKET_COLUMNS), self)
+        self.bucket_table.setHorizontalHeaderLabels(self._BUCKET_COLUMNS)
+        self.bucket_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.bucket_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.bucket_table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.bucket_table.verticalHeader().setVisible(False)
+        self.bucket_table.itemSelectionChanged.connect(self._on_bucket_selected)
+        tables.addWidget(self.bucket_table, 3)
+
+        self.glyph_table = QTableWidget(0, 2, self)
+        self.glyph_table.setHorizontalHeaderLabels(['Glyph', 'Templates'])
+        self.glyph_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.glyph_table.verticalHeader().setVisible(False)
+        tables.addWidget(self.glyph_table, 1)
+        layout.addLayout(tables, 1)
+
+
+    def showEvent(self, event) -> None:
+        super().showEvent(event)
+        self.refresh()
+
+
+    def refresh(self) -> None:
+        rates = []
+        for name, (hits, misses, rate) in Drawing.cache_statistics().items():
+            shown = '-' if rate is None else f'{100 * rate:.1f}%'
+            rates.append(f'{name.replace("_", " ")}: {shown} ({hits}/{hits + misses})')
+        self.cache_label.setText('Cache hit rates  ' + '   '.join(rates))
+
+        buckets = Drawing.bucket_statistics()
+        self.bucket_table.setRowCount(len(buckets))
+        for row, b in enumerate(buckets):
+            values = [b.stroke_count,
+                      b.templates,
+                      b.glyphs,
+                      '-' if b.prototypes is None else b.prototypes,
+                      'yes' if b.loaded else 'no',
+                      b.matches,
+                      '-' if b.mean_match_ms is None else f'{b.mean_match_ms:.2f}']
+            for col, v in enumerate(values):
+                item = QTableWidgetItem(str(v))
+                item.setData(Qt.ItemDataRole.UserRole, b.stroke_count)
+                self.bucket_table.setItem(row, col, item)
+        self._on_bucket_selected()
+
+
+    def _on_bucket_selected(self) -> None:
+        items = self.bucket_table.selectedItems()
+        stroke_count = items[0].data(Qt.ItemDataRole.UserRole) if items else None
+        glyphs = Drawing.glyph_histogram(stroke_count, self._GLYPH_LIMIT)
+        self.glyph_table.setRowCount(len(glyphs))
+        for row, (g, n) in enumerate(glyphs):
+            self.glyph_table.setItem(row, 0, QTableWidgetItem(g or ''))
+            self.glyph_table.setItem(row, 1, QTableWidgetItem(str(n)))
+
+
+    def _on_reset(self) -> None:
+        Drawing.reset_statistics()
+        self.refresh()
+
+
 class HandwritingManager(QTabWidget):
 
     _tab = None
@@ -78,6 +166,8 @@ class HandwritingManager(QTabWidget):
 
         self.tab1 = AddUpdateCharacterTab(self)
         self.tab2 = TestCharacterTab(self)
+        self.tab3 = TemplateStatisticsTab(self)
 
         self.addTab(self.tab1, "Add/Update Character")
         self.addTab(self.tab2, "Test Character")
+        self.addTab(self.tab3, "Template Statistics")
@@ -1,11 +1,11 @@
 from __future__ import annotations
 
-import csv
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QStandardItem, QStandardItemModel
+from PyQt6 import QtCore
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt
+from PyQt6.QtGui import QColor
 from PyQt6.QtWidgets import (
     QWidget,
     QVBoxLayout,
@@ -21,16 +21,314 @@ from PyQt6.QtWidgets import (
     QFormLayout,
     QGroupBox,
     QCheckBox,
+    QProgressDialog,
 )
 
-from data import KanaCard, KanjiCard, PhraseCard, maybe_connection_commit
+from data import GlyphIndex, KanaCard, KanjiCard, PhraseCard, UnitOfWork
+from data.database import KANA_CARD_KIND, KANJI_CARD_KIND
+from logic.delimited_file import DelimitedFile
+
+# Rows classified between two updates of the preview's Type column
+_SCAN_BATCH = 4096
+# Rows created and saved together while importing
+_IMPORT_CHUNK = 2000
+
+# Row types as stored in _PreviewModel, 0 meaning not classified yet
+_KINDS = ("", "KanaCard", "KanjiCard", "PhraseCard", "UNKNOWN")
+_KIND_CODES = {k: i for i, k in enumerate(_KINDS)}
+
+
+def _row_classifier(config: dict[str, Any]) -> Callable[[list[str]], str] | None:
+    """A function giving the card type of a row under config, None when the
+    type column is not chosen yet"""
+    if config["mode"] != "flags":
+        chosen = config["single_type"]
+        return lambda row: chosen
+
+    src_col = config["type_column"]
+    if src_col < 0:
+        return None
+    enabled = config["enabled"]
+    flags = {
+        "KanaCard": config["flags"]["kana"].casefold() if enabled["kana"] else "",
+        "KanjiCard": config["flags"]["kanji"].casefold() if enabled["kanji"] else "",
+        "PhraseCard": config["flags"]["phrase"].casefold() if enabled["phrase"] else "",
+    }
+    # First matching type wins, as the flags may repeat
+    by_flag: dict[str, str] = {}
+    for kind, flag in flags.items():
+        if flag:
+            by_flag.setdefault(flag, kind)
+
+    def classify(row: list[str]) -> str:
+        flag = row[src_col] if src_col < len(row) else ""
+        return by_flag.get(flag.strip().casefold(), "UNKNOWN")
+    return classify
+
+
+def _card_args(config: dict[str, Any], kind: str, row: list[str]) -> dict[str, str]:
+    """The create keyword arguments of a row of kind, raising ValueError when
+    a required cell is empty"""
+    def cell(col: int) -> str:
+        return row[col].strip() if 0 <= col < len(row) else ""
+
+    if kind == "KanaCard":
+        m = config["mapping"]["kana"]
+        kana = cell(m["kana"])
+        romaji = cell(m["romaji"])
+        if not kana or not romaji:
+            raise ValueError("KanaCard requires kana and romaji")
+        return {"kana": kana, "romaji": romaji}
+
+    if kind == "KanjiCard":
+        m = config["mapping"]["kanji"]
+        kanji = cell(m["kanji"])
+        meaning = cell(m["meaning"])
+        if not kanji or not meaning:
+            raise ValueError("KanjiCard requires kanji and meaning")
+        return {"kanji": kanji, "on_yomi": cell(m["onyomi"]), "kun_yomi": cell(m["kunyomi"]), "meaning": meaning}
+
+    m = config["mapping"]["phrase"]
+    kanji_phrase = cell(m["kanji_phrase"])
+    kana_phrase = cell(m["kana_phrase"])
+    meaning = cell(m["meaning"])
+    if not meaning:
+        raise ValueError("PhraseCard requires meaning")
+    if not (kanji_phrase or kana_phrase):
+        raise ValueError("PhraseCard requires kanji_phrase or kana_phrase")
+    return {"kanji_phrase": kanji_phrase,
+            "kana_phrase": kana_phrase,
+            # create rejects an empty grammar
+            "grammar": cell(m["grammar"]) or None,
+            "meaning": meaning}
+
+
+class _RowScanner(QtCore.QThread):
+    """Classifies every row of the file under one config, indexing the file
+    in the same pass if it is not indexed yet. Results are sent in batches
+    as (generation, first row, type codes, rows indexed, column count)."""
+
+    scanned = QtCore.pyqtSignal(int, int, bytes, int, int)
+
+    def __init__(self, file: DelimitedFile, config: dict[str, Any], generation: int, parent=None):
+        super().__init__(parent)
+        self.file = file
+        self.generation = generation
+        self._classify = _row_classifier(config)
+
+    def run(self) -> None:
+        classify = self._classify
+        codes = bytearray()
+        start = 0
+
+        def send(rows: int, columns: int) -> None:
+            nonlocal codes, start
+            self.scanned.emit(self.generation, start, bytes(codes), rows, columns)
+            start += len(codes)
+            codes = bytearray()
+
+        def on_row(row: list[str]) -> None:
+            codes.append(_KIND_CODES[classify(row)] if classify is not None else 0)
+
+        if not self.file.indexed:
+            def progress(rows: int, columns: int) -> None:
+                if len(codes) >= _SCAN_BATCH or self.file.indexed:
+                    send(rows, columns)
+            if self.file.index(progress, self.isInterruptionRequested, on_row) and codes:
+                send(self.file.row_count, self.file.column_count)
+            return
+
+        for row in self.file.iter_rows():
+            on_row(row)
+            if len(codes) >= _SCAN_BATCH:
+                send(self.file.row_count, self.file.column_count)
+                if self.isInterruptionRequested():
+                    return
+        send(self.file.row_count, self.file.column_count)
+
+
+class _PreviewModel(QAbstractTableModel):
+    """The rows of a DelimitedFile plus a computed Type column. Rows appear as
+    the file is indexed and are read a block at a time only when shown."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.file: DelimitedFile | None = None
+        self._rows = 0
+        self._columns = 0
+        self._types = bytearray()
+
+    def reset(self, file: DelimitedFile | None) -> None:
+        self.beginResetModel()
+        self.file = file
+        self._rows = 0
+        self._columns = file.column_count if file is not None else 0
+        self._types = bytearray()
+        self.endResetModel()
+
+    def grow(self, rows: int, columns: int) -> None:
+        if columns > self._columns:
+            self.beginInsertColumns(QModelIndex(), self._columns, columns - 1)
+            self._columns = columns
+            self.endInsertColumns()
+        if rows > self._rows:
+            self.beginInsertRows(QModelIndex(), self._rows, rows - 1)
+            self._rows = rows
+            self.endInsertRows()
+
+    def set_types(self, start: int, codes: bytes) -> None:
+        end = start + len(codes)
+        if end > len(self._types):
+            self._types.extend(bytes(end - len(self._types)))
+        self._types[start:end] = codes
+        if codes and start < self._rows:
+            col = self._columns
+            self.dataChanged.emit(self.index(start, col), self.index(min(end, self._rows) - 1, col))
+
+    def type_of(self, row: int) -> str:
+        return _KINDS[self._types[row]] if row < len(self._types) else ""
+
+    def type_counts(self) -> dict[str, int]:
+        return {k: self._types.count(i) for i, k in enumerate(_KINDS) if k}
+
+    # QAbstractTableModel ######################################################
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else self._rows
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid() or self.file is None:
+            return 0
+        return self._columns + 1
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if not index.isValid() or self.file is None:
+            return None
+        r, c = index.row(), index.column()
+        if c == self._columns:
+            kind = self.type_of(r)
+            if role == Qt.ItemDataRole.DisplayRole:
+                return kind
+            if role == Qt.ItemDataRole.BackgroundRole and kind == "UNKNOWN":
+                return QColor(Qt.GlobalColor.yellow)
+            return None
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        row = self.file.row(r)
+        return row[c] if c < len(row) else ""
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if role != Qt.ItemDataRole.DisplayRole or orientation != Qt.Orientation.Horizontal:
+            return None
+        return "Type" if section == self._columns else f"Column {section+1}"
+
+
+class _Importer(QtCore.QThread):
+    """Creates the cards of every row under one config and saves them. The
+    file is streamed once per card type present, kana rows first, then
+    kanji, then phrases (each may need the ones before), _IMPORT_CHUNK rows
+    at a time with one save per chunk, so a chunk is the most an error or a
+    cancel can lose. Progress is sent as (rows done, rows total) over all
+    passes. Once finished, made holds the cards saved, and stopped why the
+    import ended early, if it did."""
+
+    progressed = QtCore.pyqtSignal(int, int)
+
+    def __init__(self, file: DelimitedFile, config: dict[str, Any], present: set[str], parent=None):
+        super().__init__(parent)
+        self.file = file
+        self.config = config
+        self._classify = _row_classifier(config)
+        self._kinds = [k for k in ("KanaCard", "KanjiCard", "PhraseCard") if k in present]
+        self.made = {"KanaCard": 0, "KanjiCard": 0, "PhraseCard": 0}
+        self.errors: list[str] = []
+        self.error_count = 0
+        self.cancelled = False
+        self.stopped: str | None = None
+
+    def _report(self, r: int, kind: str, e: Exception | str) -> None:
+        self.error_count += 1
+        if len(self.errors) < 50:
+            self.errors.append(f"Row {r+1} ({kind}): {e}" if kind else f"Row {r+1}: {e}")
+
+    def _save(self, kind: str, rows: list[dict[str, str]], lines: list[int]) -> None:
+        created: list[KanaCard | KanjiCard | PhraseCard | None] = []
+        on_error = lambda i, e: self._report(lines[i], kind, e)
+        if kind == "KanaCard":
+            for args, r in zip(rows, lines):
+                try:
+                    created.append(KanaCard.create(**args))
+                except Exception as e:
+                    self._report(r, kind, e)
+        elif kind == "KanjiCard":
+            created = KanjiCard.create_many(rows, on_error=on_error)
+        else:
+            created = PhraseCard.create_many(rows, on_error=on_error)
+        created = [c for c in created if c is not None]
+        UnitOfWork(created).flush()
+        self.made[kind] += len(created)
+
+    def run(self) -> None:
+        classify = self._classify
+        assert classify is not None
+        row_count = self.file.row_count
+        total = row_count * len(self._kinds)
+        self.progressed.emit(0, total)
+
+        for n, kind in enumerate(self._kinds):
+            done = n * row_count
+            rows: list[dict[str, str]] = []
+            lines: list[int] = []
+
+            def save() -> bool:
+                try:
+                    self._save(kind, rows, lines)
+                except Exception as e:
+                    self.stopped = (f"Rows {lines[0]+1}-{lines[-1]+1} ({kind}) could not be saved "
+                                    f"and nothing after them was imported:\n{e}")
+                    return False
+                return True
+
+            for r, row in enumerate(self.file.iter_rows()):
+                if r % _SCAN_BATCH == 0:
+                    self.progressed.emit(done + r, total)
+                    if self.isInterruptionRequested():
+                        self.cancelled = True
+                        return
+                row_kind = classify(row)
+                if n == 0 and row_kind == "UNKNOWN":
+                    self._report(r, "", "UNKNOWN type")
+                if row_kind != kind:
+                    continue
+                try:
+                    rows.append(_card_args(self.config, kind, row))
+                    lines.append(r)
+                except ValueError as e:
+                    self._report(r, kind, e)
+                if len(rows) >= _IMPORT_CHUNK:
+                    if not save():
+                        return
+                    rows, lines = [], []
+            if rows and not save():
+                return
+        self.progressed.emit(total, total)
+
+
+def _result_message(title: str, counts: dict[str, int], errors: list[str], error_count: int) -> str:
+    msg = f"{title}:\n" + "".join(f"  {kind}: {n}\n" for kind, n in counts.items())
+    if errors:
+        msg += "\nErrors:\n" + "\n".join(errors)
+        if error_count > len(errors):
+            msg += f"\n... and {error_count-len(errors)} more"
+    return msg
+
 
 class ImportPage(QWidget):
 
     # ---------------- UI mode ----------------
 
     def _on_mode_toggle(self) -> None:
-        loaded = self._model.rowCount() > 0
+        loaded = self._model.file is not None
         use_flags = self._use_flag_mode.isChecked()
 
         # enable the relevant selector
@@ -52,10 +350,12 @@ class ImportPage(QWidget):
         self._path_lbl.setText("No file loaded")
         self._path_lbl.setStyleSheet("color: #535a3b")
         self._status_lbl.setText("")
-        self._model.clear()
+        self._stop_scan()
+        self._model.reset(None)
         self._type_col_cb.clear()
         self._set_controls_enabled(False)
         self._process_btn.setEnabled(False)
+        self._dry_run_btn.setEnabled(False)
         self._on_mode_toggle()
 
 
@@ -79,207 +379,213 @@ class ImportPage(QWidget):
 
 
     def _load_file(self, path: Path) -> None:
-        raw = path.read_bytes()
-        text = raw.decode("utf-8-sig", errors="replace")
+        file = DelimitedFile(path)
 
-        delim = "\t" if path.suffix.lower() == ".tsv" else ","
-        sample = text[:4096]
-        try:
-            sniffed = csv.Sniffer().sniff(sample, delimiters=",\t;|")
-            delim = sniffed.delimiter or delim
-        except Exception:
-            pass
-
-        rows: list[list[str]] = []
-        reader = csv.reader(text.splitlines(), delimiter=delim)
-        for r in reader:
-            rows.append([c if c is not None else "" for c in r])
-
-        self._model.clear()
+        self._stop_scan()
+        self._model.reset(file)
         self._path = path
         self._path_lbl.setText(str(path))
         self._status_lbl.setText("")
 
-        if not rows:
+        if not file.header:
+            self._model.reset(None)
             self._type_col_cb.clear()
             self._set_controls_enabled(False)
             self._process_btn.setEnabled(False)
+            self._dry_run_btn.setEnabled(False)
             self._on_mode_toggle()
             return
 
-        # First row is treated as "header shape" only
-        header = rows[0]
-        data_rows = rows[1:]
-
-        col_count = len(header)
-        for r in data_rows:
-            if len(r) < col_count:
-                r.extend([""] * (col_count - len(r)))
-            elif len(r) > col_count:
-                extra = len(r) - col_count
-                header.extend([""] * extra)
-                col_count = len(header)
-
-        # Add computed Type column
-        self._model.setColumnCount(col_count + 1)
-        self._model.setHorizontalHeaderLabels([f"Column {i+1}" for i in range(col_count)] + ["Type"])
-
-        for r in data_rows:
-            if len(r) < col_count:
-                r.extend([""] * (col_count - len(r)))
-
-            items = []
-            for c in r[:col_count]:
-                it = QStandardItem(str(c))
-                it.setEditable(False)
-                items.append(it)
-
-            t = QStandardItem("")
-            t.setEditable(False)
-            items.append(t)
-            self._model.appendRow(items)
-
-        # Type column choices (source columns only)
+        # First row is treated as "header shape" only. Rows wider than it add
+        # columns as the file is indexed.
+        col_count = file.column_count
         self._type_col_cb.blockSignals(True)
         self._type_col_cb.clear()
-        for i in range(col_count):
-            self._type_col_cb.addItem(f"Column {i+1}", i)
-        self._type_col_cb.setCurrentIndex(0)
         self._type_col_cb.blockSignals(False)
-
-        # Fill mapping combos
-        self._fill_column_combo(self._kana_kana_col, col_count, allow_none=False)
-        self._fill_column_combo(self._kana_romaji_col, col_count, allow_none=False)
-
-        self._fill_column_combo(self._kanji_kanji_col, col_count, allow_none=False)
-        self._fill_column_combo(self._kanji_onyomi_col, col_count, allow_none=False)
-        self._fill_column_combo(self._kanji_kunyomi_col, col_count, allow_none=False)
-        self._fill_column_combo(self._kanji_meaning_col, col_count, allow_none=False)
-
-        self._fill_column_combo(self._phrase_kanji_col, col_count, allow_none=True)
-        self._fill_column_combo(self._phrase_kana_col, col_count, allow_none=True)
-        self._fill_column_combo(self._phrase_grammar_col, col_count, allow_none=True)
-        self._fill_column_combo(self._phrase_meaning_col, col_count, allow_none=False)
+        for cb in self._column_combos():
+            cb.blockSignals(True)
+            cb.clear()
+            if cb in (self._phrase_kanji_col, self._phrase_kana_col, self._phrase_grammar_col):
+                cb.addItem("(None)", -1)
+            cb.blockSignals(False)
+        self._extend_column_combos(col_count)
+        for cb in (self._type_col_cb, *self._column_combos()):
+            cb.blockSignals(True)
+            cb.setCurrentIndex(0)
+            cb.blockSignals(False)
 
         self._set_controls_enabled(True)
         self._apply_type_enabled_state()
-        self._recompute_types()
-        self._table.resizeColumnsToContents()
         self._on_mode_toggle()
 
     # ---------------- Processing ----------------
 
 
 
-    def _extract_raw_rows(self) -> list[list[str]]:
-        raw_rows: list[list[str]] = []
-        src_cols = max(0, self._model.columnCount() - 1)  # exclude computed Type
-        for r in range(self._model.rowCount()):
-            row: list[str] = []
-            for c in range(src_cols):
-                it = self._model.item(r, c)
-                row.append("" if it is None else it.text())
-            raw_rows.append(row)
-        return raw_rows
-
-
-    def _process_data(self, config: dict[str, Any], rows: list[list[str]]) -> None:
-        type_col = self._model.columnCount() - 1
-
-        def cell(row: int, col: int) -> str:
-            if col < 0:
-                return ""
-            it = self._model.item(row, col)
-            return "" if it is None else it.text().strip()
-
-        errors: list[str] = []
-        made = {"KanaCard": 0, "KanjiCard": 0, "PhraseCard": 0}
-
-        for r in range(self._model.rowCount()):
-            kind_item = self._model.item(r, type_col)
-            kind = "" if kind_item is None else kind_item.text()
-
+    def _dry_run_data(self, config: dict[str, Any]) -> None:
+        """Checks every row the way _Importer would create it, in one
+        streaming pass and without writing anything. Each row's arguments
+        are checked on their own; uniqueness and prerequisites are checked
+        with set operations against the saved glyphs from GlyphIndex plus
+        the glyphs the valid rows of the file would add."""
+        file = self._model.file
+        assert file is not None
+        classify = _row_classifier(config)
+        assert classify is not None
+
+        # Saved cards, and unsaved ones from elsewhere in the app that an
+        # import would run into as well
+        saved_kana = set(GlyphIndex.glyphs(KANA_CARD_KIND))
+        saved_kana.update(c.kana for c in KanaCard.not_in_db())
+        saved_kanji = set(GlyphIndex.glyphs(KANJI_CARD_KIND))
+        saved_kanji.update(c.kanji for c in KanjiCard.not_in_db())
+
+        failed: dict[int, tuple[str, str]] = {}
+        valid = {"KanaCard": 0, "KanjiCard": 0, "PhraseCard": 0}
+        new_kana: set[str] = set()
+        new_kanji: set[str] = set()
+        # Rows of each kind needing glyphs not saved yet: (row, kana, kanji)
+        unmet: dict[str, list[tuple[int, set[str], set[str]]]] = {"KanjiCard": [], "PhraseCard": []}
+        kanji_rows: dict[str, int] = {}
+
+        for r, row in enumerate(file.iter_rows()):
+            kind = classify(row)
             if kind == "UNKNOWN":
-                errors.append(f"Row {r+1}: UNKNOWN type")
+                failed[r] = ("", "UNKNOWN type")
                 continue
-
-            created: list[KanaCard | KanjiCard | PhraseCard] = []
             try:
+                args = _card_args(config, kind, row)
                 if kind == "KanaCard":
-                    m = config["mapping"]["kana"]
-                    kana = cell(r, m["kana"])
-                    romaji = cell(r, m["romaji"])
-                    if not kana or not romaji:
-                        raise ValueError("KanaCard requires kana and romaji")
-                    kc = KanaCard.create(kana=kana, romaji=romaji)
-                    created.append(kc)
-                    made["KanaCard"] += 1
-
+                    kana, _ = KanaCard._check_args(**args)
+                    if kana in saved_kana or kana in new_kana:
+                        raise ValueError("Invalid kana: not unique")
+                    new_kana.add(kana)
                 elif kind == "KanjiCard":
-                    m = config["mapping"]["kanji"]
-                    kanji = cell(r, m["kanji"])
-                    onyomi = cell(r, m["onyomi"])
-                    kunyomi = cell(r, m["kunyomi"])
-                    meaning = cell(r, m["meaning"])
-                    if not kanji or not meaning:
-                        raise ValueError("KanjiCard requires kanji and meaning")
-                    kc = KanjiCard.create(kanji=kanji, on_yomi=onyomi, kun_yomi=kunyomi, meaning=meaning)
-                    created.append(kc)
-                    made["KanjiCard"] += 1
-
-                elif kind == "PhraseCard":
-                    m = config["mapping"]["phrase"]
-                    kanji_phrase = cell(r, m["kanji_phrase"]) if m["kanji_phrase"] != -1 else ""
-                    kana_phrase = cell(r, m["kana_phrase"]) if m["kana_phrase"] != -1 else ""
-                    grammar = cell(r, m["grammar"]) if m["grammar"] != -1 else ""
-                    meaning = cell(r, m["meaning"])
-                    if not meaning:
-                        raise ValueError("PhraseCard requires meaning")
-                    if not (kanji_phrase or kana_phrase):
-                        raise ValueError("PhraseCard requires kanji_phrase or kana_phrase")
-                    pc = PhraseCard.create(kanji_phrase=kanji_phrase, kana_phrase=kana_phrase, grammar=grammar, meaning=meaning)
-                    created.append(pc)
-                    made["PhraseCard"] += 1
-
+                    kanji, on_yomi, kun_yomi, _ = KanjiCard._check_args(**args)
+                    if kanji in saved_kanji or kanji in new_kanji:
+                        raise ValueError("Invalid kanji: not unique")
+                    new_kanji.add(kanji)
+                    kanji_rows[kanji] = r
+                    kana = KanjiCard._reading_kana(on_yomi, kun_yomi) - saved_kana
+                    if kana:
+                        unmet[kind].append((r, kana, set()))
                 else:
-                    errors.append(f"Row {r+1}: unrecognized type '{kind}'")
-
-            except Exception as e:
-                errors.append(f"Row {r+1} ({kind}): {e}")
-
-            # Synchronize the new cards
-            with maybe_connection_commit(None) as con:
-                for c in created:
-                    c.sync(con)
-            
-
-        msg = (
-            f"Created:\n"
-            f"  KanaCard: {made['KanaCard']}\n"
-            f"  KanjiCard: {made['KanjiCard']}\n"
-            f"  PhraseCard: {made['PhraseCard']}\n"
-        )
-        if errors:
-            msg += "\nErrors:\n" + "\n".join(errors[:50])
-            if len(errors) > 50:
-                msg += f"\n... and {len(errors)-50} more"
+                    _, _, kanji_phrase, kana_phrase = PhraseCard._check_args(**args)
+                    kana, kanji = PhraseCard._phrase_glyphs(kanji_phrase, kana_phrase)
+                    kana = set(kana) - saved_kana
+                    kanji = set(kanji) - saved_kanji
+                    if kana or kanji:
+                        unmet[kind].append((r, kana, kanji))
+                valid[kind] += 1
+            except (ValueError, TypeError) as e:
+                failed[r] = (kind, str(e))
+
+        # Kanji are created after every kana and phrases after every kanji,
+        # so the rows above can only count on the glyphs of valid rows
+        for r, kana, _ in unmet["KanjiCard"]:
+            unknown = sorted(kana - new_kana)
+            if unknown:
+                failed[r] = ("KanjiCard", f"Invalid on_yomi or kun_yomi: uknown kana '{unknown[0]}'")
+                valid["KanjiCard"] -= 1
+        new_kanji.difference_update(k for k, r in kanji_rows.items() if r in failed)
+        for r, kana, kanji in unmet["PhraseCard"]:
+            unknown_kana = sorted(kana - new_kana)
+            unknown_kanji = sorted(kanji - new_kanji)
+            if unknown_kana:
+                failed[r] = ("PhraseCard", f"Invalid kana or kanji phrase: contains unknown kana '{unknown_kana[0]}'")
+            elif unknown_kanji:
+                failed[r] = ("PhraseCard", f"Invalid kanji phrase: contains unknown kanji '{unknown_kanji[0]}'")
+            else:
+                continue
+            valid["PhraseCard"] -= 1
 
-        QMessageBox.information(self, "Import result", msg)
+        errors = [f"Row {r+1} ({kind}): {e}" if kind else f"Row {r+1}: {e}"
+                  for r, (kind, e) in sorted(failed.items())[:50]]
+        QMessageBox.information(self, "Dry run result",
+                                _result_message("Would create", valid, errors, len(failed)))
 
 
-    def _on_process(self) -> None:
+
+    def _on_dry_run(self) -> None:
         ok, errs = self._all_valid()
         if not ok:
             QMessageBox.warning(self, "Invalid configuration", "\n".join(errs))
             return
 
-        config = self._build_config()
-        raw_rows = self._extract_raw_rows()
-
         try:
-            self._process_data(config, raw_rows)
+            self._dry_run_data(self._build_config())
         except Exception as e:
-            QMessageBox.critical(self, "Processing failed", str(e))
+            QMessageBox.critical(self, "Dry run failed", str(e))
+
+
+
+    def _on_process(self) -> None:
+        ok, errs = self._all_valid()
+        if not ok:
+            QMessageBox.warning(self, "Invalid configuration", "\n".join(errs))
+            return
+
+        file = self._model.file
+        assert file is not None
+        counts = self._model.type_counts()
+        present = {k for k, n in counts.items() if n}
+        if counts.get("UNKNOWN") and not present:
+            # The first pass lists the rows of unknown type, so make sure there is one
+            present.add("KanaCard")
+
+        # Modal, as the importer fills the card caches every page reads
+        self._progress = QProgressDialog("Importing...", "Cancel", 0, 0, self)
+        self._progress.setWindowTitle("Import")
+        self._progress.setWindowModality(Qt.WindowModality.ApplicationModal)
+        self._progress.setMinimumDuration(0)
+        self._progress.setAutoClose(False)
+        self._progress.setAutoReset(False)
+
+        self._importer = _Importer(file, self._build_config(), present, self)
+        self._importer.progressed.connect(self._on_import_progress)
+        self._importer.finished.connect(self._on_import_finished)
+        self._progress.canceled.connect(self._on_import_cancel)
+        self._importer.start()
+
+    def _on_import_cancel(self) -> None:
+        if self._importer is None or self._progress is None:
+            return
+        self._importer.requestInterruption()
+        # Canceling hides the dialog, keep it up until the current chunk is saved
+        self._progress.setCancelButton(None)
+        self._progress.setLabelText("Cancelling, the rows already saved are kept...")
+        self._progress.show()
+
+    def _on_import_progress(self, done: int, total: int) -> None:
+        if self._progress is not None:
+            self._progress.setMaximum(total)
+            self._progress.setValue(done)
+
+    def _on_import_finished(self) -> None:
+        importer = self._importer
+        assert importer is not None
+        self._importer = None
+        importer.deleteLater()
+        if self._progress is not None:
+            self._progress.close()
+            self._progress.deleteLater()
+            self._progress = None
+
+        if importer.stopped is not None:
+            QMessageBox.critical(self, "Processing failed",
+                                 importer.stopped + "\n\n" + _result_message("Created before the error",
+                                                                              importer.made,
+                                                                              importer.errors,
+                                                                              importer.error_count))
+        elif importer.cancelled:
+            QMessageBox.information(self, "Import cancelled",
+                                    _result_message("Created before cancelling",
+                                                    importer.made,
+                                                    importer.errors,
+                                                    importer.error_count))
+        else:
+            QMessageBox.information(self, "Import result",
+                                    _result_message("Created", importer.made, importer.errors, importer.error_count))
 
     # ---------------- Enable/Disable UI ----------------
 
@@ -302,7 +608,7 @@ class ImportPage(QWidget):
         self._recompute_types()
 
     def _apply_type_enabled_state(self) -> None:
-        loaded = self._model.rowCount() > 0
+        loaded = self._model.file is not None
         kana_on = self._kana_enabled.isChecked()
         kanji_on = self._kanji_enabled.isChecked()
         phrase_on = self._phrase_enabled.isChecked()
@@ -398,7 +704,8 @@ class ImportPage(QWidget):
         return errs
 
     def _all_valid(self) -> tuple[bool, list[str]]:
-        if self._model.rowCount() == 0:
+        file = self._model.file
+        if file is None or (file.indexed and file.row_count == 0):
             return False, ["No data loaded."]
         errs = self._validate_mappings()
         return (len(errs) == 0), errs
@@ -442,81 +749,87 @@ class ImportPage(QWidget):
     # ---------------- Preview classification ----------------
 
     def _recompute_types(self) -> None:
-        ok, errs = self._all_valid()
+        self._recompute_status()
+        self._start_scan()
+
+    def _start_scan(self) -> None:
+        """Reclassifies every row in the background. A scan already indexing
+        the file is left to finish and followed by another one; a scan only
+        classifying is interrupted."""
+        if self._model.file is None:
+            return
+        self._scan_generation += 1
+        if self._scanner is not None:
+            if self._model.file.indexed:
+                self._scanner.requestInterruption()
+            return
+        self._launch_scan()
+
+    def _launch_scan(self) -> None:
+        self._scanner = _RowScanner(self._model.file, self._build_config(), self._scan_generation, self)
+        self._scanner.scanned.connect(self._on_scanned)
+        self._scanner.finished.connect(self._on_scan_finished)
+        self._scanner.start()
+
+    def _stop_scan(self) -> None:
+        if self._scanner is not None:
+            self._scanner.requestInterruption()
+            self._scanner.scanned.disconnect(self._on_scanned)
+            self._scanner.finished.disconnect(self._on_scan_finished)
+            self._scanner.wait()
+            self._scanner.deleteLater()
+            self._scanner = None
+
+    def _on_scanned(self, generation: int, start: int, codes: bytes, rows: int, columns: int) -> None:
+        if columns > self._type_col_cb.count():
+            self._extend_column_combos(columns)
+        first = self._model.rowCount() == 0
+        self._model.grow(rows, columns)
+        if generation == self._scan_generation:
+            self._model.set_types(start, codes)
+        if first and rows:
+            self._table.resizeColumnsToContents()
+            self._recompute_status()
+
+    def _on_scan_finished(self) -> None:
+        scanner = self._scanner
+        if scanner is None:
+            return
+        self._scanner = None
+        scanner.deleteLater()
+        if scanner.generation != self._scan_generation and self._model.file is not None:
+            self._launch_scan()
+        else:
+            self._recompute_status()
 
+    def _recompute_status(self) -> None:
+        ok, errs = self._all_valid()
         if errs:
             self._status_lbl.setText("⚠ " + "\n⚠ ".join(errs))
         else:
             self._status_lbl.setText("")
         self._process_btn.setEnabled(ok)
-
-        if self._model.rowCount() == 0 or self._model.columnCount() == 0:
-            return
-
-        computed_col = self._model.columnCount() - 1
-        use_flags = self._use_flag_mode.isChecked()
-
-        if not use_flags:
-            chosen = self._single_type_cb.currentText()
-
-            def classify(_: str) -> str:
-                return chosen
-
-            src_col = -1
-        else:
-            if self._type_col_cb.currentIndex() < 0:
-                return
-            src_col = int(self._type_col_cb.currentData())
-
-            kana_on = self._kana_enabled.isChecked()
-            kanji_on = self._kanji_enabled.isChecked()
-            phrase_on = self._phrase_enabled.isChecked()
-
-            kana_flag = self._kana_flag.text().strip().casefold()
-            kanji_flag = self._kanji_flag.text().strip().casefold()
-            phrase_flag = self._phrase_flag.text().strip().casefold()
-
-            def classify(flag: str) -> str:
-                f = flag.strip().casefold()
-                if kana_on and kana_flag and f == kana_flag:
-                    return "KanaCard"
-                if kanji_on and kanji_flag and f == kanji_flag:
-                    return "KanjiCard"
-                if phrase_on and phrase_flag and f == phrase_flag:
-                    return "PhraseCard"
-                return "UNKNOWN"
-
-        for r in range(self._model.rowCount()):
-            if use_flags:
-                src_item = self._model.item(r, src_col)
-                flag_val = src_item.text() if src_item is not None else ""
-                kind = classify(flag_val)
-            else:
-                kind = classify("")
-
-            out_item = self._model.item(r, computed_col)
-            if out_item is None:
-                out_item = QStandardItem("")
-                out_item.setEditable(False)
-                self._model.setItem(r, computed_col, out_item)
-
-            out_item.setText(kind)
-            if kind == "UNKNOWN":
-                out_item.setBackground(Qt.GlobalColor.yellow)
-            else:
-                out_item.setBackground(Qt.GlobalColor.transparent)
+        self._dry_run_btn.setEnabled(ok)
 
     # ---------------- helpers ----------------
 
-    def _fill_column_combo(self, cb: QComboBox, col_count: int, allow_none: bool) -> None:
-        cb.blockSignals(True)
-        cb.clear()
-        if allow_none:
-            cb.addItem("(None)", -1)
-        for i in range(col_count):
-            cb.addItem(f"Column {i+1}", i)
-        cb.setCurrentIndex(0)
-        cb.blockSignals(False)
+    def _column_combos(self) -> tuple[QComboBox, ...]:
+        return (
+            self._kana_kana_col, self._kana_romaji_col,
+            self._kanji_kanji_col, self._kanji_onyomi_col, self._kanji_kunyomi_col, self._kanji_meaning_col,
+            self._phrase_kanji_col, self._phrase_kana_col, self._phrase_grammar_col, self._phrase_meaning_col,
+        )
+
+    def _extend_column_combos(self, col_count: int) -> None:
+        """Adds the columns up to col_count to the type column and mapping
+        combos, keeping their selections"""
+        for cb in (self._type_col_cb, *self._column_combos()):
+            cb.blockSignals(True)
+            present = {cb.itemData(i) for i in range(cb.count())}
+            for i in range(col_count):
+                if i not in present:
+                    cb.addItem(f"Column {i+1}", i)
+            cb.blockSignals(False)
 
     # Constructor ##############################################################
     
@@ -524,10 +837,16 @@ class ImportPage(QWidget):
         super().__init__(parent)
 
         self._path: Path | None = None
-        self._model = QStandardItemModel(self)
+        self._model = _PreviewModel(self)
+        self._scanner: _RowScanner | None = None
+        self._importer: _Importer | None = None
+        self._progress: QProgressDialog | None = None
+        self._scan_generation = 0
 
         self._open_btn = QPushButton("Open CSV/TSV…")
         self._clear_btn = QPushButton("Clear")
+        self._dry_run_btn = QPushButton("Dry run")
+        self._dry_run_btn.setEnabled(False)
         self._process_btn = QPushButton("Process / Import")
         self._process_btn.setEnabled(False)
 
@@ -568,6 +887,7 @@ class ImportPage(QWidget):
         top = QHBoxLayout()
         top.addWidget(self._open_btn)
         top.addWidget(self._clear_btn)
+        top.addWidget(self._dry_run_btn)
         top.addWidget(self._process_btn)
         top.addStretch(1)
 
@@ -673,6 +993,7 @@ class ImportPage(QWidget):
         # ----- Signals -----
         self._open_btn.clicked.connect(self._on_open)
         self._clear_btn.clicked.connect(self._on_clear)
+        self._dry_run_btn.clicked.connect(self._on_dry_run)
         self._process_btn.clicked.connect(self._on_process)
 
         self._type_col_cb.currentIndexChanged.connect(self._recompute_types)
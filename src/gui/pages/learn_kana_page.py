@@ -9,10 +9,12 @@ from PyQt6.QtGui import QColorConstants, QPalette, QColor
 from data import KanaCard
 from data.database import maybe_connection
 from data.queries import query_learnable_kana_cards
+from logic.learn_planner import order_by_unlock_value
 
 from gui.widgets.writing_widgets import CharacterDrawing
 from gui.widgets.drawing_display import DrawingDisplay
-from logic.grade_handwriting import grade_strokes
+from logic.grade_handwriting import grade_strokes_detailed
+from gui.grading_settings import grading_options
 
 
 class LearnKanaPage(QtWidgets.QWidget):
@@ -20,7 +22,7 @@ class LearnKanaPage(QtWidgets.QWidget):
     Learn session (Kana):
       - iterates query_learnable_kana_cards()
       - shows canonical drawing (left) + user drawing box (right)
-      - user submits strokes -> grade_strokes(strokes, kana)
+      - user submits strokes -> grade_strokes_detailed(strokes, kana)
       - must get grade==0 to proceed (otherwise forced retry)
       - user can restart canonical animation and clear user drawing
     """
@@ -156,7 +158,7 @@ class LearnKanaPage(QtWidgets.QWidget):
     def start(self) -> None:
         if not self._cards:
             with maybe_connection(None) as con:
-                self._cards = list(query_learnable_kana_cards(con))
+                self._cards = order_by_unlock_value(list(query_learnable_kana_cards(con)))
 
         self._idx = -1
         self.next_card()
@@ -207,7 +209,7 @@ class LearnKanaPage(QtWidgets.QWidget):
         self.representation_label.setText("0%")
 
         if d is not None and d.strokes:
-            self.canonical_display.set_strokes(d.strokes)
+            self.canonical_display.set_strokes(d.stroke_set)
             self.canonical_display.set_progress(0.0)
             self.canonical_display.restart()
         else:
@@ -253,7 +255,9 @@ class LearnKanaPage(QtWidgets.QWidget):
             return
 
         glyph = self._current.kana
-        g = grade_strokes(strokes, glyph)
+        ignore_order, order_weight = grading_options()
+        result = grade_strokes_detailed(strokes, glyph, ignore_order=ignore_order, order_weight=order_weight)
+        g = result.grade
 
         # Styling for feedback
         font = self.q_status.font()
@@ -283,6 +287,8 @@ class LearnKanaPage(QtWidgets.QWidget):
         else:
             pal.setColor(QPalette.ColorRole.WindowText, QColorConstants.Red)
             self.q_status.setText("Incorrect — try again.")
+        if result.details:
+            self.q_status.setText(f"{self.q_status.text()}\n{result.details}")
 
         self.q_status.setPalette(pal)
 
@@ -9,10 +9,12 @@ from PyQt6.QtGui import QColorConstants, QPalette
 from data import KanjiCard
 from data.database import maybe_connection
 from data.queries import query_learnable_kanji_cards
+from logic.learn_planner import order_by_unlock_value
 
 from gui.widgets.writing_widgets import CharacterDrawing
 from gui.widgets.drawing_display import DrawingDisplay
-from logic.grade_handwriting import grade_strokes
+from logic.grade_handwriting import grade_strokes_detailed
+from gui.grading_settings import grading_options
 
 
 class LearnKanjiPage(QtWidgets.QWidget):
@@ -20,7 +22,7 @@ class LearnKanjiPage(QtWidgets.QWidget):
     Learn session (Kanji):
       - iterates query_learnable_kanji_cards()
       - shows canonical drawing (left) + user drawing box (right)
-      - user submits strokes -> grade_strokes(strokes, kanji)
+      - user submits strokes -> grade_strokes_detailed(strokes, kanji)
       - must get grade==0 to proceed (otherwise forced retry)
       - user can restart canonical animation and clear user drawing
     """
@@ -159,7 +161,7 @@ class LearnKanjiPage(QtWidgets.QWidget):
     @QtCore.pyqtSlot()
     def start(self) -> None:
         if not self._cards:
-            self._cards = query_learnable_kanji_cards()
+            self._cards = iter(order_by_unlock_value(list(query_learnable_kanji_cards())))
 
         self._idx = -1
         self.next_card()
@@ -229,7 +231,7 @@ class LearnKanjiPage(QtWidgets.QWidget):
         self.representation_label.setText("0%")
 
         if d is not None and d.strokes:
-            self.canonical_display.set_strokes(d.strokes)
+            self.canonical_display.set_strokes(d.stroke_set)
             self.canonical_display.set_progress(0.0)
             self.canonical_display.restart()
         else:
@@ -274,7 +276,7 @@ class LearnKanjiPage(QtWidgets.QWidget):
     #     # Load + play canonical drawing (must exist in DB for this card)
     #     d = self._current.drawing
     #     if d is not None and d.strokes:
-    #         self.canonical_display.set_strokes(d.strokes)
+    #         self.canonical_display.set_strokes(d.stroke_set)
     #         self.canonical_display.restart()
     #     else:
     #         self.canonical_display.set_strokes([])
@@ -317,7 +319,9 @@ class LearnKanjiPage(QtWidgets.QWidget):
             return
 
         glyph = self._current.kanji
-        g = grade_strokes(strokes, glyph)
+        ignore_order, order_weight = grading_options()
+        result = grade_strokes_detailed(strokes, glyph, ignore_order=ignore_order, order_weight=order_weight)
+        g = result.grade
 
         # Styling for feedback
         font = self.q_status.font()
@@ -346,6 +350,8 @@ class LearnKanjiPage(QtWidgets.QWidget):
         else:
             pal.setColor(QPalette.ColorRole.WindowText, QColorConstants.Red)
             self.q_status.setText("Incorrect — try again.")
+        if result.details:
+            self.q_status.setText(f"{self.q_status.text()}\n{result.details}")
 
         self.q_status.setPalette(pal)
 
@@ -9,8 +9,10 @@ from PyQt6.QtGui import QColorConstants, QPalette
 from data import PhraseCard
 from data.database import maybe_connection
 from data.queries import query_learnable_phrase_cards
+from logic.learn_planner import order_by_unlock_value
 
-from logic.grade_handwriting import grade_strokes
+from logic.grade_handwriting import grade_strokes_detailed
+from gui.grading_settings import grading_options
 
 # Import your new widgets (adjust import paths to match your project)
 # - GenkouyoushiWidgets: user input grid (captures strokes per character)
@@ -171,7 +173,7 @@ class LearnPhrasePage(QtWidgets.QWidget):
     @QtCore.pyqtSlot()
     def start(self) -> None:
         if self._cards is None:
-            self._cards = query_learnable_phrase_cards()
+            self._cards = iter(order_by_unlock_value(list(query_learnable_phrase_cards())))
 
         self.next_card()
 
@@ -276,9 +278,10 @@ class LearnPhrasePage(QtWidgets.QWidget):
                 return
 
         # Grade each character against the corresponding target glyph
-        grades: list[int] = []
-        for strokes, glyph in zip(seq, self._target, strict=True):
-            grades.append(grade_strokes(strokes, glyph))
+        ignore_order, order_weight = grading_options()
+        results = [grade_strokes_detailed(strokes, glyph, ignore_order=ignore_order, order_weight=order_weight)
+                   for strokes, glyph in zip(seq, self._target, strict=True)]
+        grades = [r.grade for r in results]
 
         # Styling for feedback
         font = self.q_status.font()
@@ -311,6 +314,8 @@ class LearnPhrasePage(QtWidgets.QWidget):
         else:
             pal.setColor(QPalette.ColorRole.WindowText, QColorConstants.Red)
             msg = f"Incorrect on character {first_bad + 1}/{len(grades)} (‘{self._target[first_bad]}’) — try again."
+        if results[first_bad].details:
+            msg += f"\n{results[first_bad].details}"
 
         self.q_status.setPalette(pal)
         self.q_status.setText(msg)
@@ -13,7 +13,8 @@ from data.queries import query_reviewable_kana_card
 from gui.widgets.writing_widgets import CharacterDrawing
 from gui.widgets.drawing_display import DrawingDisplay
 
-from logic.grade_handwriting import grade_strokes
+from logic.grade_handwriting import grade_strokes_detailed
+from gui.grading_settings import grading_options
 from logic.review_card import review_card_bin
 
 def _set_grade_badge(lbl: QtWidgets.QLabel, grade: int) -> None:
@@ -109,7 +110,9 @@ class ReviewKanaPage(QtWidgets.QWidget):
 
 
         c = self._cards[self._current_card_index]
-        g = grade_strokes(drawing, c.kana)
+        ignore_order, order_weight = grading_options()
+        result = grade_strokes_detailed(drawing, c.kana, ignore_order=ignore_order, order_weight=order_weight)
+        g = result.grade
 
 
         if g == 0 and self._first_success_try is None:
@@ -122,7 +125,7 @@ class ReviewKanaPage(QtWidgets.QWidget):
         elif self._first_success_try is not None and self._first_success_try >= 3:
             review_card_bin(c.card,2)
         
-        self.kana_answer_widget.answer_provided(drawing, g)
+        self.kana_answer_widget.answer_provided(drawing, g, result.details)
         self.stack.setCurrentWidget(self.kana_answer_widget)
 
 
@@ -275,7 +278,7 @@ class KanaAnswerWidget(QtWidgets.QWidget):
         self._has_db_strokes = False
         d = c.drawing
         if d is not None and getattr(d, "strokes", None):
-            self._db_drawing.set_strokes(d.strokes)
+            self._db_drawing.set_strokes(d.stroke_set)
             self._db_drawing.restart()
             self._has_db_strokes = True
         else:
@@ -287,7 +290,7 @@ class KanaAnswerWidget(QtWidgets.QWidget):
         self.replay_btn.setEnabled(self._has_db_strokes)
         self.next_button.setEnabled(False)
 
-    def answer_provided(self, s: list[list[float]], grade: int) -> None:
+    def answer_provided(self, s: list[list[float]], grade: int, details: str = "") -> None:
         self._last_grade = grade
         _set_grade_badge(self.badge, grade)
 
@@ -302,6 +305,8 @@ class KanaAnswerWidget(QtWidgets.QWidget):
         else:
             pal.setColor(QPalette.ColorRole.WindowText, QColorConstants.Red)
             self.feedback_label.setText("Incorrect")
+        if details:
+            self.feedback_label.setText(f"{self.feedback_label.text()}\n{details}")
         self.feedback_label.setPalette(pal)
 
         # User drawing is real strokes here; safe to set
@@ -589,7 +594,7 @@ class KanaAnswerWidget(QtWidgets.QWidget):
 #         self._has_db_strokes = False
 #         d = c.drawing
 #         if d is not None and getattr(d, "strokes", None):
-#             self._db_drawing.set_strokes(d.strokes)
+#             self._db_drawing.set_strokes(d.stroke_set)
 #             self._db_drawing.restart()
 #             self._has_db_strokes = True
 #         else:
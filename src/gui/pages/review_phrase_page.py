@@ -9,7 +9,8 @@ from PyQt6.QtGui import QColorConstants, QPalette
 
 from data import PhraseCard
 from data.queries import query_reviewable_phrase_cards  # <-- adjust name if different
-from logic.grade_handwriting import grade_strokes
+from logic.grade_handwriting import grade_strokes_detailed
+from gui.grading_settings import grading_options
 
 from gui.widgets.writing_widgets import GenkouyoushiWidgets
 from gui.widgets.genkouyoushi_drawing_display import GenkouyoushiDrawingDisplay
@@ -258,9 +259,10 @@ class ReviewPhrasePage(QtWidgets.QWidget):
                 return
 
         # Grade each character against the corresponding target glyph
-        grades: list[int] = []
-        for strokes, glyph in zip(seq, self._target, strict=True):
-            grades.append(grade_strokes(strokes, glyph))
+        ignore_order, order_weight = grading_options()
+        results = [grade_strokes_detailed(strokes, glyph, ignore_order=ignore_order, order_weight=order_weight)
+                   for strokes, glyph in zip(seq, self._target, strict=True)]
+        grades = [r.grade for r in results]
 
         # Styling for feedback
         font = self.q_status.font()
@@ -302,6 +304,8 @@ class ReviewPhrasePage(QtWidgets.QWidget):
         else:
             pal.setColor(QPalette.ColorRole.WindowText, QColorConstants.Red)
             msg = f"Incorrect on character {first_bad + 1}/{len(grades)} (‘{self._target[first_bad]}’) — rewrite the whole phrase."
+        if results[first_bad].details:
+            msg += f"\n{results[first_bad].details}"
 
         self.q_status.setPalette(pal)
         self.q_status.setText(msg)
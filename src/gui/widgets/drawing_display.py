@@ -1,120 +1,339 @@
+from __future__ import annotations
 from typing import Optional
+from bisect import bisect_right
+from collections import OrderedDict
 from itertools import cycle
-from PyQt6.QtCore import Qt, QTimer, QPointF
-from PyQt6.QtGui import QColor, QImage, QPen, QPainter, QPaintEvent, QResizeEvent
+from PyQt6.QtCore import Qt, QObject, QTimer, QPointF
+from PyQt6.QtGui import (QColor, QImage, QPen, QPainter, QPainterPath, QPaintEvent,
+                         QPolygonF, QResizeEvent)
 from PyQt6.QtWidgets import QWidget
-from logic.drawing_utils import normalize_strokes
+from data.drawing import Drawing
+from logic.stroke_set import StrokeSet
+
+
+
+PEN_COLORS = [
+    QColor("#1f77b4"), QColor("#ff7f0e"),
+    QColor("#2ca02c"), QColor("#d62728"),
+    QColor("#9467bd"), QColor("#8c564b"),
+    QColor("#e377c2"), QColor("#7f7f7f"),
+    QColor("#bcbd22"), QColor("#17becf"),
+    QColor("#393b79"), QColor("#637939"),
+    QColor("#8c6d31"), QColor("#843c39"),
+    QColor("#7b4173"), QColor("#3182bd"),
+    QColor("#e6550d"), QColor("#31a354"),
+    QColor("#756bb1"), QColor("#636363"),
+    QColor("#9c9ede"), QColor("#cedb9c"),
+    QColor("#e7ba52"), QColor("#ad494a"),
+    QColor("#a55194"), QColor("#6baed6"),
+    QColor("#fd8d3c"), QColor("#74c476"),
+    QColor("#9e9ac8"), QColor("#bdbdbd"),
+    QColor("#b5cf6b"), QColor("#17becf")]
+
+
+
+class _StrokeRender:
+    """Pre-rendered state for one set of strokes at one widget size.
+
+    Holds a QPainterPath per stroke and lazily built cumulative images, so a
+    frame at any position is one blit plus the part of the stroke in progress.
+    Instances are immutable once built and may be shared between displays."""
+
+    def __init__(self,
+                 strokes: StrokeSet | list[list[float]],
+                 width: int,
+                 height: int,
+                 background: QColor,
+                 colors: list[QColor]):
+        self.width = width
+        self.height = height
+        self._background = QColor(background)
+        self.colors = colors
+        self._pen = QPen(
+            Qt.GlobalColor.black,
+            3,
+            Qt.PenStyle.SolidLine,
+            Qt.PenCapStyle.RoundCap,
+            Qt.PenJoinStyle.RoundJoin)
+
+        normalized = StrokeSet.from_lists(strokes).normalized(float(width), float(height))
+        points = [QPointF(x, y) for x, y in normalized.points.tolist()]
+        bounds = normalized.offsets.tolist()
+        self.point_strokes = [points[a:b] for a, b in zip(bounds, bounds[1:])]
+
+        # segment_offsets[i] is the number of segments before stroke i, so the
+        # animation position is a single segment counter into the drawing
+        self.paths: list[QPainterPath] = []
+        self.segment_offsets: list[int] = [0]
+        for points in self.point_strokes:
+            path = QPainterPath(points[0])
+            for pt in points[1:]:
+                path.lineTo(pt)
+            self.paths.append(path)
+            self.segment_offsets.append(self.segment_offsets[-1] + len(points) - 1)
+
+        # _layers[i] holds strokes 0..i-1 fully drawn
+        self._layers: list[QImage] = []
+
+    @property
+    def background_rgba(self) -> int:
+        return self._background.rgba()
+
+    @property
+    def segment_count(self) -> int:
+        return self.segment_offsets[-1]
+
+    def layer(self, index: int) -> QImage:
+        """Returns the image with the first 'index' strokes fully drawn."""
+        if not self._layers:
+            img = QImage(self.width, self.height, QImage.Format.Format_ARGB32_Premultiplied)
+            img.fill(self._background)
+            self._layers.append(img)
+
+        while len(self._layers) <= index:
+            i = len(self._layers) - 1
+            img = self._layers[i].copy()
+            p = QPainter(img)
+            p.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+            self._pen.setColor(self.colors[i])
+            p.setPen(self._pen)
+            p.drawPath(self.paths[i])
+            p.end()
+            self._layers.append(img)
+
+        return self._layers[index]
+
+    def paint(self, p: QPainter, position: int) -> None:
+        """Paints the drawing with the first 'position' segments drawn."""
+        if not self.point_strokes:
+            p.drawImage(0, 0, self.layer(0))
+            return
+
+        # Completed strokes come from the cached layer, only the stroke in
+        # progress is drawn here
+        stroke = bisect_right(self.segment_offsets, position) - 1
+        stroke = min(stroke, len(self.point_strokes))
+        p.drawImage(0, 0, self.layer(stroke))
+
+        if stroke < len(self.point_strokes):
+            drawn = position - self.segment_offsets[stroke]
+            if drawn > 0:
+                p.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+                self._pen.setColor(self.colors[stroke])
+                p.setPen(self._pen)
+                p.drawPolyline(QPolygonF(self.point_strokes[stroke][:drawn + 1]))
+
+    def frame(self, position: int) -> QImage:
+        img = QImage(self.width, self.height, QImage.Format.Format_ARGB32_Premultiplied)
+        p = QPainter(img)
+        self.paint(p, position)
+        p.end()
+        return img
+
+
+
+class GlyphRenderCache:
+    """Process wide cache of stroke renders keyed by (drawing id, cell size,
+    background), and of finished frames keyed by (drawing id, cell size,
+    background, progress bucket).
+
+    Displays showing the same drawing at the same size, on any page, share
+    one normalization, one set of paths and one set of cumulative layers."""
+
+    # Class Variables ##########################################################
+
+    MAX_RENDERS = 64
+    MAX_FRAMES = 256
+    PROGRESS_BUCKETS = 100
+
+    _renders: OrderedDict[tuple[int, int, int, int], _StrokeRender] = OrderedDict()
+    _frames: OrderedDict[tuple[int, int, int, int, int], QImage] = OrderedDict()
+
+    # Class Methods ############################################################
+
+    @classmethod
+    def render(cls,
+               drawing_id: int,
+               strokes: StrokeSet | list[list[float]],
+               width: int,
+               height: int,
+               background: QColor) -> _StrokeRender:
+        key = (drawing_id, width, height, background.rgba())
+        r = cls._renders.get(key)
+        if r is not None:
+            cls._renders.move_to_end(key)
+            return r
+
+        colors = [PEN_COLORS[i % len(PEN_COLORS)] for i in range(len(strokes))]
+        r = _StrokeRender(strokes, width, height, background, colors)
+        cls._renders[key] = r
+        if len(cls._renders) > cls.MAX_RENDERS:
+            cls._renders.popitem(last=False)
+        return r
+
+    @classmethod
+    def bucket(cls, progress: float) -> int:
+        return int(round(max(0.0, min(1.0, progress)) * cls.PROGRESS_BUCKETS))
+
+    @classmethod
+    def frame(cls, drawing_id: int, r: _StrokeRender, bucket: int) -> QImage:
+        key = (drawing_id, r.width, r.height, r.background_rgba, bucket)
+        img = cls._frames.get(key)
+        if img is not None:
+            cls._frames.move_to_end(key)
+            return img
+
+        position = int(round(bucket / cls.PROGRESS_BUCKETS * r.segment_count))
+        img = r.frame(position)
+        cls._frames[key] = img
+        if len(cls._frames) > cls.MAX_FRAMES:
+            cls._frames.popitem(last=False)
+        return img
+
+    @classmethod
+    def invalidate(cls, drawing_id: int) -> None:
+        '''Drops everything cached for a drawing, e.g. after its strokes change'''
+        for k in [k for k in cls._renders if k[0] == drawing_id]:
+            del cls._renders[k]
+        for k in [k for k in cls._frames if k[0] == drawing_id]:
+            del cls._frames[k]
+
+    @classmethod
+    def _on_drawing_synced(cls, drawing: Drawing) -> None:
+        # Shared renders of a drawing go as soon as its strokes are saved again
+        cls.invalidate(drawing.id)
+
+
+
+Drawing.add_sync_listener(GlyphRenderCache._on_drawing_synced)
+
+
+
+class AnimationClock(QObject):
+    """A single timer stepping any number of DrawingDisplays, so a grid of
+    cells animates from one QTimer instead of one timer per cell."""
+
+    def __init__(self, milisec_per_point: int = 10, parent=None):
+        super().__init__(parent)
+        self._running: list[DrawingDisplay] = []
+        self._timer = QTimer(self)
+        self._timer.setInterval(milisec_per_point)
+        self._timer.timeout.connect(self._tick)
+
+    def start(self, d: DrawingDisplay) -> None:
+        if d not in self._running:
+            self._running.append(d)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def remove(self, d: DrawingDisplay) -> None:
+        if d in self._running:
+            self._running.remove(d)
+        if not self._running:
+            self._timer.stop()
+
+    def _tick(self) -> None:
+        for d in list(self._running):
+            if not d.step():
+                self._running.remove(d)
+        if not self._running:
+            self._timer.stop()
 
 
 
 class DrawingDisplay(QWidget):
-    pen_colors = cycle([
-        QColor("#1f77b4"), QColor("#ff7f0e"),
-        QColor("#2ca02c"), QColor("#d62728"),
-        QColor("#9467bd"), QColor("#8c564b"),
-        QColor("#e377c2"), QColor("#7f7f7f"),
-        QColor("#bcbd22"), QColor("#17becf"),
-        QColor("#393b79"), QColor("#637939"),
-        QColor("#8c6d31"), QColor("#843c39"),
-        QColor("#7b4173"), QColor("#3182bd"),
-        QColor("#e6550d"), QColor("#31a354"),
-        QColor("#756bb1"), QColor("#636363"),
-        QColor("#9c9ede"), QColor("#cedb9c"),
-        QColor("#e7ba52"), QColor("#ad494a"),
-        QColor("#a55194"), QColor("#6baed6"),
-        QColor("#fd8d3c"), QColor("#74c476"),
-        QColor("#9e9ac8"), QColor("#bdbdbd"),
-        QColor("#b5cf6b"), QColor("#17becf")])
+    pen_colors = cycle(PEN_COLORS)
 
     def __init__(self,
                  parent=None,
                  width=300,
                  height=300,
-                 milisec_per_point = 10):
+                 milisec_per_point = 10,
+                 clock: AnimationClock | None = None):
         super().__init__(parent)
 
         self.setMinimumSize(width, height)
-        
-        # Make pen for drawing
-        self._pen = QPen(
-            Qt.GlobalColor.black,
-            3,
-            Qt.PenStyle.SolidLine,
-            Qt.PenCapStyle.RoundCap,
-            Qt.PenJoinStyle.RoundJoin)
-        self._pen.setColor(next(self.pen_colors))
-        
-        # Create surface for drawing
-        self._image = QImage(width,height,QImage.Format.Format_ARGB32_Premultiplied)
-        self._image.fill(self.palette().color(self.backgroundRole()))
+
+        # Size of the surface strokes are mapped onto
+        self._width = width
+        self._height = height
 
         # Initialize stroke information
-        self._raw_strokes: list[list[float]] | None = None
-        self._point_strokes: list[list[QPointF]] = []
-        self._current_stroke_index: int = 0
-        self._current_stroke_point_index: int = 1
-        self._current_stroke_point_count: int = 0
-        
-        # Initialize timer
+        self._raw_strokes: StrokeSet | list[list[float]] | None = None
+        self._stroke_set: StrokeSet | None = None
+        self._cache_key: int | None = None
+        self._render: _StrokeRender | None = None
+        self._colors: list[QColor] = []
+        self._position: int = 0
+
+        # Finished frame from GlyphRenderCache when scrubbing a cached drawing
+        self._frame: QImage | None = None
+
+        # Initialize timer, either our own or a clock shared with other displays
         self._milisec_per_point = milisec_per_point
+        self._clock = clock
         self._timer = QTimer(self)
         self._timer.timeout.connect(self._tick)
-        
+
 
 
     def _tick(self) -> None:
-        if self._point_strokes is None or len(self._point_strokes) == 0:
-            self.stop()
-            return
+        if not self.step():
+            self.stop() # terminate the timer loop, having completed the drawing
 
-        last_point = None
-        this_point = None
-        this_stroke = self._point_strokes[self._current_stroke_index]
-        
-        last_point = this_stroke[self._current_stroke_point_index - 1]
-        this_point = this_stroke[self._current_stroke_point_index]
-
-        p = QPainter(self._image)
-        p.setRenderHint(QPainter.RenderHint.Antialiasing, True)
-        p.setPen(self._pen)
-        p.drawLine(last_point, this_point)
-        p.end()
-        
+
+
+    def step(self) -> bool:
+        """Advances the animation by one segment. Returns False once the
+        drawing is complete."""
+        if self._render is None or self._position >= self._render.segment_count:
+            return False
+
+        self._frame = None
+        self._position += 1
         self.update()
-        self.setup_next_point()
+        return self._position < self._render.segment_count
+
+
 
+    def _blank_image(self) -> QImage:
+        img = QImage(self._width, self._height, QImage.Format.Format_ARGB32_Premultiplied)
+        img.fill(self.palette().color(self.backgroundRole()))
+        return img
 
 
-    def setup_next_point(self):
-        next_stroke_point_ind = self._current_stroke_point_index + 1
 
-        if next_stroke_point_ind >= self._current_stroke_point_count:
-            if self._current_stroke_index + 1 >= len(self._point_strokes):
-                self._current_stroke_point_index = 1
-                self._current_stroke_point_count = len(self._point_strokes[0])
-                self._current_stroke_index = 0
-                self.stop() # terminate the timer loop, having completed the drawing
-            else:
-                self._current_stroke_index += 1
-                self._current_stroke_point_index = 1
-                self._current_stroke_point_count = len(self._point_strokes[self._current_stroke_index])
-                self._pen.setColor(next(self.pen_colors)) # Change the pen color each stroke
+    def _build_render(self) -> None:
+        strokes = self._stroke_set
+        if strokes is None:
+            self._render = None
+        elif self._cache_key is not None:
+            self._render = GlyphRenderCache.render(self._cache_key,
+                                                   strokes,
+                                                   self._width,
+                                                   self._height,
+                                                   self.palette().color(self.backgroundRole()))
         else:
-            self._current_stroke_point_index = next_stroke_point_ind
-                
-        
+            self._render = _StrokeRender(strokes,
+                                         self._width,
+                                         self._height,
+                                         self.palette().color(self.backgroundRole()),
+                                         self._colors)
+
+
 
     def resizeEvent(self, a0: Optional[QResizeEvent]) -> None:
         super().resizeEvent(a0)
-        # Create new backing store at new size
-        new_img = QImage(self.size(), QImage.Format.Format_ARGB32_Premultiplied)
-        new_img.fill(self.palette().color(self.backgroundRole()))
-        self._image = new_img
+        width = max(1, self.width())
+        height = max(1, self.height())
+        if width == self._width and height == self._height and self._render is not None:
+            return
+        self._width = width
+        self._height = height
 
         # Re-map strokes to new size then redraw
         if self._raw_strokes is not None:
-            self.set_strokes(self._raw_strokes)
-            self.set_strokes(self._raw_strokes)
+            self._build_render()
             self.restart()
         else:
             self.update()
@@ -128,56 +347,62 @@ class DrawingDisplay(QWidget):
 
     def paintEvent(self, a0: Optional[QPaintEvent]) -> None:
         p = QPainter(self)
-        p.drawImage(0, 0, self._image)
+        if self._frame is not None:
+            p.drawImage(0, 0, self._frame)
+        elif self._render is not None:
+            self._render.paint(p, self._position)
+        else:
+            p.drawImage(0, 0, self._blank_image())
         p.end()
-        
+
 
 
     def stop(self) -> None:
+        if self._clock is not None:
+            self._clock.remove(self)
         self._timer.stop()
 
 
 
     def resume(self) -> None:
-        self._timer.start(self._milisec_per_point)
+        if self._clock is not None:
+            self._clock.start(self)
+        else:
+            self._timer.start(self._milisec_per_point)
 
 
 
     def clear(self) -> None:
         self.stop()
         self._raw_strokes = None
-        self._point_strokes = []
-        self._current_stroke_index = 0
-        self._current_stroke_point_index = 1
-        self._current_stroke_point_count = 0
-        self._image.fill(self.palette().color(self.backgroundRole()))
+        self._stroke_set = None
+        self._cache_key = None
+        self._render = None
+        self._frame = None
+        self._position = 0
         self.update()
 
     def restart(self) -> None:
-        if not self._point_strokes:
+        if self._render is None or not self._render.point_strokes:
             self.clear()
             return
 
-        self._image.fill(self.palette().color(self.backgroundRole()))
-        self._current_stroke_index = 0
-        self._current_stroke_point_index = 1
-        self._current_stroke_point_count = len(self._point_strokes[self._current_stroke_index])
+        self._position = 0
+        self._frame = None
         self.update()
         self.resume()
 
     def _segment_count(self) -> int:
-        total = 0
-        for s in self._point_strokes:
-            if len(s) >= 2:
-                total += (len(s) - 1)
-        return total
+        if self._render is None:
+            return 0
+        return self._render.segment_count
 
     def set_progress(self, progress: float) -> None:
         """
         Render drawing at a specific progress in [0.0, 1.0].
         This acts as a scrubber over the current stroke sequence.
         """
-        if not self._point_strokes:
+        if self._render is None or not self._render.point_strokes:
             return
         p = max(0.0, min(1.0, float(progress)))
         total_segments = self._segment_count()
@@ -185,47 +410,37 @@ class DrawingDisplay(QWidget):
             return
 
         self.stop()
-        segments_to_draw = int(round(p * total_segments))
-        segments_left = segments_to_draw
-
-        self._image.fill(self.palette().color(self.backgroundRole()))
-        painter = QPainter(self._image)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
-        painter.setPen(self._pen)
-
-        for stroke in self._point_strokes:
-            if len(stroke) < 2 or segments_left <= 0:
-                continue
-            max_segments_in_stroke = len(stroke) - 1
-            draw_n = min(max_segments_in_stroke, segments_left)
-            for i in range(draw_n):
-                painter.drawLine(stroke[i], stroke[i + 1])
-            segments_left -= draw_n
-            if segments_left <= 0:
-                break
-
-        painter.end()
+        if self._cache_key is not None:
+            bucket = GlyphRenderCache.bucket(p)
+            self._frame = GlyphRenderCache.frame(self._cache_key, self._render, bucket)
+            self._position = int(round(bucket / GlyphRenderCache.PROGRESS_BUCKETS * total_segments))
+        else:
+            self._frame = None
+            self._position = int(round(p * total_segments))
         self.update()
 
 
-    def set_strokes(self, strokes: list[list[float]]):
+    def set_strokes(self, strokes: StrokeSet | list[list[float]], cache_key: int | None = None):
+        """Sets the strokes to display. When 'cache_key' (normally the drawing
+        id) is given the render is shared through GlyphRenderCache."""
         # assert that the strokes are well formed
-        for s in strokes:
-            l = len(s)
+        try:
+            stroke_set = StrokeSet.from_lists(strokes)
+        except ValueError:
             # There same number x and y value
-            if l % 2 != 0:
-                raise ValueError('Invalid strokes: not same number of x y values')
-            # There are atleast 2 points
-            if l // 2 < 2:
-                raise ValueError('Invalid strokes: stoke has less than two points')
-        normalized = normalize_strokes(strokes,
-                                       width=float(self._image.width()),
-                                       height=float(self._image.height()))
+            raise ValueError('Invalid strokes: not same number of x y values')
+        # There are atleast 2 points
+        if (stroke_set.lengths < 2).any():
+            raise ValueError('Invalid strokes: stoke has less than two points')
+
+        # Keep colors stable across resizes of the same strokes
+        if strokes is not self._raw_strokes or len(self._colors) != len(strokes):
+            self._colors = [next(self.pen_colors) for _ in strokes]
+
         # Assign values
         self._raw_strokes = strokes
-        self._current_stroke_index = 0
-        self._current_stroke_point_index = 1
-        self._point_strokes = [[QPointF(p[0], p[1])
-                                for p in zip(s[::2], s[1::2])]
-                                    for s in normalized]
-        self._current_stroke_point_count = len(self._point_strokes[self._current_stroke_index])
+        self._stroke_set = stroke_set
+        self._cache_key = cache_key
+        self._position = 0
+        self._frame = None
+        self._build_render()
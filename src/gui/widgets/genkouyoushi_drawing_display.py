@@ -16,7 +16,8 @@ from PyQt6.QtWidgets import (
 )
 
 from data.drawing import Drawing
-from gui.widgets.drawing_display import DrawingDisplay
+from gui.widgets.drawing_display import AnimationClock, DrawingDisplay
+from logic.stroke_set import StrokeSet
 
 
 class GenkouyoushiDrawingDisplay(QFrame):
@@ -33,6 +34,9 @@ class GenkouyoushiDrawingDisplay(QFrame):
     Notes:
       - For each glyph, we pick one Drawing from Drawing.by_glyph(glyph).
         Currently: choose the smallest drawing id (deterministic).
+      - Cells render through GlyphRenderCache keyed by drawing id, so repeated
+        glyphs (and the same glyph on other pages) are normalized and drawn
+        once, and all cells animate from a single AnimationClock.
     """
 
     def __init__(
@@ -59,6 +63,7 @@ class GenkouyoushiDrawingDisplay(QFrame):
         self._displays: list[DrawingDisplay] = []
         self._glyphs: list[str] = []
         self._progress_value: int = 0
+        self._clock = AnimationClock(self._ms_per_point, self)
 
         # Outer layout
         root = QGridLayout(self)
@@ -170,16 +175,16 @@ class GenkouyoushiDrawingDisplay(QFrame):
         Uses Drawing.by_glyph(g).
         """
         for glyph, disp in zip(self._glyphs, self._displays, strict=False):
-            strokes: list[list[float]] = []
+            strokes: StrokeSet | list[list[float]] = []
 
             drawings = Drawing.by_glyph(glyph)
             if drawings:
                 # deterministic choice: smallest id
                 d_id = min(drawings.keys())
-                strokes = drawings[d_id].strokes
+                strokes = drawings[d_id].stroke_set
 
             if strokes:
-                disp.set_strokes(strokes)
+                disp.set_strokes(strokes, cache_key=d_id)
                 disp.set_progress(self._progress_value / 100.0)
             else:
                 # No drawing found: clear the display
@@ -190,6 +195,8 @@ class GenkouyoushiDrawingDisplay(QFrame):
     # ---------------------------------------------------------------------
 
     def _clear_grid(self) -> None:
+        for d in self._displays:
+            d.stop()
         for f in self._frames:
             self._grid.removeWidget(f)
             f.deleteLater()
@@ -230,6 +237,7 @@ class GenkouyoushiDrawingDisplay(QFrame):
                 width=self._cell_w,
                 height=self._cell_h,
                 milisec_per_point=self._ms_per_point,
+                clock=self._clock,
             )
             inner.addWidget(disp, 1)
 
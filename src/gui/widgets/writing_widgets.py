@@ -1,6 +1,8 @@
 import math
 from typing import Callable, Optional
 from itertools import cycle
+import numpy as np
+from logic.stroke_set import StrokeSet
 from PyQt6.QtCore import pyqtSignal, pyqtSlot, Qt, QPoint, QRect, QSize
 from PyQt6.QtGui import QPainter, QPen, QImage, QColor, QMouseEvent, QPaintEvent
 
@@ -21,7 +23,73 @@ from PyQt6.QtWidgets import (QWidget,
 
 
 
+class _StrokeBuffer:
+    '''Growable float32 store for captured points.
 
+    Points are kept in coordinates normalized to the surface size, so a
+    resize never touches them. Finished strokes are delimited by offsets
+    into the point array; the stroke being drawn is the tail after the
+    last offset. Appending a point writes into preallocated storage and
+    only reallocates (doubling) when the capacity runs out.
+    '''
+
+    def __init__(self, capacity: int = 1024):
+        self._points = np.empty((capacity, 2), dtype=np.float32)
+        self._count = 0
+        self._offsets: list[int] = [0]
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def append(self, x: float, y: float):
+        if self._count == self._points.shape[0]:
+            grown = np.empty((self._count * 2, 2), dtype=np.float32)
+            grown[:self._count] = self._points[:self._count]
+            self._points = grown
+        self._points[self._count, 0] = x
+        self._points[self._count, 1] = y
+        self._count += 1
+
+    def end_stroke(self,
+                   epsilon: float = 0.0,
+                   max_points: int | None = None,
+                   scale_x: float = 1.0,
+                   scale_y: float = 1.0) -> bool:
+        '''Closes the stroke being drawn; strokes of fewer than two points are dropped
+
+        With an epsilon (in units of the scaled coordinates) the stroke is
+        simplified in place before it is closed, and max_points caps what is
+        left (see StrokeSet.simplified).
+        '''
+        start = self._offsets[-1]
+        if self._count - start < 2:
+            self._count = start
+            return False
+        if epsilon > 0 or max_points is not None:
+            scale = np.array([scale_x, scale_y], dtype=np.float32)
+            pts = self._points[start:self._count] * scale
+            one = StrokeSet(pts, np.array([0, pts.shape[0]], dtype=np.intp))
+            kept = one.simplified(epsilon, max_points).points / scale
+            self._points[start:start + kept.shape[0]] = kept
+            self._count = start + kept.shape[0]
+        self._offsets.append(self._count)
+        return True
+
+    def clear(self):
+        self._count = 0
+        self._offsets = [0]
+
+    def stroke_set(self, scale_x: float = 1.0, scale_y: float = 1.0) -> StrokeSet:
+        '''Finished strokes as a StrokeSet
+
+        With the default scale its points are a view into the buffer itself.
+        Otherwise all points are scaled in one vectorized pass.
+        '''
+        n = self._offsets[-1]
+        ss = StrokeSet(self._points[:n], np.array(self._offsets, dtype=np.intp))
+        if scale_x != 1.0 or scale_y != 1.0:
+            ss = ss.scaled(scale_x, scale_y)
+        return ss
 
 
 class DrawingSurface(QWidget):
@@ -48,13 +116,18 @@ class DrawingSurface(QWidget):
     def __init__(self,
                  parent=None,
                  min_w: int = 100,
-                 min_h: int = 100):
+                 min_h: int = 100,
+                 simplify_tolerance: float = 0.75,
+                 max_stroke_points: int | None = 256):
         super().__init__(parent)
 
         self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         self.setMinimumSize(min_w,min_h)
-        self.strokes = []
-        self.current_stroke = None
+        self._buffer = _StrokeBuffer()
+        # Finished strokes are simplified to within simplify_tolerance pixels
+        # (0 keeps every point) and capped at max_stroke_points (None for no cap)
+        self.simplify_tolerance = simplify_tolerance
+        self.max_stroke_points = max_stroke_points
 
         self.pen = QPen(
             Qt.GlobalColor.black,
@@ -80,8 +153,22 @@ class DrawingSurface(QWidget):
         p = QPainter(self)                     # paint widget from backing image
         p.drawImage(0, 0, self.image)
 
+    @property
+    def strokes(self) -> list[np.ndarray]:
+        '''Finished strokes in widget pixel coordinates'''
+        return list(self.stroke_set())
+
+    def stroke_set(self) -> StrokeSet:
+        '''Finished strokes in widget pixel coordinates as a StrokeSet'''
+        return self._buffer.stroke_set(self.image.width(), self.image.height())
 
+    def normalized_strokes(self) -> list[np.ndarray]:
+        '''Finished strokes in [0, 1] surface coordinates, as views into the capture buffer'''
+        return list(self._buffer.stroke_set())
 
+    def _capture(self, pt: QPoint):
+        self._buffer.append(pt.x() / self.image.width(),
+                            pt.y() / self.image.height())
 
     def resizeEvent(self, a0) -> None:
         assert a0
@@ -107,26 +194,7 @@ class DrawingSurface(QWidget):
         finally:
             p.end()
 
-        # Scale stored stroke coordinates so they remain consistent with the new size
-        if old_w > 0 and old_h > 0 and self.strokes:
-            sx = new_w / old_w
-            sy = new_h / old_h
-
-            scaled_strokes: list[list[float]] = []
-            for stroke in self.strokes:
-                if not stroke:
-                    scaled_strokes.append(stroke)
-                    continue
-                s2: list[float] = []
-                # stroke is [x0, y0, x1, y1, ...]
-                for i in range(0, len(stroke) - 1, 2):
-                    x = stroke[i]
-                    y = stroke[i + 1]
-                    s2.append(x * sx)
-                    s2.append(y * sy)
-                scaled_strokes.append(s2)
-            self.strokes = scaled_strokes
-
+        # Stored strokes are normalized to the surface, nothing to rescale
         self.image = new_img
         super().resizeEvent(a0)
     # --- Mouse handling: draw onto the QImage ---
@@ -138,6 +206,7 @@ class DrawingSurface(QWidget):
             self.pen.setColor(next(self.pen_colors))
             self.is_drawing = True
             self.last_point = a0.position().toPoint()
+            self._capture(self.last_point)
 
     def mouseMoveEvent(self, a0):
         if not a0:
@@ -145,11 +214,7 @@ class DrawingSurface(QWidget):
         if self.is_drawing and (a0.buttons() & Qt.MouseButton.LeftButton):
             cur = a0.position().toPoint()       # QPoint (ints)
             p = QPainter(self.image)
-
-            if self.current_stroke is None:
-                self.current_stroke = []
-            self.current_stroke.append(cur.x())
-            self.current_stroke.append(cur.y())
+            self._capture(cur)
 
             if self.last_point is not None:
                 try:
@@ -166,13 +231,13 @@ class DrawingSurface(QWidget):
     def mouseReleaseEvent(self, a0: Optional[QMouseEvent]):
         if not a0:
             return
-        
-        self.strokes.append(self.current_stroke)
-        self.current_stroke = None
-
-        print(self.strokes)
 
         if a0.button() == Qt.MouseButton.LeftButton:
+            if self.is_drawing:
+                self._buffer.end_stroke(self.simplify_tolerance,
+                                        self.max_stroke_points,
+                                        self.image.width(),
+                                        self.image.height())
             self.is_drawing = False
             self.last_point = None
 
@@ -182,8 +247,7 @@ class DrawingSurface(QWidget):
         self.image.fill(self.palette().color(self.backgroundRole()))
         self.is_drawing = False
         self.last_point = None
-        self.strokes = []
-        self.current_stroke = None
+        self._buffer.clear()
         self.update()
 
 
@@ -1,14 +1,18 @@
 from __future__ import annotations
 
+import bisect
 from dataclasses import dataclass
-from functools import lru_cache
 import json
 import os
 import random
+import threading
 from typing import Optional
 
-from data import Drawing, KanaCard, KanjiCard, PhraseCard
-from data.helpers import is_kana, is_kanji
+import sqlalchemy as sqla
+
+from data import GlyphEntry, GlyphIndex, PhraseCard, maybe_connection
+from data.database import phrase_card_table, KANA_CARD_KIND, KANJI_CARD_KIND
+from data.helpers import japanese_in, kanji_in
 
 try:
     from openai import OpenAI
@@ -33,59 +37,155 @@ class FillBlankExercise:
 PhraseExample = tuple[str, str, str]
 
 
-def _pick_phrase_text(card: PhraseCard) -> str:
-    kp = (card.kanji_phrase or "").strip()
-    if kp:
-        return kp
-    return (card.kana_phrase or "").strip()
-
-
-@lru_cache(maxsize=1)
-def _load_inventory() -> tuple[set[str], list[str], list[str], list[PhraseExample]]:
-    kana_chars = sorted(
-        {
-            c.kana.strip()
-            for c in KanaCard.in_db()
-            if getattr(c, "kana", None) and len(c.kana.strip()) == 1
-        }
-    )
-    kanji_chars = sorted(
-        {
-            c.kanji.strip()
-            for c in KanjiCard.in_db()
-            if getattr(c, "kanji", None) and len(c.kanji.strip()) == 1
-        }
-    )
-
-    allowed_chars = set(kana_chars) | set(kanji_chars)
-
-    phrase_examples: list[PhraseExample] = []
-    seen_text: set[str] = set()
-    for card in PhraseCard.in_db():
-        text = _pick_phrase_text(card)
-        if not text or text in seen_text:
-            continue
-
-        japanese_chars = [ch for ch in text if is_kana(ch) or is_kanji(ch)]
+class _InventoryIndex:
+    """Characters and phrases available for fill-in-the-blank practice.
+
+    Characters come from the GlyphIndex and phrases from one column-only
+    query; both are kept current through sync listeners, so lookups never
+    rescan the database."""
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._loaded = False
+        self.allowed_chars: set[str] = set()
+        self.kana_chars: list[str] = []
+        self.kanji_chars: list[str] = []
+        self.phrase_examples: list[PhraseExample] = []
+        self.phrases_by_char: dict[str, list[PhraseExample]] = {}
+        # Indexed phrase texts, with the number of cards having each one
+        self._seen_text: dict[str, int] = {}
+        self._examples: dict[str, PhraseExample] = {}
+        # The text each phrase card was last indexed under
+        self._card_text: dict[int, str] = {}
+        # Phrases waiting on characters not yet in the database, keyed by one
+        # missing character
+        self._pending: dict[str, list[PhraseExample]] = {}
+
+    # Loading ##################################################################
+
+    def ensure_loaded(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            for kana in GlyphIndex.glyphs(KANA_CARD_KIND):
+                self._add_char(kana, self.kana_chars)
+            for kanji in GlyphIndex.glyphs(KANJI_CARD_KIND):
+                self._add_char(kanji, self.kanji_chars)
+            with maybe_connection(None) as con:
+                stmnt = sqla.select(phrase_card_table.c.card_id,
+                                    phrase_card_table.c.kanji_phrase,
+                                    phrase_card_table.c.kana_phrase,
+                                    phrase_card_table.c.meaning,
+                                    phrase_card_table.c.grammar)
+                for card_id, kanji_phrase, kana_phrase, meaning, grammar in con.execute(stmnt):
+                    self._add_phrase(card_id, kanji_phrase, kana_phrase, meaning, grammar)
+            self._loaded = True
+
+    # Sync listeners ###########################################################
+
+    def on_glyph_indexed(self, entry: GlyphEntry) -> None:
+        with self._lock:
+            if not self._loaded:
+                return
+            if entry.kind == KANA_CARD_KIND:
+                self._add_char(entry.glyph, self.kana_chars)
+            elif entry.kind == KANJI_CARD_KIND:
+                self._add_char(entry.glyph, self.kanji_chars)
+
+    def on_phrase_synced(self, card: PhraseCard) -> None:
+        with self._lock:
+            if self._loaded:
+                # The phrase may have been edited, so its old text goes first
+                self._remove_phrase(card.card.id)
+                self._add_phrase(card.card.id, card.kanji_phrase, card.kana_phrase, card.meaning, card.grammar)
+
+    # Helpers ##################################################################
+
+    def _add_char(self, ch: str | None, ordered: list[str]) -> None:
+        ch = (ch or "").strip()
+        if len(ch) != 1 or ch in self.allowed_chars:
+            return
+        self.allowed_chars.add(ch)
+        bisect.insort(ordered, ch)
+
+        # Re-check the phrases that were only waiting on this character
+        for example in self._pending.pop(ch, []):
+            self._place_example(example)
+
+    def _add_phrase(self,
+                    card_id: int,
+                    kanji_phrase: str | None,
+                    kana_phrase: str | None,
+                    meaning: str | None,
+                    grammar: str | None) -> None:
+        text = (kanji_phrase or "").strip() or (kana_phrase or "").strip()
+        if not text:
+            return
+        if text in self._seen_text:
+            self._seen_text[text] += 1
+            self._card_text[card_id] = text
+            return
+
+        japanese_chars = japanese_in(text)
         if len(japanese_chars) < 2 or len(japanese_chars) > 12:
-            continue
-        if not all(ch in allowed_chars for ch in japanese_chars):
-            continue
-
-        phrase_examples.append(
-            (
-                text,
-                (card.meaning or "").strip(),
-                (card.grammar or "").strip(),
-            )
-        )
-        seen_text.add(text)
-
-    return allowed_chars, kana_chars, kanji_chars, phrase_examples
+            return
+
+        self._seen_text[text] = 1
+        self._card_text[card_id] = text
+        example = (text, (meaning or "").strip(), (grammar or "").strip())
+        self._examples[text] = example
+        self._place_example(example)
+
+    def _remove_phrase(self, card_id: int) -> None:
+        """Drops what the card was last indexed under, unless another card
+        still has the same text"""
+        text = self._card_text.pop(card_id, None)
+        if text is None:
+            return
+        count = self._seen_text[text] - 1
+        if count:
+            self._seen_text[text] = count
+            return
+        del self._seen_text[text]
+        example = self._examples.pop(text)
+
+        for ch in set(japanese_in(text)):
+            waiting = self._pending.get(ch)
+            if waiting is not None and example in waiting:
+                waiting.remove(example)
+                if not waiting:
+                    del self._pending[ch]
+                # A pending phrase is nowhere else
+                return
+
+        self.phrase_examples.remove(example)
+        for ch in set(text):
+            by_char = self.phrases_by_char.get(ch)
+            if by_char is not None and example in by_char:
+                by_char.remove(example)
+                if not by_char:
+                    del self.phrases_by_char[ch]
+
+    def _place_example(self, example: PhraseExample) -> None:
+        text = example[0]
+        for ch in japanese_in(text):
+            if ch not in self.allowed_chars:
+                self._pending.setdefault(ch, []).append(example)
+                return
+
+        self.phrase_examples.append(example)
+        for ch in set(text):
+            if ch in self.allowed_chars:
+                self.phrases_by_char.setdefault(ch, []).append(example)
+
+
+_inventory = _InventoryIndex()
+GlyphIndex.add_listener(_inventory.on_glyph_indexed)
+PhraseCard.add_sync_listener(_inventory.on_phrase_synced)
 
 
 def _build_hint(answer: str) -> str:
-    kc = KanjiCard.by_kanji(answer)
+    kc = GlyphIndex.kanji_card(answer)
     if kc is not None:
         pieces: list[str] = []
         if kc.meaning:
@@ -95,7 +195,7 @@ def _build_hint(answer: str) -> str:
             pieces.append(f"reading: {readings}")
         return " • ".join(pieces) if pieces else "This blank is a kanji already in your database."
 
-    kana = KanaCard.by_kana(answer)
+    kana = GlyphIndex.kana_card(answer)
     if kana is not None and getattr(kana, "romaji", None):
         return f"romaji: {kana.romaji}"
 
@@ -106,25 +206,18 @@ def _is_allowed_sentence(sentence: str, allowed_chars: set[str]) -> bool:
     if not sentence:
         return False
 
-    for ch in sentence:
-        if ch in allowed_chars or ch in _ALLOWED_PUNCTUATION:
-            continue
-        if ch.isspace():
-            continue
-        if is_kana(ch) or is_kanji(ch):
-            return False
-        return False
-    return True
+    # Anything left besides whitespace, kana and kanji included, is not allowed
+    rest = set(sentence).difference(allowed_chars, _ALLOWED_PUNCTUATION)
+    return all(ch.isspace() for ch in rest)
 
 
 def _has_saved_drawing(glyph: str) -> bool:
-    matches = Drawing.by_glyph(glyph)
-    return bool(matches)
+    return GlyphIndex.has_drawing(glyph)
 
 
 def _candidate_answers(text: str, allowed_chars: set[str]) -> list[str]:
-    chars = [ch for ch in text if ch in allowed_chars and (is_kana(ch) or is_kanji(ch))]
-    preferred = [ch for ch in chars if is_kanji(ch)]
+    chars = [ch for ch in japanese_in(text) if ch in allowed_chars]
+    preferred = [ch for ch in kanji_in(text) if ch in allowed_chars]
 
     preferred_with_drawings = [ch for ch in preferred if _has_saved_drawing(ch)]
     if preferred_with_drawings:
@@ -148,7 +241,7 @@ def _fallback_exercise(
 
     pool = phrase_examples
     if preferred_answer:
-        narrowed = [item for item in phrase_examples if preferred_answer in item[0]]
+        narrowed = _inventory.phrases_by_char.get(preferred_answer)
         if narrowed:
             pool = narrowed
 
@@ -179,12 +272,20 @@ def _fallback_exercise(
     )
 
 
-def _request_openai_exercise(
-    answer: str,
-    related_examples: list[PhraseExample],
-    kana_chars: list[str],
-    allowed_chars: set[str],
-) -> FillBlankExercise:
+_EXERCISE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sentence": {"type": "string"},
+        "answer": {"type": "string"},
+        "english_meaning": {"type": "string"},
+        "hint": {"type": "string"},
+    },
+    "required": ["sentence", "answer", "english_meaning", "hint"],
+    "additionalProperties": False,
+}
+
+
+def _openai_client():
     if OpenAI is None:
         raise RuntimeError("The `openai` package is not available in this environment.")
 
@@ -192,22 +293,74 @@ def _request_openai_exercise(
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY is not set.")
 
+    return OpenAI(api_key=api_key)
+
+
+def _build_whitelist(
+    answers: list[str],
+    related_examples: list[PhraseExample],
+    kana_chars: list[str],
+    allowed_chars: set[str],
+) -> list[str]:
     whitelist = sorted(
         {
             ch
             for text, _, _ in related_examples
-            for ch in text
-            if ch in allowed_chars and (is_kana(ch) or is_kanji(ch))
+            for ch in japanese_in(text)
+            if ch in allowed_chars
         }
     )
 
-    if answer not in whitelist:
-        whitelist.append(answer)
+    for answer in answers:
+        if answer not in whitelist:
+            whitelist.append(answer)
 
     if len(whitelist) < 14:
         extra_kana = random.sample(kana_chars, k=min(14 - len(whitelist), len(kana_chars)))
         whitelist.extend(ch for ch in extra_kana if ch not in whitelist)
 
+    return whitelist
+
+
+def _exercise_from_payload(
+    payload: dict,
+    answer: str,
+    allowed_chars: set[str],
+    source: str,
+) -> FillBlankExercise:
+    sentence = (payload.get("sentence") or "").strip()
+    returned_answer = (payload.get("answer") or "").strip()
+    english_meaning = (payload.get("english_meaning") or "").strip()
+    hint = (payload.get("hint") or "").strip()
+
+    if returned_answer != answer:
+        raise ValueError("OpenAI returned a different answer character than requested.")
+    if len(returned_answer) != 1 or returned_answer not in allowed_chars:
+        raise ValueError("OpenAI returned an answer that is not in the database.")
+    if returned_answer not in sentence:
+        raise ValueError("OpenAI returned a sentence that does not include the answer.")
+    if not _is_allowed_sentence(sentence, allowed_chars):
+        raise ValueError("OpenAI returned characters that are not present in the database.")
+
+    return FillBlankExercise(
+        sentence=sentence,
+        blanked_sentence=sentence.replace(returned_answer, BLANK_CHAR, 1),
+        answer=returned_answer,
+        english_meaning=english_meaning,
+        hint=hint or _build_hint(returned_answer),
+        source=source,
+    )
+
+
+def _request_openai_exercise(
+    answer: str,
+    related_examples: list[PhraseExample],
+    kana_chars: list[str],
+    allowed_chars: set[str],
+) -> FillBlankExercise:
+    client = _openai_client()
+    whitelist = _build_whitelist([answer], related_examples, kana_chars, allowed_chars)
+
     example_block = "\n".join(
         f"- {text} :: {meaning}" if meaning else f"- {text}"
         for text, meaning, _ in related_examples[:6]
@@ -236,7 +389,6 @@ def _request_openai_exercise(
         }}
     """.strip()
 
-    client = OpenAI(api_key=api_key)
     response = client.chat.completions.create(
         model=MODEL_NAME,
         messages=[{"role": "user", "content": prompt}],
@@ -244,45 +396,134 @@ def _request_openai_exercise(
             "type": "json_schema",
             "json_schema": {
                 "name": "FillBlankExercise",
+                "schema": _EXERCISE_SCHEMA,
+            },
+        },
+        timeout=30,
+    )
+
+    payload = json.loads(response.choices[0].message.content)
+    return _exercise_from_payload(payload, answer, allowed_chars, f"OpenAI ({MODEL_NAME})")
+
+
+def _request_openai_exercises(
+    answers: list[str],
+    related_examples: dict[str, list[PhraseExample]],
+    kana_chars: list[str],
+    allowed_chars: set[str],
+) -> tuple[list[FillBlankExercise], set[str]]:
+    """Requests one exercise for every character in `answers` with a single
+    call. Each returned item is validated on its own. Returns the valid
+    exercises and the answers whose items all failed validation; answers the
+    model skipped are in neither."""
+    client = _openai_client()
+
+    all_examples: list[PhraseExample] = []
+    for answer in answers:
+        all_examples.extend(related_examples.get(answer, [])[:3])
+    whitelist = _build_whitelist(answers, all_examples, kana_chars, allowed_chars)
+
+    example_block = "\n".join(
+        f"- {text} :: {meaning}" if meaning else f"- {text}"
+        for text, meaning, _ in all_examples[:3 * len(answers)]
+    )
+
+    prompt = f"""
+        You are generating {len(answers)} beginner-friendly Japanese fill-in-the-blank exercises.
+
+        Rules:
+        - Write exactly one exercise for each of these answer characters, in this order: {''.join(answers)}
+        - The missing answer of each exercise must be exactly its one answer character
+        - Use ONLY Japanese characters from this database-derived whitelist: {''.join(whitelist)}
+        - You may also use simple punctuation like 。、！？ and spaces
+        - Keep each sentence short and natural (about 4 to 12 characters)
+        - No romaji and no English in the sentences
+        - Each sentence must contain its answer character
+
+        Database examples:
+        {example_block}
+
+        Required:
+        {{
+        "exercises": [
+            {{
+            "sentence": "short Japanese sentence",
+            "answer": "{answers[0]}",
+            "english_meaning": "brief English meaning of the sentence",
+            "hint": "short hint for the learner"
+            }}
+        ]
+        }}
+    """.strip()
+
+    response = client.chat.completions.create(
+        model=MODEL_NAME,
+        messages=[{"role": "user", "content": prompt}],
+        response_format={
+            "type": "json_schema",
+            "json_schema": {
+                "name": "FillBlankExerciseBatch",
                 "schema": {
                     "type": "object",
                     "properties": {
-                        "sentence": {"type": "string"},
-                        "answer": {"type": "string"},
-                        "english_meaning": {"type": "string"},
-                        "hint": {"type": "string"},
+                        "exercises": {"type": "array", "items": _EXERCISE_SCHEMA},
                     },
-                    "required": ["sentence", "answer", "english_meaning", "hint"],
+                    "required": ["exercises"],
                     "additionalProperties": False,
                 },
             },
         },
-        timeout=30,
+        timeout=30 + 5 * len(answers),
     )
 
     payload = json.loads(response.choices[0].message.content)
-    sentence = (payload.get("sentence") or "").strip()
-    returned_answer = (payload.get("answer") or "").strip()
-    english_meaning = (payload.get("english_meaning") or "").strip()
-    hint = (payload.get("hint") or "").strip()
+    items = payload.get("exercises") or []
+
+    remaining = set(answers)
+    rejected: set[str] = set()
+    source = f"OpenAI ({MODEL_NAME}, batch)"
+    exercises: list[FillBlankExercise] = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        answer = (item.get("answer") or "").strip()
+        if answer not in remaining:
+            continue
+        try:
+            exercises.append(_exercise_from_payload(item, answer, allowed_chars, source))
+        except ValueError:
+            rejected.add(answer)
+            continue
+        remaining.discard(answer)
+        rejected.discard(answer)
 
-    if returned_answer != answer:
-        raise ValueError("OpenAI returned a different answer character than requested.")
-    if len(returned_answer) != 1 or returned_answer not in allowed_chars:
-        raise ValueError("OpenAI returned an answer that is not in the database.")
-    if returned_answer not in sentence:
-        raise ValueError("OpenAI returned a sentence that does not include the answer.")
-    if not _is_allowed_sentence(sentence, allowed_chars):
-        raise ValueError("OpenAI returned characters that are not present in the database.")
+    return exercises, rejected
 
-    return FillBlankExercise(
-        sentence=sentence,
-        blanked_sentence=sentence.replace(returned_answer, BLANK_CHAR, 1),
-        answer=returned_answer,
-        english_meaning=english_meaning,
-        hint=hint or _build_hint(returned_answer),
-        source=f"OpenAI ({MODEL_NAME})",
-    )
+
+def _pick_answer(phrase_examples: list[PhraseExample], allowed_chars: set[str]) -> str:
+    seed_text, _, _ = random.choice(phrase_examples)
+    seed_candidates = _candidate_answers(seed_text, allowed_chars)
+    if not seed_candidates:
+        raise ValueError("Could not choose a database-backed character for practice.")
+    return random.choice(seed_candidates)
+
+
+def _shorten_reason(exc: Exception) -> str:
+    reason = str(exc).strip() or "OpenAI unavailable"
+    if len(reason) > 120:
+        reason = reason[:117] + "..."
+    return reason
+
+
+def _checked_inventory() -> tuple[set[str], list[str], list[PhraseExample]]:
+    _inventory.ensure_loaded()
+    if not _inventory.allowed_chars:
+        raise ValueError("No kana or kanji cards were found in db.sqlite3.")
+
+    if not _inventory.phrase_examples:
+        raise ValueError("No phrase cards are available for fill-in-the-blank practice.")
+
+    return _inventory.allowed_chars, _inventory.kana_chars, _inventory.phrase_examples
 
 
 def generate_fill_blank_exercise() -> FillBlankExercise:
@@ -291,32 +532,64 @@ def generate_fill_blank_exercise() -> FillBlankExercise:
     present in db.sqlite3. OpenAI is used when available; otherwise it falls back
     to a short phrase already stored in the database.
     """
-    allowed_chars, kana_chars, _, phrase_examples = _load_inventory()
-    if not allowed_chars:
-        raise ValueError("No kana or kanji cards were found in db.sqlite3.")
+    allowed_chars, kana_chars, phrase_examples = _checked_inventory()
 
-    if not phrase_examples:
-        raise ValueError("No phrase cards are available for fill-in-the-blank practice.")
-
-    seed_text, seed_meaning, _ = random.choice(phrase_examples)
-    seed_candidates = _candidate_answers(seed_text, allowed_chars)
-    if not seed_candidates:
-        raise ValueError("Could not choose a database-backed character for practice.")
-
-    answer = random.choice(seed_candidates)
-    related_examples = [item for item in phrase_examples if answer in item[0]][:8]
+    answer = _pick_answer(phrase_examples, allowed_chars)
+    related_examples = _inventory.phrases_by_char.get(answer, [])[:8]
     if not related_examples:
         related_examples = [random.choice(phrase_examples)]
 
     try:
         return _request_openai_exercise(answer, related_examples, kana_chars, allowed_chars)
     except Exception as exc:
-        reason = str(exc).strip() or "OpenAI unavailable"
-        if len(reason) > 120:
-            reason = reason[:117] + "..."
         return _fallback_exercise(
             phrase_examples,
             allowed_chars,
             preferred_answer=answer,
-            reason=reason,
+            reason=_shorten_reason(exc),
         )
+
+
+def generate_fill_blank_exercises(count: int) -> list[FillBlankExercise]:
+    """
+    Build up to `count` exercises, each blanking a different character, with a
+    single OpenAI request. Answers whose item was rejected or missing (or the
+    whole batch when OpenAI is unavailable) are filled from database phrases
+    instead.
+    """
+    assert count >= 1
+    allowed_chars, kana_chars, phrase_examples = _checked_inventory()
+
+    # Choose distinct answers; give up after a bounded number of draws when the
+    # database simply does not have `count` usable characters
+    answers: list[str] = []
+    for _ in range(count * 4):
+        if len(answers) >= count:
+            break
+        answer = _pick_answer(phrase_examples, allowed_chars)
+        if answer not in answers:
+            answers.append(answer)
+
+    related = {a: _inventory.phrases_by_char.get(a, [])[:8] for a in answers}
+
+    reason = ""
+    rejected: set[str] = set()
+    try:
+        exercises, rejected = _request_openai_exercises(answers, related, kana_chars, allowed_chars)
+    except Exception as exc:
+        exercises = []
+        reason = _shorten_reason(exc)
+
+    by_answer = {e.answer: e for e in exercises}
+    result: list[FillBlankExercise] = []
+    for answer in answers:
+        exercise = by_answer.get(answer)
+        if exercise is None:
+            exercise = _fallback_exercise(
+                phrase_examples,
+                allowed_chars,
+                preferred_answer=answer,
+                reason=reason or ("rejected by validation" if answer in rejected else "missing from batch"),
+            )
+        result.append(exercise)
+    return result
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import codecs
+import csv
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator
+
+# Rows between two entries of the byte offset index, also the unit read_block
+# reads and caches
+ROWS_PER_BLOCK = 256
+# Bytes read to sniff the delimiter
+SNIFF_BYTES = 64 * 1024
+# Blocks kept by read_block
+CACHED_BLOCKS = 64
+
+
+class _LineReader:
+    """Feeds csv.reader one decoded line at a time while tracking the byte
+    offset of the next line. csv.reader never reads past the row it returns,
+    so after each row pos is where the next row starts."""
+
+    def __init__(self, f: BinaryIO, pos: int):
+        self._f = f
+        self.pos = pos
+
+    def __iter__(self) -> _LineReader:
+        return self
+
+    def __next__(self) -> str:
+        line = self._f.readline()
+        if not line:
+            raise StopIteration
+        self.pos += len(line)
+        # A newline byte never falls inside a UTF-8 sequence, so lines decode
+        # on their own
+        return line.decode("utf-8", errors="replace")
+
+
+class DelimitedFile:
+    """A CSV/TSV file read in blocks of rows instead of all at once.
+
+    The delimiter is sniffed from the first SNIFF_BYTES. index() makes one
+    streaming pass recording the byte offset of every ROWS_PER_BLOCK-th data
+    row, after which any block can be read with one seek. The first row is
+    kept as the header and blank lines are skipped."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            head = f.read(SNIFF_BYTES)
+        self._start = len(codecs.BOM_UTF8) if head.startswith(codecs.BOM_UTF8) else 0
+
+        self.delimiter = "\t" if path.suffix.lower() == ".tsv" else ","
+        sample = head[self._start:].decode("utf-8", errors="replace")
+        if len(head) == SNIFF_BYTES:
+            # Drop the partial last line
+            sample = sample[:sample.rfind("\n") + 1] or sample
+        try:
+            sniffed = csv.Sniffer().sniff(sample, delimiters=",\t;|")
+            self.delimiter = sniffed.delimiter or self.delimiter
+        except csv.Error:
+            pass
+
+        self.header: list[str] = []
+        self.column_count = 0
+        self.row_count = 0
+        self.indexed = False
+        self._data_start = self._start
+        self._offsets = array("q")
+        self._blocks: OrderedDict[int, list[list[str]]] = OrderedDict()
+
+        with open(path, "rb") as f:
+            f.seek(self._start)
+            lines = _LineReader(f, self._start)
+            for row in csv.reader(lines, delimiter=self.delimiter):
+                if row:
+                    self.header = row
+                    self.column_count = len(row)
+                    break
+            self._data_start = lines.pos
+
+    # Reading ##################################################################
+
+    def _rows_from(self, f: BinaryIO, pos: int) -> Iterator[tuple[int, list[str]]]:
+        """(start offset, row) for every non blank row from pos on"""
+        f.seek(pos)
+        lines = _LineReader(f, pos)
+        start = pos
+        for row in csv.reader(lines, delimiter=self.delimiter):
+            if row:
+                yield start, row
+            start = lines.pos
+
+    def index(self,
+              progress: Callable[[int, int], None] | None = None,
+              interrupted: Callable[[], bool] | None = None,
+              on_row: Callable[[list[str]], None] | None = None) -> bool:
+        """Records the offset of every block and the widest row. progress is
+        called with (rows indexed, column count) after each block and on_row
+        with every row. Returns False if interrupted returned True first."""
+        if self.indexed:
+            return True
+        offsets = array("q")
+        count = 0
+        columns = self.column_count
+        with open(self.path, "rb") as f:
+            for start, row in self._rows_from(f, self._data_start):
+                if count % ROWS_PER_BLOCK == 0:
+                    offsets.append(start)
+                count += 1
+                if len(row) > columns:
+                    columns = len(row)
+                if on_row is not None:
+                    on_row(row)
+                if count % ROWS_PER_BLOCK == 0:
+                    self._offsets = offsets
+                    self.row_count = count
+                    self.column_count = columns
+                    if progress is not None:
+                        progress(count, columns)
+                    if interrupted is not None and interrupted():
+                        return False
+        self._offsets = offsets
+        self.row_count = count
+        self.column_count = columns
+        self.indexed = True
+        if progress is not None:
+            progress(count, columns)
+        return True
+
+    def iter_rows(self, start: int = 0) -> Iterator[list[str]]:
+        """Streams the data rows from row start on, each as read (not padded).
+        Starting from row 0 works before the file is indexed."""
+        block, skip = divmod(start, ROWS_PER_BLOCK)
+        if block == 0:
+            pos = self._data_start
+        elif block < len(self._offsets):
+            pos = self._offsets[block]
+        else:
+            return
+        with open(self.path, "rb") as f:
+            for _, row in self._rows_from(f, pos):
+                if skip:
+                    skip -= 1
+                    continue
+                yield row
+
+    def read_block(self, block: int) -> list[list[str]]:
+        """The rows of one block, padded to column_count, from a small LRU
+        cache. Only blocks already indexed can be read."""
+        rows = self._blocks.get(block)
+        if rows is not None:
+            self._blocks.move_to_end(block)
+            return rows
+
+        rows = []
+        if block < len(self._offsets):
+            with open(self.path, "rb") as f:
+                for _, row in self._rows_from(f, self._offsets[block]):
+                    rows.append(row + [""] * (self.column_count - len(row)))
+                    if len(rows) == ROWS_PER_BLOCK:
+                        break
+        # The last block may still be growing while the file is indexed
+        if self.indexed or len(rows) == ROWS_PER_BLOCK:
+            self._blocks[block] = rows
+            if len(self._blocks) > CACHED_BLOCKS:
+                self._blocks.popitem(last=False)
+        return rows
+
+    def row(self, i: int) -> list[str]:
+        return self.read_block(i // ROWS_PER_BLOCK)[i % ROWS_PER_BLOCK]
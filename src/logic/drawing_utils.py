@@ -1,13 +1,27 @@
 import numpy as np
 from scipy.spatial import procrustes
+from scipy.optimize import linear_sum_assignment
 from numpy.typing import NDArray
+from logic.stroke_set import StrokeSet
 
 
 
-def interpolate_line(line: list[float], point_count: int) -> NDArray[np.float32]:
+def resample_strokes(strokes: StrokeSet | list[list[float]],
+                     point_count: int,
+                     arc_length: bool = False) -> NDArray[np.float64]:
+    """Resamples every stroke of a drawing to point_count points in one pass,
+    returning an (S, point_count, 2) array (see StrokeSet.resampled)"""
+    return StrokeSet.from_lists(strokes).resampled(point_count, arc_length=arc_length)
+
+
+
+def interpolate_line(line: list[float], point_count: int, arc_length: bool = False) -> NDArray[np.float32]:
     """Takes an alternating list of x and y values and returns a vector of
     2 * point_count values representing a stretched or compacted equivalent
     line"""
+    if arc_length:
+        return resample_strokes([line], point_count, arc_length=True)[0].astype(np.float32)
+
     x = np.array(line[0::2])
     y = np.array(line[1::2])
 
@@ -22,10 +36,14 @@ def interpolate_line(line: list[float], point_count: int) -> NDArray[np.float32]
 
 
 
-def process_strokes(strokes: list[list[float]], point_count: int=100, size=100) -> NDArray[np.float32]:
+def process_strokes(strokes: StrokeSet | list[list[float]],
+                    point_count: int=100,
+                    size=100,
+                    arc_length: bool = False) -> NDArray[np.float32]:
     """Maps a sequence of lines onto a 'size' X 'size' 2D space where each line is comprised
-    of point_count number of points or point_count * 2 x/y values."""
-    normalized = np.array([interpolate_line(line,point_count) for line in strokes])
+    of point_count number of points or point_count * 2 x/y values. arc_length
+    resamples by distance rather than by point index (see resample_strokes)."""
+    normalized = resample_strokes(strokes, point_count, arc_length=arc_length).astype(np.float32)
     mins = normalized.min(axis=(0,1))
     maxs = normalized.max(axis=(0,1))
     normalized = (normalized - mins) / (maxs - mins) * size
@@ -34,18 +52,63 @@ def process_strokes(strokes: list[list[float]], point_count: int=100, size=100)
 
 
 
-def stroke_diff(s1: list[list[float]] | NDArray,
-                s2: list[list[float]] | NDArray,
+def coarse_descriptor(strokes: list[list[float]],
+                      point_count: int=8,
+                      size=100,
+                      arc_length: bool = False) -> NDArray[np.float32]:
+    """Cheap low resolution stand-in for process_strokes used to prune template
+    searches. Each stroke is point_count resampled points followed by its
+    start to end vector, giving an (S, 2 * point_count + 2) array on the same
+    'size' X 'size' grid."""
+    coarse = process_strokes(strokes, point_count=point_count, size=size, arc_length=arc_length)
+    travel = coarse[:, -2:] - coarse[:, :2]
+    return np.concatenate([coarse, travel], axis=1)
+
+
+
+def drawing_descriptor(strokes: list[list[float]], point_count: int=64, size=100) -> NDArray[np.float32]:
+    """Stroke count independent outline of a drawing. Every stroke is resampled
+    to the same number of points, the strokes are joined in order and the
+    result is resampled to point_count points on a 'size' X 'size' grid,
+    returned flat as 2 * point_count values. Lets drawings from different
+    stroke count buckets be compared."""
+    joined = process_strokes(strokes, point_count=16, size=size).reshape(-1, 2)
+    old_lin = np.linspace(0, 1, joined.shape[0])
+    new_lin = np.linspace(0, 1, point_count)
+    out = np.empty((point_count, 2), dtype=np.float32)
+    out[:, 0] = np.interp(new_lin, old_lin, joined[:, 0])
+    out[:, 1] = np.interp(new_lin, old_lin, joined[:, 1])
+    return out.reshape(-1)
+
+
+
+def pairwise_diff_chunks(a: NDArray, b: NDArray, max_elements: int = 1 << 24):
+    """Yields (row_start, block) where block holds the stroke_diff between rows
+    row_start.. of 'a' and every row of 'b'. a is (T, ...) and b is (U, ...)
+    with matching trailing shapes; rows are taken in chunks so no broadcast
+    exceeds max_elements values."""
+    a2 = a.reshape(a.shape[0], -1)
+    b2 = b.reshape(b.shape[0], -1)
+    chunk = max(1, max_elements // max(1, b2.size))
+    for start in range(0, a2.shape[0], chunk):
+        block = np.abs(a2[start:start + chunk, None, :] - b2[None, :, :]).mean(axis=-1)
+        yield start, block
+
+
+
+def stroke_diff(s1: StrokeSet | list[list[float]] | NDArray,
+                s2: StrokeSet | list[list[float]] | NDArray,
                 point_count=100,
-                size=100) -> float:
+                size=100,
+                arc_length: bool = False) -> float:
     '''Finds the absoulte difference between every x and y value of two drawings
     and returns the mean'''
     
     # Normalize the collections of lines to be of similar shape
-    if isinstance(s1, list):
-        s1 = process_strokes(s1,point_count=point_count,size=size)
-    if isinstance(s2, list):
-        s2 = process_strokes(s2,point_count=point_count,size=size)
+    if isinstance(s1, (list, StrokeSet)):
+        s1 = process_strokes(s1,point_count=point_count,size=size,arc_length=arc_length)
+    if isinstance(s2, (list, StrokeSet)):
+        s2 = process_strokes(s2,point_count=point_count,size=size,arc_length=arc_length)
     assert s1.shape == s2.shape
 
     dif = s1 - s2
@@ -54,12 +117,77 @@ def stroke_diff(s1: list[list[float]] | NDArray,
 
 
 
+def stroke_cost_matrix(s1: NDArray, s2: NDArray) -> NDArray[np.float32]:
+    """Takes two processed drawings of shape (S1, 2P) and (S2, 2P) and returns
+    the (S1, S2) matrix of mean absolute differences between every pair of
+    strokes. Leading batch dimensions on s1 broadcast, so a stack of
+    templates (T, S, 2P) yields (T, S, S2)."""
+    return np.abs(s1[..., :, None, :] - s2[..., None, :, :]).mean(axis=-1)
+
+
+
+def order_penalty(assignment: NDArray) -> float:
+    """Fraction of stroke pairs written in the opposite order to the template,
+    0 when the assignment is the identity and 1 when it is fully reversed"""
+    n = assignment.size
+    if n < 2:
+        return 0.0
+    inversions = np.triu(assignment[:, None] > assignment[None, :], 1).sum()
+    return float(inversions) / (n * (n - 1) / 2)
+
+
+
+def match_strokes(s1: StrokeSet | list[list[float]] | NDArray,
+                  s2: StrokeSet | list[list[float]] | NDArray,
+                  point_count=100,
+                  size=100,
+                  arc_length: bool = False) -> tuple[float, float]:
+    """Pairs the strokes of two drawings regardless of the order they were
+    written in and returns (shape_score, order_penalty). The shape score is
+    the stroke_diff of the optimally paired strokes."""
+    if isinstance(s1, (list, StrokeSet)):
+        s1 = process_strokes(s1,point_count=point_count,size=size,arc_length=arc_length)
+    if isinstance(s2, (list, StrokeSet)):
+        s2 = process_strokes(s2,point_count=point_count,size=size,arc_length=arc_length)
+    assert s1.shape == s2.shape
+
+    cost = stroke_cost_matrix(s1, s2)
+    rows, cols = linear_sum_assignment(cost)
+    return float(cost[rows, cols].mean()), order_penalty(cols)
+
+
+
+def match_strokes_batch(templates: NDArray,
+                        ps: NDArray,
+                        max_elements: int = 1 << 22) -> tuple[NDArray, NDArray]:
+    """Order independent matching of one processed drawing (S, 2P) against a
+    stack of processed templates (T, S, 2P) with the same stroke count.
+    Cost matrices are computed in chunks of templates so the broadcast never
+    holds more than max_elements values. Returns (shape_scores, order_penalties)
+    as arrays of length T."""
+    t, s, d = templates.shape
+    assert ps.shape == (s, d)
+
+    shapes = np.empty(t, dtype=np.float64)
+    orders = np.empty(t, dtype=np.float64)
+    chunk = max(1, max_elements // max(1, s * s * d))
+    for start in range(0, t, chunk):
+        costs = stroke_cost_matrix(templates[start:start + chunk], ps)
+        for i, cost in enumerate(costs, start):
+            rows, cols = linear_sum_assignment(cost)
+            shapes[i] = cost[rows, cols].mean()
+            orders[i] = order_penalty(cols)
+    return shapes, orders
+
+
+
 def compare_drawings(
     drawing1: list[list[float]],
     drawing2: list[list[float]],
     point_count: int = 100,
     size: int = 100,
-    stroke_order_weight: float = 0.5
+    stroke_order_weight: float = 0.5,
+    ignore_order: bool = False
 ) -> float:
     """
     Compares two drawings and returns a dissimilarity score where 0 is identical.
@@ -70,6 +198,8 @@ def compare_drawings(
     - Stroke ordering
     
     stroke_order_weight controls how much penalty is applied for differing stroke counts.
+    With ignore_order strokes are paired by an optimal assignment on their
+    shapes instead of by position.
     """
     strokes1 = process_strokes(drawing1, point_count, size)
     strokes2 = process_strokes(drawing2, point_count, size)
@@ -79,12 +209,15 @@ def compare_drawings(
     # Penalty for different number of strokes
     stroke_count_penalty = abs(n1 - n2) * stroke_order_weight
 
-    # Compare only the strokes we have in common, in order
+    # Compare only the strokes we have in common, in order unless told otherwise
     common_strokes = min(n1, n2)
+    pairs = zip(range(common_strokes), range(common_strokes))
+    if ignore_order and common_strokes > 0:
+        pairs = zip(*linear_sum_assignment(stroke_cost_matrix(strokes1, strokes2)))
     disparities = []
-    for i in range(common_strokes):
+    for i, j in pairs:
         s1 = strokes1[i].reshape(-1, 2)
-        s2 = strokes2[i].reshape(-1, 2)
+        s2 = strokes2[j].reshape(-1, 2)
         _, _, disparity = procrustes(s1, s2)
         disparities.append(disparity)
 
@@ -94,6 +227,38 @@ def compare_drawings(
     
 
 
+def k_medoids(dist: NDArray, k: int, max_iter: int = 50) -> NDArray[np.intp]:
+    """Sorted indices of up to k medoids of the items described by the square
+    distance matrix 'dist'. Starts from the most central item plus the
+    farthest-first picks and alternates assignment with medoid updates until
+    the medoids stop changing. Fewer than k come back when there are fewer
+    than k distinct items."""
+    n = dist.shape[0]
+    if k >= n:
+        return np.arange(n)
+
+    medoids = [int(np.argmin(dist.sum(axis=1)))]
+    while len(medoids) < k:
+        gaps = dist[:, medoids].min(axis=1)
+        if gaps.max() <= 0:
+            break
+        medoids.append(int(np.argmax(gaps)))
+    current = np.array(medoids)
+
+    for _ in range(max_iter):
+        labels = np.argmin(dist[:, current], axis=1)
+        updated = current.copy()
+        for c in range(current.size):
+            members = np.flatnonzero(labels == c)
+            if members.size:
+                updated[c] = members[np.argmin(dist[np.ix_(members, members)].sum(axis=1))]
+        if np.array_equal(updated, current):
+            break
+        current = updated
+    return np.sort(current)
+
+
+
 def bin_drawing_respose(
     drawing1: list[list[float]],
     drawing2: list[list[float]],
@@ -166,7 +331,7 @@ def bin_drawing_respose(
 
 
 
-def normalize_strokes(strokes: list[list[float]],
+def normalize_strokes(strokes: StrokeSet | list[list[float]],
                       width: float,
                       height: float,
                       pad: float = 12.0,
@@ -177,90 +342,10 @@ def normalize_strokes(strokes: list[list[float]],
 
     Input:  strokes = [[x0,y0,x1,y1,...], ...]
     Output: same structure, but mapped into target pixel space.
+    Use StrokeSet.normalized directly to stay in array form.
     """
-    if width <= 0 or height <= 0:
-        raise ValueError("width/height must be positive")
-
-    # Validate + gather arrays
-    arrays: list[np.ndarray] = []
-    total_pts = 0
-    for s in strokes:
-        if len(s) % 2 != 0:
-            raise ValueError("Each stroke must have even length: [x0,y0,x1,y1,...]")
-        if len(s) == 0:
-            arrays.append(np.empty((0, 2), dtype=np.float64))
-            continue
-        a = np.asarray(s, dtype=np.float64).reshape(-1, 2)  # (N,2)
-        arrays.append(a)
-        total_pts += a.shape[0]
-
-    if total_pts == 0:
-        return [list(s) for s in strokes]
-
-    # Stack for global bounds
-    all_pts = np.vstack([a for a in arrays if a.shape[0] > 0])  # (M,2)
-    minxy = all_pts.min(axis=0)
-    maxxy = all_pts.max(axis=0)
-    span = maxxy - minxy
-
-    # Drawable area
-    W = float(width)
-    H = float(height)
-    inner_w = max(1.0, W - 2.0 * pad)
-    inner_h = max(1.0, H - 2.0 * pad)
-
-    # Degenerate cases: all points same or line-ish
-    # We'll still scale by the non-degenerate axis if possible; otherwise center.
-    eps = 1e-12
-    span_x = float(span[0])
-    span_y = float(span[1])
-
-    if span_x < eps and span_y < eps:
-        cx = W * 0.5
-        cy = H * 0.5
-        out: list[list[float]] = []
-        for a in arrays:
-            if a.shape[0] == 0:
-                out.append([])
-            else:
-                b = np.empty_like(a)
-                b[:, 0] = cx
-                b[:, 1] = cy
-                out.append(b.reshape(-1).tolist())
-        return out
-
-    # Compute scale
-    if keep_aspect:
-        sx = inner_w / max(span_x, eps)
-        sy = inner_h / max(span_y, eps)
-        s = min(sx, sy)
-        sx = sy = s
-    else:
-        sx = inner_w / max(span_x, eps)
-        sy = inner_h / max(span_y, eps)
-
-    # Size after scaling (for centering)
-    draw_w = span_x * sx
-    draw_h = span_y * sy
-    ox = pad + (inner_w - draw_w) * 0.5
-    oy = pad + (inner_h - draw_h) * 0.5
-
-    out_strokes: list[list[float]] = []
-    for a in arrays:
-        if a.shape[0] == 0:
-            out_strokes.append([])
-            continue
-
-        b = a.copy()
-        b[:, 0] = (b[:, 0] - minxy[0]) * sx
-        b[:, 1] = (b[:, 1] - minxy[1]) * sy
-
-        if flip_y:
-            b[:, 1] = draw_h - b[:, 1]
-
-        b[:, 0] += ox
-        b[:, 1] += oy
-
-        out_strokes.append(b.reshape(-1).tolist())
-
-    return out_strokes
+    return StrokeSet.from_lists(strokes).normalized(width,
+                                                    height,
+                                                    pad=pad,
+                                                    keep_aspect=keep_aspect,
+                                                    flip_y=flip_y).to_lists()
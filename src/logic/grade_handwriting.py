@@ -1,26 +1,74 @@
+from dataclasses import dataclass
 from data import Drawing
 
-def grade_strokes(s: list[list[float]], target_glyph: str, top_n: int = 20) -> int:
+# Grid units added per unit of order penalty (the fraction of stroke pairs
+# written in the opposite order) when grading ignores stroke order. Small
+# next to a wrong shape, so order only breaks ties between close templates.
+DEFAULT_ORDER_WEIGHT = 2.0
+
+@dataclass(frozen=True)
+class StrokeGrade:
+    '''The grade of grade_strokes with how it was reached. rank is that of the
+    target's closest template; shape_score (in grid units) and order_penalty
+    (0 to 1, see drawing_utils.match_strokes) are those of that template and
+    only known when the search scored it, i.e. not on the positional fast
+    path or when the target was not among the top_n.'''
+    grade: int
+    rank: int | None = None
+    shape_score: float | None = None
+    order_penalty: float | None = None
+
+    @property
+    def details(self) -> str:
+        '''A line for the learner describing the scores, empty when unknown'''
+        if self.shape_score is None:
+            return ''
+        text = f'Shape score {self.shape_score:.1f}'
+        if self.order_penalty:
+            text += f', {self.order_penalty:.0%} of stroke pairs out of order'
+        return text
+
+def _grade_from_rank(rank: int | None, top_n: int) -> int:
+    if rank is None or rank >= top_n:
+        return 2
+    if top_n == 1 or rank < top_n//2:
+        return 0
+    return 1
+
+def grade_strokes_detailed(s: list[list[float]],
+                           target_glyph: str,
+                           top_n: int = 20,
+                           ignore_order: bool = False,
+                           order_weight: float = DEFAULT_ORDER_WEIGHT,
+                           exhaustive: bool = False) -> StrokeGrade:
+    '''grade_strokes, along with the rank and scores of the target's closest
+    template (see StrokeGrade)'''
     assert top_n >= 1
-    canidates = [d.glyph for d in Drawing.by_strokes_fuzzy(s,top_n)]
-
- 
-    if top_n == 1:
-        if target_glyph in canidates:
-            return 0
-        else:
-            return 2
-    elif top_n == 2:
-        if target_glyph == canidates[0]:
-            return 0
-        elif target_glyph == canidates[1]:
-            return 1
-        else:
-            return 2
-    else:
-        if target_glyph in canidates[:top_n//2]:
-            return 0
-        elif target_glyph in canidates[top_n//2:]:
-            return 1
-        else:
-            return 2
+    if not exhaustive and not ignore_order:
+        rank = Drawing.target_rank(s, target_glyph, top_n)
+        return StrokeGrade(_grade_from_rank(rank, top_n), rank)
+
+    scored = Drawing.by_strokes_fuzzy_scored(s,
+                                             top_n,
+                                             ignore_order=ignore_order,
+                                             order_weight=order_weight)
+    for rank, (d, shape, order) in enumerate(scored):
+        if d.glyph == target_glyph:
+            return StrokeGrade(_grade_from_rank(rank, top_n), rank, shape, order)
+    return StrokeGrade(_grade_from_rank(None, top_n))
+
+def grade_strokes(s: list[list[float]],
+                  target_glyph: str,
+                  top_n: int = 20,
+                  ignore_order: bool = False,
+                  order_weight: float = DEFAULT_ORDER_WEIGHT,
+                  exhaustive: bool = False) -> int:
+    '''0 when target_glyph is in the first half of the top_n closest templates,
+    1 in the second half, 2 when it is not among them (with top_n == 1, 0 or 2).
+
+    ignore_order grades the shape of the strokes regardless of the order
+    they were written in, order_weight then sets how much a wrong order
+    still counts against the learner (see Drawing.by_strokes_fuzzy).
+    Positional grading only scores the target's templates and their
+    confusable neighbors (Drawing.target_rank) unless exhaustive is set.'''
+    return grade_strokes_detailed(s, target_glyph, top_n, ignore_order, order_weight, exhaustive).grade
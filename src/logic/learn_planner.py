@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import heapq
+import threading
+from typing import Protocol, Sequence, TypeVar
+
+import sqlalchemy as sqla
+
+from data import Card, CardRelation, maybe_connection
+from data.database import card_table, card_relation_table, PHRASE_CARD_KIND
+
+
+class _HasCard(Protocol):
+    @property
+    def card(self) -> Card: ...
+
+
+_T = TypeVar("_T", bound=_HasCard)
+
+
+class LearnPlanner:
+    """The prerequisite graph of every saved card, for planning what to learn.
+
+    Loaded with two column-only queries on first use (every card's kind and
+    study state, every prerequisite relation), then kept current through the
+    Card and CardRelation sync listeners. Along with the edges it keeps, per
+    card, how many direct prerequisites are still unstudied, and a
+    topological order (prerequisites first) that is only rebuilt when a new
+    edge contradicts it. Questions about a card walk its ancestors or direct
+    dependents only, never the whole graph."""
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self) -> None:
+        self._loaded = False
+        self._prereqs: dict[int, set[int]] = {}
+        self._dependents: dict[int, set[int]] = {}
+        self._kind: dict[int, str] = {}
+        self._studied: set[int] = set()
+        # Unstudied direct prerequisites of each card, absent when 0
+        self._missing: dict[int, int] = {}
+        self._order: list[int] = []
+        self._rank: dict[int, int] = {}
+        self._order_stale = True
+        # Cards on a prerequisite cycle, placed after every other card
+        self._cyclic: set[int] = set()
+
+    # Loading ##################################################################
+
+    def ensure_loaded(self, con: sqla.Connection | None = None) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            R = card_relation_table
+            with maybe_connection(con) as con:
+                stmnt = sqla.select(card_table.c.id, card_table.c.kind, card_table.c.study_id)
+                for card_id, kind, study_id in con.execute(stmnt):
+                    self._kind[card_id] = kind
+                    if study_id is not None and study_id > 0:
+                        self._studied.add(card_id)
+                stmnt = sqla.select(R.c.card_a_id, R.c.card_b_id).where(R.c.b_is_prereq == True)
+                for a, b in con.execute(stmnt):
+                    self._add_edge(a, b)
+            self._order_stale = True
+            self._loaded = True
+
+    def reload(self) -> None:
+        with self._lock:
+            self._clear()
+
+    # Sync listeners ###########################################################
+
+    def on_card_synced(self, card: Card) -> None:
+        with self._lock:
+            if not self._loaded:
+                return
+            card_id = card.id
+            if card_id not in self._kind and not self._order_stale:
+                # A new card has no relations saved yet, so it can go last
+                self._rank[card_id] = len(self._order)
+                self._order.append(card_id)
+            self._kind[card_id] = card.kind
+
+            studied = card.study_id > 0
+            if studied == (card_id in self._studied):
+                return
+            if studied:
+                self._studied.add(card_id)
+            else:
+                self._studied.discard(card_id)
+            for d in self._dependents.get(card_id, ()):
+                self._adjust_missing(d, -1 if studied else 1)
+
+    def on_relation_synced(self, relation: CardRelation) -> None:
+        with self._lock:
+            if not self._loaded:
+                return
+            if relation.b_is_prereq:
+                self._add_edge(relation.card_a_id, relation.card_b_id)
+            else:
+                self._remove_edge(relation.card_a_id, relation.card_b_id)
+
+    # Graph upkeep #############################################################
+
+    def _adjust_missing(self, card_id: int, delta: int) -> None:
+        count = self._missing.get(card_id, 0) + delta
+        if count > 0:
+            self._missing[card_id] = count
+        else:
+            self._missing.pop(card_id, None)
+
+    def _add_edge(self, a: int, b: int) -> None:
+        prereqs = self._prereqs.setdefault(a, set())
+        if b in prereqs:
+            return
+        prereqs.add(b)
+        self._dependents.setdefault(b, set()).add(a)
+        if b not in self._studied:
+            self._adjust_missing(a, 1)
+
+        # The order still holds while b comes before a
+        if not self._order_stale:
+            rank_a = self._rank.get(a)
+            rank_b = self._rank.get(b)
+            if rank_a is None or rank_b is None or rank_b >= rank_a or a in self._cyclic:
+                self._order_stale = True
+
+    def _remove_edge(self, a: int, b: int) -> None:
+        prereqs = self._prereqs.get(a)
+        if prereqs is None or b not in prereqs:
+            return
+        prereqs.discard(b)
+        self._dependents[b].discard(a)
+        if b not in self._studied:
+            self._adjust_missing(a, -1)
+        # Dropping an edge keeps a topological order valid, unless it broke a
+        # cycle whose cards should now be placed properly
+        if a in self._cyclic:
+            self._order_stale = True
+
+    def _ensure_order(self) -> None:
+        """Kahn's algorithm, taking the lowest card id among the ready cards
+        so the order is stable between rebuilds"""
+        if not self._order_stale:
+            return
+        waiting = {c: len(self._prereqs.get(c, ()))
+                   for c in self._kind.keys() | self._prereqs.keys() | self._dependents.keys()}
+        ready = [c for c, n in waiting.items() if n == 0]
+        heapq.heapify(ready)
+        order: list[int] = []
+        while ready:
+            c = heapq.heappop(ready)
+            order.append(c)
+            for d in self._dependents.get(c, ()):
+                waiting[d] -= 1
+                if waiting[d] == 0:
+                    heapq.heappush(ready, d)
+        self._cyclic = {c for c, n in waiting.items() if n > 0}
+        order.extend(sorted(self._cyclic))
+        self._order = order
+        self._rank = {c: i for i, c in enumerate(order)}
+        self._order_stale = False
+
+    # Queries ##################################################################
+
+    def topological_order(self) -> list[int]:
+        """Every card id, each after all of its prerequisites"""
+        self.ensure_loaded()
+        with self._lock:
+            self._ensure_order()
+            return list(self._order)
+
+    def missing_prerequisites(self, card_id: int) -> list[int]:
+        """The smallest set of cards to study before card_id unlocks: its
+        unstudied prerequisites, theirs, and so on (a studied card's own
+        prerequisites no longer matter), in an order they can be learned"""
+        self.ensure_loaded()
+        with self._lock:
+            self._ensure_order()
+            return sorted(self._unstudied_ancestors(card_id), key=self._rank.__getitem__)
+
+    def _unstudied_ancestors(self, card_id: int) -> set[int]:
+        found: set[int] = set()
+        stack = [card_id]
+        while stack:
+            for p in self._prereqs.get(stack.pop(), ()):
+                if p not in self._studied and p not in found:
+                    found.add(p)
+                    stack.append(p)
+        return found
+
+    def unlock_value(self, card_id: int) -> int:
+        """Number of cards that studying card_id would unlock straight away:
+        unstudied dependents whose only unstudied prerequisite it is"""
+        self.ensure_loaded()
+        with self._lock:
+            if card_id in self._studied:
+                return 0
+            return sum(1 for d in self._dependents.get(card_id, ())
+                       if d not in self._studied and self._missing.get(d, 0) == 1)
+
+    def unlocked_by(self, card_id: int, kind: str | None = PHRASE_CARD_KIND, limit: int = 10) -> list[int]:
+        """Up to limit unstudied cards of kind (any kind when None) that
+        depend on card_id and would be unlocked by studying it along with its
+        missing prerequisites. Those that are prerequisites of the most other
+        cards come first, then by topological order."""
+        self.ensure_loaded()
+        with self._lock:
+            self._ensure_order()
+            plan = self._unstudied_ancestors(card_id)
+            plan.add(card_id)
+            found = []
+            for d in self._dependents.get(card_id, ()):
+                if d in self._studied or d in plan:
+                    continue
+                if kind is not None and self._kind.get(d) != kind:
+                    continue
+                if all(p in self._studied or p in plan for p in self._prereqs.get(d, ())):
+                    found.append(d)
+            found.sort(key=lambda d: (-len(self._dependents.get(d, ())), self._rank[d]))
+            return found[:limit]
+
+    def order_by_unlock_value(self, cards: Sequence[_T]) -> list[_T]:
+        """cards (anything with a .card) ordered so those unlocking the most
+        other cards come first, ties kept in topological order"""
+        self.ensure_loaded()
+        with self._lock:
+            self._ensure_order()
+            end = len(self._order)
+            return sorted(cards, key=lambda c: (-self.unlock_value(c.card.id),
+                                                self._rank.get(c.card.id, end)))
+
+
+_planner = LearnPlanner()
+Card.add_sync_listener(_planner.on_card_synced)
+CardRelation.add_sync_listener(_planner.on_relation_synced)
+
+
+def topological_order() -> list[int]:
+    return _planner.topological_order()
+
+
+def missing_prerequisites(card_id: int) -> list[int]:
+    return _planner.missing_prerequisites(card_id)
+
+
+def unlock_value(card_id: int) -> int:
+    return _planner.unlock_value(card_id)
+
+
+def unlocked_by(card_id: int, kind: str | None = PHRASE_CARD_KIND, limit: int = 10) -> list[int]:
+    return _planner.unlocked_by(card_id, kind, limit)
+
+
+def order_by_unlock_value(cards: Sequence[_T]) -> list[_T]:
+    return _planner.order_by_unlock_value(cards)
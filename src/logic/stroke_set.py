@@ -0,0 +1,267 @@
+from __future__ import annotations
+from typing import Iterator, Sequence
+import numpy as np
+from numpy.typing import NDArray
+
+
+
+class StrokeSet:
+    """A drawing held as one flat float32 (N, 2) point buffer plus an offsets
+    array of length S + 1, stroke i being points[offsets[i]:offsets[i + 1]].
+
+    Geometry (bounding box, normalizing, resampling) runs over every point of
+    every stroke at once. Iterating or indexing gives each stroke as a flat
+    [x0, y0, x1, y1, ...] view into the buffer, so a StrokeSet can be passed
+    wherever the list[list[float]] form is read, and to_lists converts back
+    with a single tolist call."""
+
+    __slots__ = ('points', 'offsets')
+
+    def __init__(self, points: NDArray[np.float32], offsets: NDArray[np.intp]):
+        assert points.ndim == 2 and points.shape[1] == 2
+        assert offsets[0] == 0 and offsets[-1] == points.shape[0]
+        self.points = points
+        self.offsets = offsets
+
+
+
+    # Conversions ##############################################################
+
+
+
+    @classmethod
+    def from_lists(cls, strokes: StrokeSet | Sequence[Sequence[float]]) -> StrokeSet:
+        """Builds a StrokeSet from [[x0, y0, x1, y1, ...], ...]. A StrokeSet is
+        returned unchanged."""
+        if isinstance(strokes, StrokeSet):
+            return strokes
+        lengths = np.empty(len(strokes), dtype=np.intp)
+        for i, s in enumerate(strokes):
+            if len(s) % 2 != 0:
+                raise ValueError("Each stroke must have even length: [x0,y0,x1,y1,...]")
+            lengths[i] = len(s) // 2
+        offsets = np.zeros(len(strokes) + 1, dtype=np.intp)
+        np.cumsum(lengths, out=offsets[1:])
+        if offsets[-1] == 0:
+            return cls(np.empty((0, 2), dtype=np.float32), offsets)
+        points = np.concatenate([np.asarray(s, dtype=np.float32) for s in strokes])
+        return cls(points.reshape(-1, 2), offsets)
+
+
+
+    def to_lists(self) -> list[list[float]]:
+        flat = self.points.reshape(-1).tolist()
+        return [flat[2 * a:2 * b] for a, b in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist())]
+
+
+
+    # Container protocol #######################################################
+
+
+
+    def __len__(self) -> int:
+        return self.offsets.size - 1
+
+
+
+    def __getitem__(self, i: int) -> NDArray[np.float32]:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.points[self.offsets[i]:self.offsets[i + 1]].reshape(-1)
+
+
+
+    def __iter__(self) -> Iterator[NDArray[np.float32]]:
+        flat = self.points.reshape(-1)
+        for a, b in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist()):
+            yield flat[2 * a:2 * b]
+
+
+
+    # Properties ###############################################################
+
+
+
+    @property
+    def lengths(self) -> NDArray[np.intp]:
+        """Number of points in each stroke"""
+        return np.diff(self.offsets)
+
+
+
+    @property
+    def point_count(self) -> int:
+        return self.points.shape[0]
+
+
+
+    # Geometry #################################################################
+
+
+
+    def stroke_index(self) -> NDArray[np.intp]:
+        """Index of the stroke each point belongs to"""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+
+
+    def bbox(self) -> tuple[NDArray[np.float32], NDArray[np.float32]]:
+        """(min_xy, max_xy) over every point, raises ValueError when empty"""
+        if self.point_count == 0:
+            raise ValueError("An empty StrokeSet has no bounding box")
+        return self.points.min(axis=0), self.points.max(axis=0)
+
+
+
+    def scaled(self, sx: float, sy: float) -> StrokeSet:
+        return StrokeSet(self.points * np.array([sx, sy], dtype=np.float32), self.offsets)
+
+
+
+    def resampled(self, point_count: int, arc_length: bool = False) -> NDArray[np.float64]:
+        """Resamples every stroke to point_count points in one pass, returning
+        an (S, point_count, 2) array. By default points are spread evenly over
+        the original point indices; with arc_length they are spread evenly over
+        the distance travelled, so the speed the pen moved at no longer changes
+        the point density.
+
+        All strokes are interpolated together on a single parameter u = 2 * i + t,
+        where i is the stroke index and t runs from 0 to 1 along the stroke. The
+        gap of 1 between strokes keeps neighbouring strokes from blending."""
+        lengths = self.lengths
+        pts = self.points.astype(np.float64)
+
+        starts = self.offsets[:-1]
+        stroke_of = self.stroke_index()
+        local = np.arange(pts.shape[0]) - starts[stroke_of]
+        spans = np.maximum(lengths - 1, 1)[stroke_of]
+        t = local / spans
+
+        if arc_length:
+            seg = np.zeros(pts.shape[0])
+            seg[1:] = np.hypot(*(pts[1:] - pts[:-1]).T)
+            seg[starts[lengths > 0]] = 0.0
+            travelled = np.cumsum(seg)
+            # an empty last stroke starts one past the final point
+            travelled -= travelled[np.minimum(starts, pts.shape[0] - 1)][stroke_of]
+            totals = travelled[np.maximum(starts + lengths - 1, 0)]
+            moving = totals[stroke_of] > 0
+            t = np.where(moving, travelled / np.where(moving, totals[stroke_of], 1.0), t)
+
+        u = 2.0 * stroke_of + t
+        # single point strokes have nothing to interpolate towards
+        reach = (lengths > 1).astype(np.float64)[:, None]
+        targets = 2.0 * np.arange(lengths.size)[:, None] + np.linspace(0, 1, point_count)[None, :] * reach
+        flat = targets.reshape(-1)
+        out = np.empty((flat.size, 2))
+        out[:, 0] = np.interp(flat, u, pts[:, 0])
+        out[:, 1] = np.interp(flat, u, pts[:, 1])
+        return out.reshape(lengths.size, point_count, 2)
+
+
+
+    def simplified(self, epsilon: float, max_points: int | None = None) -> StrokeSet:
+        """Drops points that lie within epsilon of the polyline through the
+        points kept (see simplify_mask); strokes still longer than max_points
+        are then resampled by arc length down to max_points"""
+        kept: list[NDArray[np.float32]] = []
+        for a, b in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist()):
+            pts = self.points[a:b]
+            if epsilon > 0:
+                pts = pts[simplify_mask(pts, epsilon)]
+            if max_points is not None and pts.shape[0] > max_points:
+                one = StrokeSet(pts, np.array([0, pts.shape[0]], dtype=np.intp))
+                pts = one.resampled(max_points, arc_length=True)[0].astype(np.float32)
+            kept.append(pts)
+        offsets = np.zeros(len(kept) + 1, dtype=np.intp)
+        np.cumsum([k.shape[0] for k in kept], out=offsets[1:])
+        points = np.concatenate(kept) if kept else np.empty((0, 2), dtype=np.float32)
+        return StrokeSet(points, offsets)
+
+
+
+    def normalized(self,
+                   width: float,
+                   height: float,
+                   pad: float = 12.0,
+                   keep_aspect: bool = True,
+                   flip_y: bool = False) -> StrokeSet:
+        """Maps the drawing into [pad..width-pad] x [pad..height-pad], centered.
+        A drawing collapsed to a single point is placed at the center."""
+        if width <= 0 or height <= 0:
+            raise ValueError("width/height must be positive")
+        if self.point_count == 0:
+            return self
+
+        W = float(width)
+        H = float(height)
+        inner_w = max(1.0, W - 2.0 * pad)
+        inner_h = max(1.0, H - 2.0 * pad)
+
+        pts = self.points.astype(np.float64)
+        minxy = pts.min(axis=0)
+        span = pts.max(axis=0) - minxy
+
+        eps = 1e-12
+        span_x = float(span[0])
+        span_y = float(span[1])
+        if span_x < eps and span_y < eps:
+            out = np.empty_like(self.points)
+            out[:] = (W * 0.5, H * 0.5)
+            return StrokeSet(out, self.offsets)
+
+        sx = inner_w / max(span_x, eps)
+        sy = inner_h / max(span_y, eps)
+        if keep_aspect:
+            sx = sy = min(sx, sy)
+
+        # Size after scaling (for centering)
+        draw_w = span_x * sx
+        draw_h = span_y * sy
+        ox = pad + (inner_w - draw_w) * 0.5
+        oy = pad + (inner_h - draw_h) * 0.5
+
+        pts -= minxy
+        pts *= (sx, sy)
+        if flip_y:
+            pts[:, 1] = draw_h - pts[:, 1]
+        pts += (ox, oy)
+        return StrokeSet(pts.astype(np.float32), self.offsets)
+
+
+
+
+def simplify_mask(points: NDArray, epsilon: float) -> NDArray[np.bool_]:
+    """Ramer-Douglas-Peucker on one stroke's (N, 2) points: a mask of the points
+    to keep so no dropped point is further than epsilon from the simplified
+    polyline. The recursion is unrolled onto a stack and each split measures
+    every point of its span at once."""
+    n = points.shape[0]
+    keep = np.zeros(n, dtype=bool)
+    if n < 3:
+        keep[:] = True
+        return keep
+    keep[0] = keep[-1] = True
+
+    pts = points.astype(np.float64)
+    spans = [(0, n - 1)]
+    while spans:
+        a, b = spans.pop()
+        if b - a < 2:
+            continue
+        chord = pts[b] - pts[a]
+        rel = pts[a + 1:b] - pts[a]
+        length = float(np.hypot(*chord))
+        if length > 0:
+            dist = np.abs(chord[0] * rel[:, 1] - chord[1] * rel[:, 0]) / length
+        else:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        i = int(np.argmax(dist))
+        if dist[i] > epsilon:
+            m = a + 1 + i
+            keep[m] = True
+            spans.append((a, m))
+            spans.append((m, b))
+    return keep
@@ -2,15 +2,44 @@
 
 #### IMPORTS ###################################################################
 import sys
+from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QFont
-from PyQt6.QtWidgets import QApplication
+from PyQt6.QtWidgets import QApplication, QProgressDialog
+from data import migrate
 from gui.main_window import MainWindow
 from gui.theme_manager import ThemeManager
 
+#### DATABASE SETUP ############################################################
+
+def migrate_database(app: QApplication) -> None:
+    """Brings the database up to date before any page queries it, showing a
+    progress dialog while a migration runs."""
+    dialog: QProgressDialog | None = None
+
+    def progress(description: str, done: int, total: int) -> None:
+        nonlocal dialog
+        if dialog is None:
+            dialog = QProgressDialog(description, "", 0, total)
+            dialog.setWindowTitle("Updating database")
+            dialog.setCancelButton(None)
+            dialog.setWindowModality(Qt.WindowModality.ApplicationModal)
+            dialog.setMinimumDuration(0)
+        dialog.setLabelText(description)
+        dialog.setMaximum(total)
+        dialog.setValue(done)
+        app.processEvents()
+
+    try:
+        migrate(progress)
+    finally:
+        if dialog is not None:
+            dialog.close()
+
 #### PROGRAM ENTRY POINT #######################################################
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
+    migrate_database(app)
     tm = ThemeManager(app)
     w = MainWindow(tm)
     #w.show()
@@ -0,0 +1,31 @@
+# Checks StrokeSet.resampled on the edge cases the vectorised version has to
+# handle without a per stroke loop.
+#
+# Run with: python -m pytest tests (from src)
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logic.stroke_set import StrokeSet  # noqa: E402
+
+
+def test_arc_length_allows_empty_last_stroke():
+    strokes = StrokeSet.from_lists([[0, 0, 1, 1, 2, 2], []])
+    for arc_length in (False, True):
+        out = strokes.resampled(3, arc_length=arc_length)
+        assert out.shape == (2, 3, 2)
+        np.testing.assert_allclose(out[0], [[0, 0], [1, 1], [2, 2]])
+
+
+def test_arc_length_ignores_pen_speed():
+    # Most of the points bunch up near the start of the stroke
+    strokes = StrokeSet.from_lists([[0, 0, 0.1, 0, 0.2, 0, 0.3, 0, 4, 0], [5, 5], []])
+    by_index = strokes.resampled(5)
+    by_arc = strokes.resampled(5, arc_length=True)
+    np.testing.assert_allclose(by_arc[0, :, 0], [0, 1, 2, 3, 4], atol=1e-9)
+    assert not np.allclose(by_index[0, :, 0], by_arc[0, :, 0])
+    np.testing.assert_allclose(by_arc[1], [[5, 5]] * 5)
@@ -0,0 +1,145 @@
+# Exercises UnitOfWork.flush against a throwaway SQLite file, so
+# data/db.sqlite3 is never touched. Every test makes its own cards, with
+# characters no other test uses, since the wrapper caches outlive a test.
+#
+# Run with: python -m pytest tests (from src)
+
+import os
+import sys
+from datetime import date
+
+import pytest
+import sqlalchemy as sqla
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from data import (Card, Drawing, KanaCard, KanjiCard, UnitOfWork,  # noqa: E402
+                  database, maybe_connection_commit, migrate, read_connection)
+from data.database import card_table, card_relation_table, kanji_card_table  # noqa: E402
+
+
+@pytest.fixture(scope="module", autouse=True)
+def temp_database(tmp_path_factory):
+    saved = (database._db_path, database._backup_dir)
+    database.use_database(str(tmp_path_factory.mktemp("db") / "db.sqlite3"))
+    migrate()
+    yield
+    database.use_database(*saved)
+
+
+def _kanji_row(kanji):
+    with read_connection() as con:
+        return con.execute(sqla.select(kanji_card_table)
+                           .where(kanji_card_table.c.kanji == kanji)).mappings().one_or_none()
+
+
+def _count(table):
+    with read_connection() as con:
+        return con.execute(sqla.select(sqla.func.count()).select_from(table)).scalar_one()
+
+
+def test_insert_and_update_in_one_flush():
+    old = KanjiCard.create("猫", on_yomi="びょう", meaning="cat", require_relationships=False)
+    old.sync()
+    old.meaning = "kitty"
+    old.card.due_date_increment = 4
+    new = KanjiCard.create("犬", on_yomi="けん", meaning="dog", require_relationships=False)
+
+    UnitOfWork([old, new]).flush()
+
+    assert old.synced and new.synced and new.card.synced
+    assert new.id > 0 and new.card.id > 0
+    assert KanjiCard.by_kanji("犬") is new
+    assert KanjiCard.by_card_id(new.card.id) is new
+    assert Card.by_id(new.card.id) is new.card
+    assert _kanji_row("猫")["meaning"] == "kitty"
+    assert _kanji_row("犬")["card_id"] == new.card.id
+    with read_connection() as con:
+        increment = con.execute(sqla.select(card_table.c.due_date_increment)
+                                .where(card_table.c.id == old.card.id)).scalar_one()
+    assert increment == 4
+
+
+def test_failed_flush_restores_ids_and_caches():
+    kana = KanaCard.create("ぬ", "nu")
+    kana.sync()
+    first = KanjiCard.create("鳥", kun_yomi="ぬ")
+    second = KanjiCard.create("魚", kun_yomi="ぬ")
+    objs = [first, first.card, second, second.card]
+    temp_ids = [o.id for o in objs]
+    rows_before = (_count(card_table), _count(card_relation_table), _count(kanji_card_table))
+
+    # A row the wrappers know nothing about makes the kanji_cards INSERT fail
+    # after the cards and relations were already written
+    with maybe_connection_commit(None) as con:
+        card_id = con.execute(sqla.insert(card_table).values(
+            due_date_increment=0, due_date=date.today(), kind="kanji")).inserted_primary_key[0]
+        con.execute(sqla.insert(kanji_card_table).values(card_id=card_id, kanji="魚"))
+    rows_before = (rows_before[0] + 1, rows_before[1], rows_before[2] + 1)
+
+    with pytest.raises(sqla.exc.IntegrityError):
+        UnitOfWork([first, second]).flush()
+
+    assert [o.id for o in objs] == temp_ids
+    assert not any(o.synced for o in objs)
+    assert KanjiCard.by_kanji("鳥") is first
+    assert KanjiCard.by_card_id(first.card.id) is first
+    assert Card.by_id(first.card.id) is first.card
+    assert KanaCard.by_kana("ぬ") is kana
+    assert first.card.prerequisites == [kana.card]
+    assert (_count(card_table), _count(card_relation_table), _count(kanji_card_table)) == rows_before
+
+    # Once the conflict is gone the same objects save exactly once
+    with maybe_connection_commit(None) as con:
+        con.execute(sqla.delete(kanji_card_table).where(kanji_card_table.c.card_id == card_id))
+        con.execute(sqla.delete(card_table).where(card_table.c.id == card_id))
+    UnitOfWork([first, second]).flush()
+
+    assert all(o.id > 0 and o.synced for o in objs)
+    assert _count(card_table) == rows_before[0] - 1 + 2
+    assert _count(card_relation_table) == rows_before[1] + 2
+    assert _kanji_row("魚")["card_id"] == second.card.id
+
+
+def test_kanji_card_chain_is_saved_in_dependency_order():
+    kanji = KanjiCard.create("雨", on_yomi="う", meaning="rain", require_relationships=False)
+    drawing = Drawing.create([[0, 0, 1, 1, 2, 2], [0, 2, 2, 0]], "雨")
+    kanji.drawing = drawing
+    assert kanji.card.id < 1 and drawing.id < 1
+
+    UnitOfWork([kanji]).flush()
+
+    assert kanji.card.synced and drawing.synced
+    assert kanji.card.id > 0 and drawing.id > 0
+    assert Drawing.by_id(drawing.id) is drawing
+    row = _kanji_row("雨")
+    assert row["card_id"] == kanji.card.id
+    assert row["drawing_id"] == drawing.id
+
+
+def test_unlocked_follows_prerequisite_study_id():
+    kana = KanaCard.create("ろ", "ro")
+    kanji = KanjiCard.create("炉", on_yomi="ろ")
+    # Saves the kana's card through the prerequisite relation, but not the
+    # KanaCard, whose maps are keyed on that card's id
+    kanji.sync()
+    assert kana.card.id > 0 and kana.id < 1
+    assert KanaCard.by_card_id(kana.card.id) is kana
+    assert kana.card.study_id < 1
+    assert not kanji.card.unlocked
+
+    def stored_unlocked():
+        with read_connection() as con:
+            return con.execute(sqla.select(card_table.c.unlocked)
+                               .where(card_table.c.id == kanji.card.id)).scalar_one()
+
+    kana.card.study_id = 1
+    UnitOfWork([kana]).flush()
+    assert kanji.card.unlocked
+    assert stored_unlocked()
+
+    kana.card.study_id = 0
+    UnitOfWork([kana]).flush()
+    assert not kanji.card.unlocked
+    assert not stored_unlocked()
+    assert Card.check_unlocked(repair=False) == 0
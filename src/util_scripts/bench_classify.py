@@ -0,0 +1,113 @@
+################################################################################
+# Imports
+################################################################################
+
+import argparse
+import time
+import numpy as np
+from data import helpers
+
+################################################################################
+# Function Definitions
+################################################################################
+
+
+
+def _random_texts(count: int, length: int, rng: np.random.Generator) -> list[str]:
+    '''Phrase-like strings: mostly kana and kanji with some latin letters,
+    digits and punctuation'''
+    pools = [np.arange(0x3041, 0x3097), np.arange(0x30A1, 0x30FB),
+             np.arange(0x4E00, 0x9FB0), np.array([ord(c) for c in 'abcxyz0123 。、「」'])]
+    weights = [0.45, 0.1, 0.35, 0.1]
+    texts = []
+    for _ in range(count):
+        n = int(rng.integers(max(1, length // 2), length * 3 // 2 + 1))
+        picks = rng.choice(len(pools), size=n, p=weights)
+        texts.append(''.join(chr(int(rng.choice(pools[p]))) for p in picks))
+    return texts
+
+
+
+def _original_is_kana(ch: str) -> bool:
+    '''is_kana as it was before the character classes, for the baseline'''
+    if len(ch) != 1:
+        return False
+    code = ord(ch)
+    return 0x3040 <= code <= 0x309F or 0x30A0 <= code <= 0x30FF
+
+
+
+def _original_is_kanji(ch: str) -> bool:
+    if len(ch) != 1:
+        return False
+    code = ord(ch)
+    return 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF
+
+
+
+def _timed(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(
+        description="Per character is_kana/is_kanji loops versus the string "
+                    "and batch classification helpers.")
+    ap.add_argument("--count", type=int, default=20000)
+    ap.add_argument("--length", type=int, default=12)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--extended", action="store_true",
+                    help="count the extended CJK blocks as kanji, the baseline "
+                         "then loops over the configurable is_kana/is_kanji")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    texts = _random_texts(args.count, args.length, np.random.default_rng(args.seed))
+    is_kana, is_kanji = _original_is_kana, _original_is_kanji
+    if args.extended:
+        helpers.set_kanji_ranges(helpers.DEFAULT_KANJI_RANGES + helpers.EXTENDED_KANJI_RANGES)
+        is_kana, is_kanji = helpers.is_kana, helpers.is_kanji
+
+    def loop_sets():
+        kana, kanji = set(), set()
+        for t in texts:
+            kana.update(c for c in t if is_kana(c))
+            kanji.update(c for c in t if is_kanji(c))
+        return kana, kanji
+
+    def loop_lists():
+        return [[c for c in t if is_kana(c) or is_kanji(c)] for t in texts]
+
+    def loop_has_kanji():
+        return [any(is_kanji(c) for c in t) for t in texts]
+
+    def loop_masks():
+        return [[2 if is_kanji(c) else 1 if is_kana(c) else 0 for c in t] for t in texts]
+
+    cases = [
+        ("distinct kana/kanji", loop_sets, lambda: helpers.glyph_sets(texts)),
+        ("kana+kanji per text", loop_lists, lambda: [helpers.japanese_in(t) for t in texts]),
+        ("has kanji per text", loop_has_kanji, lambda: [helpers.has_kanji(t) for t in texts]),
+        ("masks per text", loop_masks, lambda: helpers.char_masks(texts)),
+    ]
+    assert loop_sets() == helpers.glyph_sets(texts)
+    assert loop_lists() == [helpers.japanese_in(t) for t in texts]
+    assert [m.tolist() for m in helpers.char_masks(texts)] == loop_masks()
+
+    chars = sum(len(t) for t in texts)
+    print(f"{len(texts)} texts, {chars} characters, best of {args.repeat}")
+    print(f"{'case':<22} {'per char ms':>12} {'helper ms':>10} {'speedup':>8}")
+    for name, old, new in cases:
+        t_old = _timed(old, args.repeat)
+        t_new = _timed(new, args.repeat)
+        print(f"{name:<22} {1000 * t_old:>12.2f} {1000 * t_new:>10.2f} {t_old / t_new:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+################################################################################
+# Imports
+################################################################################
+
+import argparse
+import time
+import numpy as np
+from numpy.typing import NDArray
+from data import *
+from logic import drawing_utils as du
+
+################################################################################
+# Function Definitions
+################################################################################
+
+
+
+def _uneven_pen(strokes: list[list[float]], rng: np.random.Generator, noise: float) -> list[list[float]]:
+    '''Simulates tablet input for a template: each stroke is retraced at a
+    randomly varying speed, so points bunch up where the pen slows down, with
+    a random number of samples and per point jitter ('noise' is a fraction of
+    the drawing's extent)'''
+    dense = du.resample_strokes(strokes, 256, arc_length=True)
+    extent = float(np.ptp(dense.reshape(-1, 2), axis=0).max()) or 1.0
+    grid = np.linspace(0, 1, 256)
+    out = []
+    for stroke in dense:
+        n = int(rng.integers(12, 120))
+        speed = np.convolve(rng.gamma(0.6, 1.0, n + 8), np.ones(5) / 5, mode='same')[4:n + 4]
+        t = np.concatenate([[0.0], np.cumsum(speed)])[:n]
+        t /= t[-1] if t[-1] > 0 else 1.0
+        pts = np.stack([np.interp(t, grid, stroke[:, 0]), np.interp(t, grid, stroke[:, 1])], axis=1)
+        pts += rng.normal(0.0, noise * extent, pts.shape)
+        out.append(pts.reshape(-1).tolist())
+    return out
+
+
+
+def _rank(stack: NDArray, query: NDArray, target: int) -> int:
+    scores = np.abs(stack - query).mean(axis=(1, 2))
+    return int((scores < scores[target]).sum())
+
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(
+        description="Template matching accuracy and cost of index versus arc "
+                    "length resampling on simulated variable speed pen input.")
+    ap.add_argument("--samples", type=int, default=300)
+    ap.add_argument("--point-counts", type=int, nargs="+", default=[100, 64, 48, 32, 24, 16])
+    ap.add_argument("--top-n", type=int, default=10)
+    ap.add_argument("--noise", type=float, default=0.01)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    migrate()
+
+    rng = np.random.default_rng(args.seed)
+    buckets: dict[int, list[Drawing]] = {}
+    for d in Drawing.in_db():
+        buckets.setdefault(d.stroke_count, []).append(d)
+    drawings = [d for b in buckets.values() if len(b) > 1 for d in b]
+    if not drawings:
+        print("Not enough drawings in the database, import some with svg_to_strokes first")
+        return
+
+    picks = rng.choice(len(drawings), size=min(args.samples, len(drawings)), replace=False)
+    queries = [(drawings[i], _uneven_pen(drawings[i].strokes, rng, args.noise)) for i in picks]
+
+    print(f"{len(queries)} queries, top-1 and top-{args.top_n} accuracy")
+    print(f"{'points':>7} {'mode':>6} {'top-1':>7} {'top-n':>7} {'ms/query':>9}")
+    for point_count in args.point_counts:
+        for arc_length in (False, True):
+            stacks = {sc: np.stack([du.process_strokes(d.strokes, point_count, arc_length=arc_length) for d in b])
+                      for sc, b in buckets.items() if len(b) > 1}
+            top1 = topn = 0
+            elapsed = 0.0
+            for template, q in queries:
+                bucket = buckets[template.stroke_count]
+                start = time.perf_counter()
+                ps = du.process_strokes(q, point_count, arc_length=arc_length)
+                rank = _rank(stacks[template.stroke_count], ps, bucket.index(template))
+                elapsed += time.perf_counter() - start
+                top1 += rank == 0
+                topn += rank < args.top_n
+            mode = 'arc' if arc_length else 'index'
+            print(f"{point_count:>7} {mode:>6} {top1 / len(queries):>7.3f} {topn / len(queries):>7.3f} "
+                  f"{1000 * elapsed / len(queries):>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
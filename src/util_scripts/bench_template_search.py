@@ -0,0 +1,95 @@
+################################################################################
+# Imports
+################################################################################
+
+import argparse
+import time
+import numpy as np
+from data import *
+
+################################################################################
+# Function Definitions
+################################################################################
+
+
+
+def _perturb(strokes: list[list[float]], rng: np.random.Generator, noise: float) -> list[list[float]]:
+    '''Simulates a learner's attempt at a template: a random scale and offset
+    for the whole drawing plus per point jitter, 'noise' being a fraction of
+    the drawing's extent'''
+    pts = np.concatenate([np.asarray(s, dtype=np.float64) for s in strokes]).reshape(-1, 2)
+    extent = float(np.ptp(pts, axis=0).max()) or 1.0
+    scale = rng.uniform(0.8, 1.2, 2)
+    offset = rng.uniform(-extent, extent, 2)
+    out = []
+    for s in strokes:
+        a = np.asarray(s, dtype=np.float64).reshape(-1, 2)
+        a = a * scale + offset + rng.normal(0.0, noise * extent, a.shape)
+        out.append(a.reshape(-1).tolist())
+    return out
+
+
+
+def _timed_search(s: list[list[float]], top_n: int, factor: int, args: argparse.Namespace) -> tuple[list[Drawing], float]:
+    start = time.perf_counter()
+    res = Drawing.by_strokes_fuzzy(s,
+                                   top_n,
+                                   ignore_order=args.ignore_order,
+                                   shortlist_factor=factor,
+                                   coarse_point_count=args.coarse_point_count)
+    return res, time.perf_counter() - start
+
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(
+        description="Top-N recall and latency of the template search cascade "
+                    "against an exhaustive search over the drawings in the database.")
+    ap.add_argument("--samples", type=int, default=200,
+                    help="Number of drawings used as queries")
+    ap.add_argument("--top-n", type=int, default=20)
+    ap.add_argument("--factors", type=int, nargs="+", default=[2, 3, 4, 6, 8],
+                    help="Shortlist factors to compare")
+    ap.add_argument("--coarse-point-count", type=int, default=8)
+    ap.add_argument("--noise", type=float, default=0.03)
+    ap.add_argument("--ignore-order", action="store_true")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    migrate()
+
+    rng = np.random.default_rng(args.seed)
+    drawings = Drawing.in_db()
+    if not drawings:
+        print("No drawings in the database, import some with svg_to_strokes first")
+        return
+
+    picks = rng.choice(len(drawings), size=min(args.samples, len(drawings)), replace=False)
+    queries = [_perturb(drawings[i].strokes, rng, args.noise) for i in picks]
+
+    # warm the per bucket caches so only the search itself is timed
+    for q in queries:
+        _timed_search(q, args.top_n, 0, args)
+
+    exhaustive: list[set[int]] = []
+    base_time = 0.0
+    for q in queries:
+        res, t = _timed_search(q, args.top_n, 0, args)
+        exhaustive.append({d.id for d in res})
+        base_time += t
+    print(f"{len(queries)} queries over {len(drawings)} drawings, top {args.top_n}")
+    print(f"{'factor':>8} {'recall':>8} {'min':>8} {'ms/query':>10} {'speedup':>8}")
+    print(f"{'full':>8} {1.0:>8.4f} {1.0:>8.4f} {1000 * base_time / len(queries):>10.3f} {1.0:>8.2f}")
+
+    for factor in args.factors:
+        total_time = 0.0
+        recalls = []
+        for q, truth in zip(queries, exhaustive):
+            res, t = _timed_search(q, args.top_n, factor, args)
+            total_time += t
+            recalls.append(len(truth & {d.id for d in res}) / len(truth) if truth else 1.0)
+        print(f"{factor:>8} {np.mean(recalls):>8.4f} {min(recalls):>8.4f} "
+              f"{1000 * total_time / len(queries):>10.3f} {base_time / total_time:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+################################################################################
+# Imports
+################################################################################
+
+import argparse
+from data import *
+
+################################################################################
+# Function Definitions
+################################################################################
+
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(
+        description="Check the stored unlocked flag of every card against its prerequisites.")
+    ap.add_argument("--dry-run", action="store_true",
+                    help="Only count the cards that disagree, without rewriting them")
+    args = ap.parse_args()
+    migrate()
+
+    wrong = Card.check_unlocked(repair=not args.dry_run)
+    if args.dry_run:
+        print(f'{wrong} cards have a stale unlocked flag')
+    else:
+        print(f'{wrong} cards had a stale unlocked flag and were rebuilt')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+################################################################################
+# Imports
+################################################################################
+
+import argparse
+import time
+import numpy as np
+import sqlalchemy as sqla
+from numpy.typing import NDArray
+from data import *
+from data.database import glyph_confusable_bucket_table, glyph_confusable_table
+from logic import drawing_utils as du
+
+################################################################################
+# Function Definitions
+################################################################################
+
+
+
+def _merge_block(best: dict[str, dict[str, float]],
+                 row_glyphs: list[str],
+                 col_glyphs: list[str],
+                 block: NDArray,
+                 k: int) -> None:
+    '''Folds a block of template distances into the per glyph neighbor lists,
+    keeping the k nearest other glyphs (by their closest template) for each
+    row glyph'''
+    m = min(block.shape[1], 4 * k)
+    for r, g in enumerate(row_glyphs):
+        dists = block[r]
+        nearest = np.argpartition(dists, m - 1)[:m] if m < dists.size else np.arange(dists.size)
+        neighbors = best.setdefault(g, {})
+        for c in nearest:
+            ng = col_glyphs[c]
+            if ng == g:
+                continue
+            d = float(dists[c])
+            if d < neighbors.get(ng, np.inf):
+                neighbors[ng] = d
+        if len(neighbors) > k:
+            best[g] = dict(sorted(neighbors.items(), key=lambda kv: kv[1])[:k])
+
+
+
+def compute_confusables(k: int,
+                        point_count: int,
+                        max_elements: int) -> dict[str, list[tuple[str, float]]]:
+    '''Nearest k other glyphs for every glyph with a template. Templates with
+    the same stroke count are compared with stroke_diff at grading resolution;
+    templates one stroke apart are compared on drawing_descriptor so a miscounted
+    stroke still surfaces the neighbor.'''
+    buckets: dict[int, list[Drawing]] = {}
+    for d in Drawing.in_db():
+        if d.glyph:
+            buckets.setdefault(d.stroke_count, []).append(d)
+
+    full: dict[int, NDArray] = {}
+    outline: dict[int, NDArray] = {}
+    for sc, drawings in buckets.items():
+        full[sc] = np.stack([du.process_strokes(d.strokes, point_count=point_count) for d in drawings])
+        outline[sc] = np.stack([du.drawing_descriptor(d.strokes) for d in drawings])
+
+    best: dict[str, dict[str, float]] = {}
+    for sc in sorted(buckets):
+        start_time = time.perf_counter()
+        glyphs = [d.glyph for d in buckets[sc]]
+        for start, block in du.pairwise_diff_chunks(full[sc], full[sc], max_elements):
+            _merge_block(best, glyphs[start:start + block.shape[0]], glyphs, block, k)
+
+        if sc + 1 in buckets:
+            next_glyphs = [d.glyph for d in buckets[sc + 1]]
+            for start, block in du.pairwise_diff_chunks(outline[sc], outline[sc + 1], max_elements):
+                rows = glyphs[start:start + block.shape[0]]
+                _merge_block(best, rows, next_glyphs, block, k)
+                _merge_block(best, next_glyphs, rows, block.T, k)
+
+        print(f'{sc} strokes: {len(glyphs)} templates, {time.perf_counter() - start_time:.2f}s')
+
+    return {g: sorted(n.items(), key=lambda kv: kv[1]) for g, n in best.items()}
+
+
+
+def store_confusables(confusables: dict[str, list[tuple[str, float]]]) -> None:
+    '''Replaces the stored confusables, recording what each bucket held so
+    lookups can tell when a bucket has changed since'''
+    rows = [{'glyph': g, 'neighbor_glyph': ng, 'rank': rank, 'distance': dist}
+            for g, neighbors in confusables.items()
+            for rank, (ng, dist) in enumerate(neighbors)]
+    stroke_counts = {d.stroke_count for d in Drawing.in_db()}
+    sources = [{'stroke_count': sc, 'template_count': n, 'max_drawing_id': max_id}
+               for sc in sorted(stroke_counts)
+               for n, max_id in [Drawing.bucket_source(sc)]]
+    with maybe_connection_commit(None) as con:
+        con.execute(sqla.delete(glyph_confusable_table))
+        con.execute(sqla.delete(glyph_confusable_bucket_table))
+        if rows:
+            con.execute(sqla.insert(glyph_confusable_table), rows)
+        if sources:
+            con.execute(sqla.insert(glyph_confusable_bucket_table), sources)
+    Drawing.reload_confusable_glyphs()
+
+
+
+def mark_relations(confusables: dict[str, list[tuple[str, float]]], top: int) -> None:
+    '''Flags the 'top' nearest neighbors of every glyph as easily confused
+    card relations where both glyphs have a card'''
+    cards: dict[str, Card] = {}
+    for kc in KanaCard.every():
+        cards[kc.kana] = kc.card
+    for kc in KanjiCard.every():
+        cards[kc.kanji] = kc.card
+
+    changed: list[CardRelation] = []
+    seen: set[frozenset[str]] = set()
+    for g, neighbors in confusables.items():
+        if g not in cards:
+            continue
+        for ng, _ in neighbors[:top]:
+            pair = frozenset((g, ng))
+            if ng in cards and pair not in seen:
+                seen.add(pair)
+                r = CardRelation.specifc_relation(cards[ng].id, cards[g].id)
+                if r is None:
+                    r = cards[g].add_easily_confused(cards[ng])
+                else:
+                    r.easily_confused = True
+                if not r.synced:
+                    changed.append(r)
+
+    UnitOfWork(changed).flush()
+    print(f'{len(changed)} relations marked')
+
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(
+        description="Precompute the confusable neighbors of every glyph template.")
+    ap.add_argument("--k", type=int, default=40,
+                    help="Neighbors stored per glyph")
+    ap.add_argument("--point-count", type=int, default=100,
+                    help="Points per stroke, keep equal to the grading resolution")
+    ap.add_argument("--max-elements", type=int, default=1 << 24,
+                    help="Largest distance broadcast held in memory at once")
+    ap.add_argument("--mark-relations", type=int, default=0, metavar="TOP",
+                    help="Also flag the TOP nearest neighbors as easily confused cards")
+    args = ap.parse_args()
+    migrate()
+
+    confusables = compute_confusables(args.k, args.point_count, args.max_elements)
+    store_confusables(confusables)
+    print(f'{len(confusables)} glyphs stored')
+
+    if args.mark_relations > 0:
+        mark_relations(confusables, args.mark_relations)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,9 +6,11 @@
 from svgpathtools import svg2paths2, Path as SvgPath
 import argparse
 from pathlib import Path
+import time
 from typing import Generator
 import numpy as np
 from data import *
+from data.database import KANA_CARD_KIND
 
 ################################################################################
 # Function Definitions
@@ -79,37 +81,30 @@ def cmd_batch(args: argparse.Namespace) -> None:
     if args.limit and args.limit > 0:
         svgs = svgs[:args.limit]
 
-    kana = set([k.kana for k in KanaCard.every()])
-    kanji = set([k.kanji for k in KanjiCard.every()])
-
     changed: list[KanaCard | KanjiCard] = []
     
     for p in svgs:
         c = _char_from_filename(p)
-        if c not in kana and c not in kanji:
+        kind = GlyphIndex.kind(c) if c else None
+        if kind is None:
             continue
         
         strokes = svg_to_strokes(str(p), args.point_count)
 
-        if c in kana:
-            kc = KanaCard.by_kana(c)
-            assert kc
-            kc.drawing = Drawing.create(strokes, c)
-        elif c in kanji:
-            kc = KanjiCard.by_kanji(c)
-            assert kc
+        kc = GlyphIndex.kana_card(c) if kind == KANA_CARD_KIND else GlyphIndex.kanji_card(c)
+        assert kc
+        if kc.drawing is None:
             kc.drawing = Drawing.create(strokes, c)
         else:
-            continue
+            # Unchanged strokes leave the drawing synced and are not rewritten
+            kc.drawing.strokes = strokes
         print(c)
         changed.append(kc)
 
-    with maybe_connection_commit(None) as con:
-        total = len(changed)
-        count = 0
-        for c in changed:
-            print(f'{++count} / {total}')
-            c.sync(con=con)
+    pending = sum(1 for kc in changed if not kc.synced or (kc.drawing and not kc.drawing.synced))
+    start_time = time.perf_counter()
+    UnitOfWork(changed).flush()
+    print(f'Saved {pending} of {len(changed)} cards in {time.perf_counter() - start_time:.3f}s')
 
 def main() -> None:
     ap = argparse.ArgumentParser()
@@ -135,6 +130,7 @@ def main() -> None:
     ap_batch.set_defaults(func=cmd_batch)
 
     args = ap.parse_args()
+    migrate()
     args.func(args)
 
 